@@ -325,8 +325,12 @@ def send_mappack_patch(event)
   if flags.key?(:all)
     wrong = MappackScore.gold_check(mappack: flags.key?(:m))
     count = wrong.count
-    changed = wrong.count{ |s|
-      !!MappackScore.patch_score(s[2], nil, nil, nil, silent: true)
+    changed = 0
+    # Sorted by level, so that ntrace can simulate the scores of each one together
+    scores = MappackScore.where(id: wrong.map{ |s| s[2] }).order(:highscoreable_id, :id).select{ |s| s.demo&.demo }
+    sims = scores.lazy.map{ |s| NSim.new(s.highscoreable.dump_level, [s.demo.demo]) }
+    NSim.batch(sims, score_only: true){ |nsim, i|
+      changed += 1 if !!MappackScore.patch_score(scores[i].id, nil, nil, nil, silent: true, nsim: nsim)
     }
     Log.clear
     event << "Patched #{changed} / #{count} mappack scores successfully with ntrace."
@@ -1099,11 +1103,24 @@ def test_ntrace(event)
   klass = klass.select{ |l| l.tiles.flatten.any?{ |t| t > 33 } } if flags.key?(:glitchful)
   count = klass.count
 
-  # Execute test
-  results = klass.each_with_index.map{ |l, i|
+  # Execute test, running all simulations in a single ntrace batch. They're
+  # built as they're sent, and a level that fails to build is only left as nil
+  results = {}
+  names = []
+  sims = klass.lazy.filter_map do |l|
+    nsim = l.map.ntrace_test
+    results[l.name] = Map.ntrace_result(nsim)
+    names << l.name if nsim
+    nsim
+  rescue => e
+    lex(e, 'ntrace testing failed')
+    results[l.name] = nil
+    nil
+  end
+  NSim.batch(sims, basic_sim: false, basic_render: false){ |nsim, i|
     dbg("Testing ntrace on level #{i + 1} / #{count}...", progress: true)
-    [l.name, l.map.test_ntrace]
-  }.to_h
+    results[names[i]] = Map.ntrace_result(nsim)
+  }
   Log.clear
   log("Finished testing ntrace")
   good  = results.select{ |k, v| v == :good  }.to_h
@@ -232,11 +232,12 @@ DIR_SOURCE      = 'src'
 
 DIR_TEST        = 'test'
 
-DIR_UTILS       = 'util'
-DIR_FONTS       = "#{DIR_UTILS}/fonts"
-PATH_NTRACE     = "#{DIR_UTILS}/ntrace/ntrace.py"
-PATH_STEAM_AUTH = "#{DIR_UTILS}/auth.py"
-PATH_STEAM_KEY  = "#{DIR_UTILS}/steam.pem"
+DIR_UTILS         = 'util'
+DIR_FONTS         = "#{DIR_UTILS}/fonts"
+PATH_NTRACE       = "#{DIR_UTILS}/ntrace/ntrace.py"
+PATH_NTRACE_CACHE = "#{DIR_UTILS}/ntrace/cache"
+PATH_STEAM_AUTH   = "#{DIR_UTILS}/auth.py"
+PATH_STEAM_KEY    = "#{DIR_UTILS}/steam.pem"
 
 FILENAME_MAPPACK_AUTHORS = 'AUTHORS'
 FILENAME_MAPPACK_SCORES  = 'SCORES'
@@ -303,13 +304,9 @@ ANIM_PROGRESS_UPDATE = 2     # Seconds between progress bar updates
 
 FEATURE_NTRACE  = true # Enable SimVYo's ntrace tool (requires Python 3)
 FEATURE_ANIMATE = true # Enable animation for traces
-
-NTRACE_MAP_DATA   = 'map_data'
-NTRACE_MAP_DATA_E = "map_data_%s"
-NTRACE_INPUTS     = "inputs_%s"
-NTRACE_INPUTS_E   = 'inputs_episode'
-NTRACE_OUTPUT     = 'output.bin'
-NTRACE_OUTPUT_E   = 'output.txt'
+NTRACE_JOBS     = 0    # Processes to run batches of simulations in parallel (0 = all cores)
+NTRACE_CACHE    = 256  # Max size of the simulation result cache in MB (0 = disabled)
+NTRACE_COMPACT  = false # Request traces in the compact format (delta encoded and compressed)
 
 # <---------------------------------------------------------------------------->
 # <------                  MONKEY PATCHING VARIABLES                     ------>
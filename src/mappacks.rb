@@ -1202,7 +1202,7 @@ class MappackScore < ActiveRecord::Base
     # Conmpute fractional score using NSim
     patched = false
     if frac
-      sim_res = NSim.run(h.dump_level, [Demo.encode(demos)]){ |nsim|
+      sim_res = NSim.run(h.dump_level, [Demo.encode(demos)], score_only: true){ |nsim|
         { score: nsim.score, frac: nsim.frac }
       }
       fraction = sim_res[:frac] || 1
@@ -1418,7 +1418,8 @@ class MappackScore < ActiveRecord::Base
   # - A player and a highscoreable, in which case, his current hs PB will be taken
   # - An ID, in which case that specific score will be chosen
   # It performs score validation via gold check before changing it
-  def self.patch_score(id, highscoreable, player, score, silent: false, frac: false, output: nil)
+  # The score can also be taken from an NSim object that already simulated the demo
+  def self.patch_score(id, highscoreable, player, score, silent: false, frac: false, output: nil, nsim: nil)
     # Find score
     if !id.nil? # If ID has been provided
       s = MappackScore.find_by(id: id)
@@ -1437,7 +1438,7 @@ class MappackScore < ActiveRecord::Base
     # Compute score and frac with NSim if not specified
     if !score
       perror("Mappack score #{s.id} has no associated demo.") if !s.demo&.demo
-      res = NSim.run(highscoreable.dump_level, [s.demo.demo]){ |nsim| { score: nsim.score, frac: nsim.frac } }
+      res = nsim ? { score: nsim.score, frac: nsim.frac } : NSim.run(highscoreable.dump_level, [s.demo.demo], score_only: true){ |nsim| { score: nsim.score, frac: nsim.frac } }
       perror("ntrace failed to compute correct score") if !res[:score] || !res[:frac]
       s.update(fraction: res[:frac], simulated: true)
       score = res[:score]
@@ -1641,7 +1642,7 @@ class MappackScore < ActiveRecord::Base
       return :lost
     end
 
-    frac = NSim.run(highscoreable.dump_level, [demo.demo]){ |nsim| nsim.frac }
+    frac = NSim.run(highscoreable.dump_level, [demo.demo], score_only: true){ |nsim| nsim.frac }
     update(fraction: frac || 1, simulated: true)
     return frac ? :good : :bad
   rescue => e
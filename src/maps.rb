@@ -2515,19 +2515,31 @@ module Map
 
   # Tests whether ntrace is working with this level or not
   def test_ntrace(ranks: [0], board: 'hs', frac: false)
+    nsim = ntrace_test(ranks: ranks, board: board, frac: frac)
+    nsim.run(basic_sim: false, basic_render: false, silent: true) if nsim
+    Map.ntrace_result(nsim)
+  rescue => e
+    lex(e, 'ntrace testing failed')
+    nil
+  end
+
+  # Prepare the simulation used to test ntrace with this level, nil if there are
+  # no runs to test
+  def ntrace_test(ranks: [0], board: 'hs', frac: false)
     leaderboard = vanilla.leaderboard(board, pluck: false, frac: frac)
     scores = ranks.map{ |r| leaderboard[r] }.compact
-    return :other if scores.empty?
+    return if scores.empty?
     demos = scores.map{ |s| s.demo.demo }
-    return :other if demos.count(nil) > 0
-    nsim = NSim.new(dump_level, demos)
-    nsim.run(basic_sim: false, basic_render: false, silent: true)
+    return if demos.count(nil) > 0
+    NSim.new(dump_level, demos)
+  end
+
+  # Classify the outcome of an ntrace test after running the simulation
+  def self.ntrace_result(nsim)
+    return :other if !nsim
     return :error if !nsim.success
     return :other if !nsim.correct
     return nsim.valid ? :good : :bad
-  rescue => e
-    lex(e, 'ntrace testing failed')
-    nil
   end
 end
 
@@ -1598,7 +1598,7 @@ def fix_episode(event)
   # Compute episode level scores using NSim
   TmpMsg.update(event, '-# Running simulation...')
   nsim = NSim.new(ep.levels.map{ |l| l.map.dump_level }, Demo.encode(ep_replay))
-  nsim.run
+  nsim.run(score_only: true)
   nsim.check(event, debug: debug)
   ep_scores = { valid: nsim.valid_flags, splits: nsim.splits, scores: nsim.scores }
   nsim.destroy
@@ -1860,7 +1860,7 @@ module Scorish
     # Execute ntrace in mutex
     TmpMsg.update(event, '-# Running simulation...') if event
     nsim = NSim.new(highscoreable.levels.map{ |l| l.map.dump_level }, demo.demo)
-    nsim.run
+    nsim.run(score_only: true)
     res = { valid: nsim.valid_flags, splits: nsim.splits, scores: nsim.scores }
     nsim.destroy
     res
@@ -3365,7 +3365,7 @@ class Archive < ActiveRecord::Base
       return :lost
     end
 
-    frac = NSim.run(highscoreable.map.dump_level, [demo.demo]){ |nsim| nsim.frac }
+    frac = NSim.run(highscoreable.map.dump_level, [demo.demo], score_only: true){ |nsim| nsim.frac }
     update(fraction: frac || 1, simulated: true)
     return frac ? :good : :bad
   rescue => e
@@ -806,20 +806,21 @@ end
 #   stream - Redirect STDOUT/STDERR to Ruby's terminal so we can see
 #   output - Return the output (STDOUT/STDERR/status) as an array of strings
 #  timeout - Seconds before sending SIGTERM. SIGKILL will be sent at twice this.
-def shell(cmd, stream: LOG_SHELL, output: true, timeout: 0)
+def shell(cmd, stream: LOG_SHELL, output: true, timeout: 0, input: nil)
   cmd += ' > /dev/null 2>&1' if !stream && !output
   cmd.prepend("timeout -k #{2 * timeout} #{timeout} ") if timeout > 0
   dbg("Shell: #{cmd}")
-  output ? Open3.capture3(cmd) : system(cmd)
+  opts = input ? { stdin_data: input, binmode: true } : {}
+  output ? Open3.capture3(cmd, **opts) : system(cmd)
 rescue => e
   lex(e, "Failed to execute shell command: #{cmd}")
 end
 
 # Execute a python script
-def python(cmd, stream: LOG_SHELL, output: false, fast: false, timeout: 0)
+def python(cmd, stream: LOG_SHELL, output: false, fast: false, timeout: 0, input: nil)
   interpreter = fast ? $tools[:python_fast] : $tools[:python]
   return err("No #{fast ? 'fast ' : ''}Python interpreter found") if !interpreter
-  shell("#{interpreter} #{cmd}", stream: stream, output: output, timeout: timeout)
+  shell("#{interpreter} #{cmd}", stream: stream, output: output, timeout: timeout, input: input)
 rescue => e
   lex(e, "Failed to run Python script.")
   nil
@@ -2106,15 +2107,63 @@ class NSim
   Collision = Struct.new(:id, :index, :state)
 
   # One-shot usage of the simulator, shortcut to avoid creation and cleanup of NSim objects
-  def self.run(map_data, demo_data, basic_sim: true, basic_render: true, silent: false, &block)
+  def self.run(map_data, demo_data, basic_sim: true, basic_render: true, score_only: false, silent: false, &block)
     return if !block_given?
     nsim = new(map_data, demo_data)
-    nsim.run(basic_sim: basic_sim, basic_render: basic_render, silent: silent)
+    nsim.run(basic_sim: basic_sim, basic_render: basic_render, score_only: score_only, silent: silent)
     ret = yield(nsim)
     nsim.destroy
     ret
   end
 
+  # Command to execute ntrace in the given mode, with the configured options
+  # Only batches run in parallel, single requests are too small to pay for the workers
+  def self.command(mode)
+    cmd = "#{PATH_NTRACE} #{mode}"
+    cmd << " -j #{NTRACE_JOBS}" if mode == '--batch'
+    cmd << " --cache #{PATH_NTRACE_CACHE} --cache-size #{NTRACE_CACHE}" if NTRACE_CACHE > 0
+    cmd
+  end
+
+  # Run many simulations in a single ntrace process, so that its startup is only
+  # paid once. Each NSim object is yielded, along with its index in the list, as
+  # soon as its simulation is finished, and then destroyed. The list can be any
+  # enumerable, so objects can be built lazily as they are needed.
+  def self.batch(list, basic_sim: true, basic_render: true, score_only: false, silent: true)
+    return err("No Python interpreter found") if !$tools[:python]
+    pending = Queue.new
+    Open3.popen2("#{$tools[:python]} #{command('--batch')}") do |stdin, stdout, thread|
+      stdin.binmode
+      stdout.binmode
+      # The list may be a lazy query, so the writer needs its own connection
+      writer = Thread.new do
+        with_connection do
+          list.each{ |nsim|
+            pending << nsim
+            request = nsim.request(basic_sim: basic_sim, basic_render: basic_render, score_only: score_only)
+            stdin.write([request.bytesize].pack('L<') + request)
+          }
+        rescue => e
+          lex(e, 'Error sending NSim batch')
+        ensure
+          pending << nil
+          stdin.close
+        end
+      end
+      index = 0
+      while (nsim = pending.pop)
+        size = stdout.read(4)&.unpack('L<')&.first
+        nsim.receive(size ? stdout.read(size) : '', silent: silent)
+        yield(nsim, index)
+        nsim.destroy
+        index += 1
+      end
+      writer.join
+    end
+  rescue => e
+    lex(e, 'Error running NSim batch')
+  end
+
   def initialize(map_data, demo_data)
     @splits_mode    = map_data.is_a?(Array)
     @map_data       = map_data
@@ -2124,7 +2173,10 @@ class NSim
     @success        = false # Was nsim executed successfully?
     @correct        = false # Was nsim output parsed correctly?
     @valid          = false # Was nsim result a valid run?
+    @score_only     = false # Was nsim executed without logging anything?
     @output         = ''
+    @request        = ''
+    @result         = ''
     @valid_flags    = []
     @scores         = []
     @splits         = []
@@ -2136,36 +2188,36 @@ class NSim
     @stats          = {}
   end
 
-  # Export input files for nsim
-  private def export
-    if @splits_mode
-      File.binwrite(NTRACE_INPUTS_E, @demo_data)
-      @map_data.each_with_index{ |map, i| File.binwrite(NTRACE_MAP_DATA_E % i, map) }
-    else
-      @demo_data.each_with_index{ |demo, i| File.binwrite(NTRACE_INPUTS % i, demo) }
-      File.binwrite(NTRACE_MAP_DATA, @map_data)
-    end
+  # Build the request for nsim, containing the map and demo data (see ntrace_docs.txt)
+  private def export(basic_sim: true, basic_render: true, score_only: false)
+    @score_only = score_only
+    maps  = @splits_mode ? @map_data : [@map_data]
+    demos = @splits_mode ? [@demo_data] : @demo_data
+    flags = (basic_sim ? 1 : 0) | (basic_render ? 0 : 2) | (score_only ? 4 : 0) | (NTRACE_COMPACT ? 8 | 16 : 0)
+    @request = [@splits_mode ? 1 : 0, flags, 1.0].pack('C2E')
+    [maps, demos].each{ |list|
+      @request << [list.size].pack('C')
+      list.each{ |data| @request << [data.bytesize].pack('L<') << data.b }
+    }
   end
 
-  # Execute simulation
+  # Execute simulation, sending the request through stdin and reading the response
+  # from stdout, so that no files are involved and several can run at once
   # TODO: Store all scores in trace mode into @scores
-  private def execute(basic_sim: true, basic_render: true, silent: false)
+  private def execute(silent: false)
     t = Time.now
-    path = PATH_NTRACE + (basic_sim ? ' --basic-sim' : '') + (basic_render ? '' : ' --full-export')
-    stdout, stderr, status = python(path, output: true, fast: false)
-    @output = [stdout, stderr].join("\n\n")
+    stdout, stderr, status = python(NSim.command('--stdin'), output: true, input: @request)
     dbg("NSim simulation time: %.3fs" % [Time.now - t]) unless silent
-    @success = status.success? && File.file?(@splits_mode ? NTRACE_OUTPUT_E : NTRACE_OUTPUT)
+    read_response(stdout, stderr, status.success?)
   end
 
-  # Remove all temp files
-  private def clean
-    if @splits_mode
-      FileUtils.rm_f([NTRACE_INPUTS_E, *Dir.glob(NTRACE_MAP_DATA_E % '*')])
-    else
-      FileUtils.rm_f([NTRACE_MAP_DATA, *Dir.glob(NTRACE_INPUTS % '*')])
-    end
-    FileUtils.rm_f([@splits_mode ? NTRACE_OUTPUT_E : NTRACE_OUTPUT])
+  # Read nsim's response, containing the stats and the simulation result
+  private def read_response(response, stderr = '', success = true)
+    code, size = response.unpack('CL<') if response.bytesize >= 5
+    text = size ? response.byteslice(5, size).force_encoding('UTF-8') : ''
+    @result = size ? response.byteslice(5 + size..-1) : ''
+    @output = [text, stderr].join("\n\n")
+    @success = success && code == 0
   end
 
   # Parse nsim's output file in trace mode and read coordinates and collisions
@@ -2178,29 +2230,55 @@ class NSim
     @scores = scores_from_splits(splits, offset: 90.0)
   end
 
+  # Read the valid flags and splits from the stats in score-only mode, since
+  # there is no output then
+  private def parse_scores
+    @valid_flags = @stats['valid'].map{ |v| !!v }
+    return if !@splits_mode
+    split = 90 * 60
+    @splits = @stats['frames'].zip(@stats['gold']).map{ |frames, gold|
+      split += 1 - frames + 120 * gold
+      round_score(split / 60.0)
+    }
+    @scores = scores_from_splits(splits, offset: 90.0)
+  end
+
   # Parse nsim's output in splits mode and read level splits and valid flags
   # TODO: Should we deduplicate collisions, or handle it later?
   private def parse_trace(f)
-    # Run count and valid flags
+    # Compact traces start with a 0 (never a run count), then their version and flags
     n, = ioparse(f, 'C')
+    version, flags = n == 0 ? ioparse(f, 'C2') : [1, 0]
+    raise "Unknown NSim trace version #{version}" if ![1, 2].include?(version)
+    n, = ioparse(f, 'C') if version == 2
+
+    # Run count and valid flags
     @valid_flags = ioparse(f, 'C' * n).map{ |b| b > 0 }
 
     n.times do |i|
+      # Section of the run, which compact traces may compress with zlib
+      section = f
+      if version == 2 && flags & 1 > 0
+        size, = ioparse(f, 'L<')
+        section = StringIO.new(Zlib::Inflate.inflate(f.read(size)))
+      end
+
       # Entity coordinate section
-      entity_count, = ioparse(f, 'S<')
+      entity_count, = ioparse(section, 'S<')
       entity_count.times do
-        id, index, chunk_count = ioparse(f, 'CS<S<')
-        chunks = ioparse(f, "S<#{2 * chunk_count}").each_slice(2).to_a.transpose
+        id, index, chunk_count = ioparse(section, 'CS<S<')
+        chunks = ioparse(section, "S<#{2 * chunk_count}").each_slice(2).to_a.transpose
         @raw_chunks[id][index] = chunks unless @raw_chunks[id][index]
-        frames = chunks.last.sum
-        next f.seek(4 * frames, :CUR) if @raw_coords[id][index]
-        @raw_coords[id][index] = f.read(4 * frames)
+        size = version == 2 ? ioparse(section, 'L<').first : 4 * chunks.last.sum
+        next section.seek(size, IO::SEEK_CUR) if @raw_coords[id][index]
+        coords = section.read(size)
+        @raw_coords[id][index] = version == 2 ? decode_coords(coords) : coords
       end
 
       # Entity collision section
-      collision_count, = ioparse(f, 'L<')
+      collision_count, = ioparse(section, 'L<')
       collision_count.times do
-        collision = f.read(6)
+        collision = section.read(6)
         frame, = collision.unpack('S<')
         @raw_collisions[frame] ||= ""
         @raw_collisions[frame] << collision[2, 4]
@@ -2208,30 +2286,42 @@ class NSim
     end
   end
 
+  # Coordinates of compact traces are the differences between consecutive
+  # frames, zigzag encoded as variable length integers, so we add them up and
+  # pack them the same way as regular traces
+  private def decode_coords(data)
+    pos = [0, 0]
+    data.unpack('w*').each_with_index.map{ |z, i| pos[i & 1] += (z >> 1) ^ -(z & 1) }.pack('s<*')
+  end
+
   # Read and parse nsim's output file
   private def parse(silent: false)
-    fn = @splits_mode ? NTRACE_OUTPUT_E : NTRACE_OUTPUT
-    return if !File.file?(fn)
-    f = File.open(fn, 'rb')
-    dbg("NSim output size: %.3fKiB" % [File.size(fn) / 1024.0]) unless silent
+    f = StringIO.new(@result)
+    dbg("NSim output size: %.3fKiB" % [@result.bytesize / 1024.0]) unless silent
     t = Time.now
     @correct = true
     begin
-      @splits_mode ? parse_splits(f) : parse_trace(f)
+      parse_stats
+      if @score_only
+        parse_scores
+      else
+        @splits_mode ? parse_splits(f) : parse_trace(f)
+      end
     rescue => e
       lex(e, 'Failed to parse NSim output')
       @correct = false
     end
     dbg("NSim read size: %.3fKiB" % [f.pos / 1024.0]) unless silent
     dbg("NSim parse time: %.3fms" % [1000.0 * (Time.now - t)]) unless silent
+    segments = @stats['eliminated_segments']
+    dbg("NSim merged segments: %s" % [@splits_mode ? segments.join(', ') : segments.first]) if segments && !silent
   ensure
     f&.close
   end
 
-  # Parse the stats printed to the terminal after execution
+  # Parse the stats returned along with the simulation result
   private def parse_stats
-    start = @output.strip.rindex("\n").to_i
-    @stats = JSON.parse(@output[start..]) rescue {}
+    @stats = JSON.parse(@output.split("\n\n", 2).first) rescue {}
   end
 
   # Print debug information
@@ -2258,18 +2348,39 @@ class NSim
     @valid = @success && @correct && @valid_flags.all?
   end
 
-  # Run simulation and parse result inside the NSim mutex
-  def run(basic_sim: true, basic_render: true, silent: false)
-    $mutex[:nsim].synchronize do
-      export
-      execute(basic_sim: basic_sim, basic_render: basic_render, silent: silent)
+  # Run simulation and parse result
+  # In score-only mode nothing is logged, so only the stats are available (i.e.
+  # validity, scores and fractions, but no coordinates or collisions)
+  def run(basic_sim: true, basic_render: true, score_only: false, silent: false)
+    begin
+      export(basic_sim: basic_sim, basic_render: basic_render, score_only: score_only)
+      execute(silent: silent)
       parse(silent: silent) if @success
     rescue => e
       lex(e, 'Error running NSim')
-    ensure
-      clean
     end
-    parse_stats if @success
+    finish(silent: silent)
+  end
+
+  # Request for nsim, for when the simulation is executed elsewhere (e.g. batches)
+  def request(basic_sim: true, basic_render: true, score_only: false)
+    export(basic_sim: basic_sim, basic_render: basic_render, score_only: score_only)
+    @request
+  end
+
+  # Parse the response to the request, for when the simulation is executed elsewhere
+  def receive(response, silent: false)
+    begin
+      read_response(response)
+      parse(silent: silent) if @success
+    rescue => e
+      lex(e, 'Error reading NSim response')
+    end
+    finish(silent: silent)
+  end
+
+  # Process the stats and check the results once the output has been parsed
+  private def finish(silent: false)
     compute_complexity(silent: silent) if @correct
     validate
   end
@@ -2312,6 +2423,11 @@ class NSim
     @demos.clear
     @demos = nil
 
+    @request.clear
+    @request = nil
+    @result.clear
+    @result = nil
+
     return if @splits_mode
 
     @raw_collisions.each{ |frame, cols| cols.clear }
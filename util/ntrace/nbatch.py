@@ -0,0 +1,555 @@
+"""Batch simulation of many replays on the same level at once, to validate whole leaderboards or
+lots of scores in one go. The ninjas are advanced in lockstep, and their state is kept in NumPy
+arrays (one array per variable, with one element per replay) instead of a Ninja object for each
+of them, so that every step of the physics is computed for all of them at the same time. The
+results are exactly the same as those of the regular simulator, bit for bit.
+
+Only levels whose entities can be simulated for each ninja independently are supported, which
+are those with nothing but gold, exits and their switches, and regular (toggled) mines. For any
+other level, or if NumPy isn't installed, the replays must be simulated one by one instead.
+"""
+from nsim import *
+from nkernels import pack_segments, square
+
+try:
+    import numpy as np
+except ImportError: #NumPy is optional, without it the regular simulator is always used.
+    np = None
+
+#Components of each raw input, indexed by it (like HOR_INPUTS_DIC and JUMP_INPUTS_DIC in ntrace).
+HOR_INPUTS = (0, 0, 1, 1, -1, -1, -1, -1)
+JUMP_INPUTS = (0, 1, 0, 1, 0, 1, 0, 1)
+
+#Kinds of the supported entities, for the tables of the batch simulator.
+KIND_MINE = 0
+KIND_GOLD = 1
+KIND_SWITCH = 2
+KIND_EXIT = 3
+
+
+def available():
+    """Return whether batch simulation can be used, which requires NumPy."""
+    return np is not None
+
+
+class NinjaView:
+    """Values of a single ninja of the batch, which the tile collision methods of Ninja can be run on."""
+    RADIUS = Ninja.RADIUS
+    __slots__ = ("sim", "xpos", "ypos", "xpos_old", "ypos_old", "xspeed", "yspeed", "floor_count",
+                 "ceiling_count", "floor_normal_x", "floor_normal_y", "ceiling_normal_x",
+                 "ceiling_normal_y", "x_crush", "y_crush", "crush_len")
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.x_crush = self.y_crush = self.crush_len = 0
+
+    depenetrate = Ninja.depenetrate
+    collide_vs_tiles = Ninja.collide_vs_tiles
+
+
+class BatchSimulator:
+    """Simulates many replays on the same level at the same time. The state of the ninjas is kept
+    in arrays (see ARRAYS), which only contain the ninjas that are still running: replays are
+    removed from them as soon as they finish, when the ninja dies, wins or runs out of inputs.
+    There's no need to simulate the ragdoll nor the graphics of the ninja, since only the stats of
+    the replays are returned, as in score-only mode.
+    """
+    ARRAYS = ("ids", "xpos", "ypos", "xspeed", "yspeed", "xpos_old", "ypos_old", "xspeed_old",
+              "yspeed_old", "applied_gravity", "state", "airborn", "walled", "wall_normal",
+              "jump_input_old", "jump_duration", "jump_buffer", "floor_buffer", "wall_buffer",
+              "floor_normalized_x", "floor_normalized_y", "gold", "active")
+    #Values of the ninjas kept by NinjaView, for the tile collisions of a single ninja.
+    VIEW = ("xpos", "ypos", "xpos_old", "ypos_old", "xspeed", "yspeed", "floor_count", "ceiling_count",
+            "floor_normal_x", "floor_normal_y", "ceiling_normal_x", "ceiling_normal_y")
+    #Below this many ninjas, it's faster to collide them with the tiles one by one than all at once.
+    #Batches start well above it (see BATCH_MIN_REPLAYS in ntrace), so it only applies to the last
+    #ninjas still running, and to the depenetration loop. Anything between 32 and 64 performs the
+    #same within noise, at 300 and 1000 replays alike.
+    VECTORIZE_MIN = 32
+
+    def __init__(self, config=None):
+        """Create a batch simulator with the given options (a SimConfig), or the default ones. Only
+        basic_sim affects the results, since nothing but the stats are computed.
+        """
+        self.config = config or SimConfig()
+
+    @staticmethod
+    def supports(sim):
+        """Return whether the level loaded in a simulator can be simulated in batch. Its entities
+        must only react to the ninja that touches them, so that each ninja has its own copy of them.
+        Exit doors are only added to the entity grid once their switch is collected, after the other
+        entities of their cell, so there can't be more than one in the same cell.
+        """
+        doors = set()
+        for entity in (entity for list in sim.entity_dic.values() for entity in list):
+            if type(entity) is EntityExit:
+                if entity.cell in doors:
+                    return False
+                doors.add(entity.cell)
+            elif type(entity) is EntityToggleMine:
+                if entity.state != 0:
+                    return False
+            elif type(entity) not in (EntityGold, EntityExitSwitch):
+                return False
+        return True
+
+    def load(self, map_data):
+        """Load a level, and return whether it's supported (see supports). The entities are ordered
+        like the ninja collides with them: by cell, and in each cell, in the order they were added
+        to it. For each cell the ninja can be in, the table of neighbours lists the entities in the
+        surrounding cells, in that order.
+        """
+        sim = Simulator(SimConfig(basic_sim=self.config.basic_sim, score_only=True))
+        sim.load(map_data)
+        self.sim = sim
+        if not self.supports(sim):
+            return False
+        self.segments = pack_segments(sim.level)
+        entities = [entity for cell in sim.grid_entity for entity in cell]
+        entities += sorted(sim.entity_dic[3], key=lambda entity: entity.cell)
+        entities.sort(key=lambda entity: entity.cell) #Stable, so each cell keeps its order.
+        self.entities = entities
+        self.entity_xpos = np.array([entity.xpos for entity in entities], dtype=float)
+        self.entity_ypos = np.array([entity.ypos for entity in entities], dtype=float)
+        self.entity_radius = np.array([entity.RADIUS + Ninja.RADIUS for entity in entities], dtype=float)
+        kinds = {EntityToggleMine: KIND_MINE, EntityGold: KIND_GOLD, EntityExitSwitch: KIND_SWITCH, EntityExit: KIND_EXIT}
+        self.entity_kinds = [kinds[type(entity)] for entity in entities]
+        self.entity_doors = [entities.index(entity.parent) if type(entity) is EntityExitSwitch else None for entity in entities]
+        self.entity_active = np.array([type(entity) is not EntityExit for entity in entities], dtype=bool)
+
+        cells = [[] for _ in range(GRID_WIDTH*GRID_HEIGHT)]
+        for index, entity in enumerate(entities):
+            cells[entity.cell].append(index)
+        neighbours = []
+        for cell in range(GRID_WIDTH*GRID_HEIGHT):
+            xcell, ycell = divmod(cell, GRID_HEIGHT)
+            neighbours.append([index for x in range(max(xcell - 1, 0), min(xcell + 1, 43) + 1)
+                                     for y in range(max(ycell - 1, 0), min(ycell + 1, 24) + 1)
+                                     for index in cells[x*GRID_HEIGHT + y]])
+        self.neighbours = np.full((GRID_WIDTH*GRID_HEIGHT, max(map(len, neighbours))), -1, dtype=np.intp)
+        for cell, indices in enumerate(neighbours):
+            self.neighbours[cell, :len(indices)] = indices
+        return True
+
+    def simulate(self, inputs_list):
+        """Simulate a list of replays on the loaded level, given their raw inputs. Return the stats
+        of each of them in the same order: gold collected, input length, fractional frame and
+        validity, the same as simulating them separately in score-only mode.
+        """
+        count = len(inputs_list)
+        self.lengths = np.array([len(inputs) for inputs in inputs_list], dtype=np.intp)
+        self.inputs = np.zeros((max(self.lengths, default=0), count), dtype=np.uint8)
+        for i, inputs in enumerate(inputs_list):
+            self.inputs[:len(inputs), i] = inputs
+        self.results = [None] * count
+        self.fractional_frame = [0] * count #Python values, so that they're returned with the same types.
+        self.frame = 0
+
+        #Initiate every ninja like Ninja does, at the spawn point.
+        ninja = self.sim.ninja
+        self.ids = np.arange(count)
+        for name in ("xpos", "ypos", "xspeed", "yspeed", "applied_gravity", "wall_normal",
+                     "floor_normalized_x", "floor_normalized_y"):
+            setattr(self, name, np.full(count, getattr(ninja, name), dtype=float))
+        for name in ("state", "jump_duration", "jump_buffer", "floor_buffer", "wall_buffer"):
+            setattr(self, name, np.full(count, getattr(ninja, name), dtype=np.intp))
+        for name in ("airborn", "walled", "jump_input_old"):
+            setattr(self, name, np.full(count, getattr(ninja, name), dtype=bool))
+        self.xpos_old, self.ypos_old = self.xpos.copy(), self.ypos.copy()
+        self.xspeed_old, self.yspeed_old = self.xspeed.copy(), self.yspeed.copy()
+        self.gold = np.zeros(count, dtype=np.intp)
+        self.active = np.tile(self.entity_active, (count, 1))
+        self.finish(self.lengths[self.ids] == 0)
+
+        while self.ids.size:
+            self.tick()
+        return self.results
+
+    def finish(self, finished):
+        """Store the results of the replays that have finished, and remove them from the arrays."""
+        if not finished.any():
+            return
+        for i in np.flatnonzero(finished).tolist():
+            id = int(self.ids[i])
+            length = int(self.lengths[id])
+            valid = bool(self.state[i] == 8) and self.frame == length
+            self.results[id] = (int(self.gold[i]), length, 1 - self.fractional_frame[id], valid)
+        running = ~finished
+        for name in self.ARRAYS:
+            setattr(self, name, getattr(self, name)[running])
+
+    def tick(self):
+        """Simulate a frame for every ninja, in the same way as Simulator.tick."""
+        self.frame += 1
+        raw = self.inputs[self.frame - 1, self.ids]
+        hor_input = np.array(HOR_INPUTS, dtype=float)[raw]
+        jump_input = np.array(JUMP_INPUTS, dtype=bool)[raw]
+
+        self.integrate()
+        self.pre_collision()
+        self.collide_vs_tiles()
+        self.post_collision()
+        self.think(hor_input, jump_input)
+
+        #The replays finish when the ninja dies or wins, or when their inputs end.
+        self.finish((self.state == 6) | (self.state == 8) | (self.lengths[self.ids] == self.frame))
+
+    def integrate(self):
+        """Update position and speed by applying drag and gravity, see Ninja.integrate. The drag only
+        changes after winning, so it's always the regular one.
+        """
+        self.xspeed *= Ninja.DRAG_REGULAR
+        self.yspeed *= Ninja.DRAG_REGULAR
+        self.yspeed += self.applied_gravity
+        self.xpos_old = self.xpos.copy()
+        self.ypos_old = self.ypos.copy()
+        self.xpos += self.xspeed
+        self.ypos += self.yspeed
+
+    def pre_collision(self):
+        """Keep the speed before the collisions, see Ninja.pre_collision."""
+        self.xspeed_old = self.xspeed.copy()
+        self.yspeed_old = self.yspeed.copy()
+
+    def collide_vs_tiles(self):
+        """Handle the physical collisions with the tiles, and look for walls next to the ninjas, see
+        Ninja.collide_vs_tiles. There are no physical entities, so the 4 collision substeps only
+        collide with the tiles. The depenetration loop goes on for the ninjas that are still
+        colliding with something, and the last few of them are finished one by one, like the
+        whole collision when there are few ninjas (see VECTORIZE_MIN).
+        """
+        count = self.ids.size
+        self.floor_count = np.zeros(count, dtype=np.intp)
+        self.ceiling_count = np.zeros(count, dtype=np.intp)
+        self.floor_normal_x, self.floor_normal_y = np.zeros(count), np.zeros(count)
+        self.ceiling_normal_x, self.ceiling_normal_y = np.zeros(count), np.zeros(count)
+        if count < self.VECTORIZE_MIN:
+            self.wall = np.zeros(count)
+            for i in range(count):
+                view = self.view(i)
+                for _ in range(4):
+                    view.collide_vs_tiles()
+                self.store(i, view)
+                self.wall[i] = find_wall_normal(self.sim, view.xpos, view.ypos, Ninja.RADIUS + 0.1) or 0
+            return
+
+        for _ in range(4):
+            #Interpolation routine mainly to prevent from going through walls.
+            dx = self.xpos - self.xpos_old
+            dy = self.ypos - self.ypos_old
+            time = self.segments.sweep_circle(self.xpos_old, self.ypos_old, dx, dy, Ninja.RADIUS * 0.5)
+            self.xpos = self.xpos_old + time * dx
+            self.ypos = self.ypos_old + time * dy
+
+            #Find the closest point from the ninjas, apply depenetration and update speed. Loop 32 times.
+            indices = np.arange(count)
+            for iteration in range(32):
+                if indices.size < self.VECTORIZE_MIN:
+                    for i in indices.tolist():
+                        view = self.view(i)
+                        view.depenetrate(32 - iteration)
+                        self.store(i, view)
+                    break
+                result, a, b = self.segments.closest_points(self.xpos[indices], self.ypos[indices], Ninja.RADIUS)
+                colliding = result != 0
+                indices, result, a, b = indices[colliding], result[colliding], a[colliding], b[colliding]
+                xpos, ypos = self.xpos[indices], self.ypos[indices]
+                dx = xpos - a
+                dy = ypos - b
+                #Same band-aid as in Ninja.collide_vs_tiles.
+                dx = np.where(np.abs(dx) <= 0.0000001,
+                              np.where((xpos == 50.51197510492316) | (xpos == 49.23232124849253), -2**-47,
+                                       np.where(xpos == 49.153536108584795, 2**-47, 0)), dx)
+                dist = np.sqrt(square(dx) + square(dy))
+                depen_len = Ninja.RADIUS - dist*result
+                colliding = (dist != 0) & ~(depen_len < 0.0000001)
+                indices, xpos, ypos = indices[colliding], xpos[colliding], ypos[colliding]
+                dx, dy, dist, depen_len = dx[colliding], dy[colliding], dist[colliding], depen_len[colliding]
+                self.xpos[indices] = xpos + dx / dist * depen_len
+                self.ypos[indices] = ypos + dy / dist * depen_len
+                xspeed, yspeed = self.xspeed[indices], self.yspeed[indices]
+                toward = xspeed * dx + yspeed * dy < 0 #Project velocity onto surface only if moving towards surface
+                projected = (xspeed*dy - yspeed*dx) / square(dist)
+                self.xspeed[indices] = np.where(toward, projected * dy, xspeed)
+                self.yspeed[indices] = np.where(toward, projected * (0 - dx), yspeed) #Not -dx, which turns the 0 of the band-aid into -0.0.
+                ceiling = dy >= -0.0001 #Adjust ceiling variables if ninja collides with ceiling (or wall!)
+                floor = ~ceiling
+                self.ceiling_count[indices[ceiling]] += 1
+                self.ceiling_normal_x[indices[ceiling]] += dx[ceiling]/dist[ceiling]
+                self.ceiling_normal_y[indices[ceiling]] += dy[ceiling]/dist[ceiling]
+                self.floor_count[indices[floor]] += 1
+                self.floor_normal_x[indices[floor]] += dx[floor]/dist[floor]
+                self.floor_normal_y[indices[floor]] += dy[floor]/dist[floor]
+
+        self.wall = self.segments.wall_normals(self.xpos, self.ypos, Ninja.RADIUS + 0.1)
+
+    def view(self, i):
+        """Return a view of the values of a ninja, as Python numbers like those of the Ninja class."""
+        view = NinjaView(self.sim)
+        for name in self.VIEW:
+            setattr(view, name, getattr(self, name)[i].item())
+        return view
+
+    def store(self, i, view):
+        """Store the values of a ninja back into the arrays, after changing them with its view."""
+        for name in self.VIEW:
+            getattr(self, name)[i] = getattr(view, name)
+
+    def post_collision(self):
+        """Perform the logical collisions with the entities, check for airborn and walled states,
+        calculate the floor normals and check for impact death, see Ninja.post_collision.
+        """
+        self.collide_vs_entities()
+
+        self.airborn_old = self.airborn
+        self.walled = self.wall != 0
+        self.wall_normal = np.where(self.walled, self.wall, self.wall_normal)
+
+        #Calculate the combined floor normalized normal vector where the ninja has touched any floor.
+        touched = np.flatnonzero(self.floor_count > 0)
+        self.airborn = np.ones(self.ids.size, dtype=bool)
+        self.airborn[touched] = False
+        normal_x, normal_y = self.normalize(self.floor_normal_x[touched], self.floor_normal_y[touched], -1)
+        self.floor_normalized_x[touched] = normal_x
+        self.floor_normalized_y[touched] = normal_y
+        impact = (self.state[touched] != 8) & self.airborn_old[touched]
+        self.check_impact(touched[impact], normal_x[impact], normal_y[impact])
+
+        #Calculate the combined ceiling normalized normal vector where the ninja has touched any ceiling.
+        touched = np.flatnonzero(self.ceiling_count > 0)
+        normal_x, normal_y = self.normalize(self.ceiling_normal_x[touched], self.ceiling_normal_y[touched], 1)
+        impact = self.state[touched] != 8
+        self.check_impact(touched[impact], normal_x[impact], normal_y[impact])
+
+    def normalize(self, normal_x, normal_y, default_y):
+        """Return the normalized vectors of some combined normals, or (0, default_y) if they're null."""
+        scalar = np.sqrt(square(normal_x) + square(normal_y))
+        null = scalar == 0
+        scalar[null] = 1
+        return np.where(null, 0, normal_x / scalar), np.where(null, default_y, normal_y / scalar)
+
+    def check_impact(self, indices, normal_x, normal_y):
+        """Kill the ninjas that hit a floor or ceiling too fast, given its normalized normal."""
+        impact_vel = -(normal_x*self.xspeed_old[indices] + normal_y*self.yspeed_old[indices])
+        indices = indices[impact_vel > Ninja.MAX_SURVIVABLE_IMPACT - 4/3 * np.abs(normal_y)]
+        self.xspeed[indices] = self.xspeed_old[indices]
+        self.yspeed[indices] = self.yspeed_old[indices]
+        self.kill(indices)
+
+    def collide_vs_entities(self):
+        """Perform the logical collisions with the entities. Since a ninja rarely touches any, the
+        entities in the neighbourhood of every ninja are checked at once, and only those being
+        touched are handled one by one, in the order the ninja would collide with them.
+        """
+        xcell = np.clip(np.floor(self.xpos / 24), 0, 43).astype(np.intp)
+        ycell = np.clip(np.floor(self.ypos / 24), 0, 24).astype(np.intp)
+        neighbours = self.neighbours[xcell*GRID_HEIGHT + ycell]
+        ninjas, slots = np.nonzero(neighbours >= 0)
+        entities = neighbours[ninjas, slots]
+        active = self.active[ninjas, entities]
+        ninjas, entities = ninjas[active], entities[active]
+        dist = np.sqrt(square(self.entity_xpos[entities] - self.xpos[ninjas]) +
+                       square(self.entity_ypos[entities] - self.ypos[ninjas]))
+        touched = dist < self.entity_radius[entities]
+        for i, index in zip(ninjas[touched].tolist(), entities[touched].tolist()):
+            kind = self.entity_kinds[index]
+            if kind == KIND_MINE:
+                if self.state[i] not in (6, 8, 9):
+                    self.kill(np.array([i]))
+            elif kind == KIND_GOLD:
+                if self.state[i] != 8:
+                    self.gold[i] += 1
+                    self.active[i, index] = False
+            elif kind == KIND_SWITCH:
+                self.active[i, index] = False
+                self.active[i, self.entity_doors[index]] = True
+            else:
+                self.win(i)
+                xpos_old, ypos_old = float(self.xpos_old[i]), float(self.ypos_old[i])
+                dx, dy = float(self.xpos[i]) - xpos_old, float(self.ypos[i]) - ypos_old
+                self.fractional_frame[int(self.ids[i])] = get_time_of_intersection_circle_vs_circle(
+                    xpos_old, ypos_old, dx, dy, self.entities[index].xpos, self.entities[index].ypos, Ninja.RADIUS + EntityExit.RADIUS)
+
+    def think(self, hor_input, jump_input):
+        """Handle the actions of the ninjas depending on their inputs and environment, like Ninja.think
+        does for each of them. Every branch of it is computed for the ninjas that take it.
+        """
+        state = self.state
+        airborn = self.airborn
+        walled = self.walled
+        xspeed = self.xspeed
+        yspeed = self.yspeed
+        normal_x = self.floor_normalized_x
+        normal_y = self.floor_normalized_y
+        wall_normal = self.wall_normal
+
+        #Logic to determine if you're starting a new jump.
+        new_jump_check = jump_input & ~self.jump_input_old
+        self.jump_input_old = jump_input
+
+        #Determine if within buffer ranges. If so, increment buffers. There are no launch pads, so
+        #their buffer is never used.
+        buffers = []
+        for name in ("jump_buffer", "wall_buffer", "floor_buffer"):
+            buffer = getattr(self, name)
+            buffer = np.where((buffer > -1) & (buffer < 5), buffer + 1, -1)
+            buffers.append((buffer > -1) & (buffer < 5))
+            setattr(self, name, buffer)
+        in_jump_buffer, in_wall_buffer, in_floor_buffer = buffers
+        jumping = in_jump_buffer | new_jump_check
+
+        #Initiate jump buffer if beginning a new jump and airborn, wall buffer if touched a wall this
+        #frame, and floor buffer if touched a floor this frame.
+        self.jump_buffer[new_jump_check & airborn] = 0
+        self.wall_buffer[walled] = 0
+        self.floor_buffer[~airborn] = 0
+
+        #The ninjas that are awaiting death die, and those celebrating are done.
+        alive = state < 6
+        state[state == 7] = 6
+
+        #Horizontal acceleration, which is different on the floor and in the air.
+        accel = np.where(airborn, Ninja.AIR_ACCEL * hor_input, Ninja.GROUND_ACCEL * hor_input)
+        xspeed_new = xspeed + accel
+        under_max = np.abs(xspeed_new) < Ninja.MAX_HOR_SPEED
+        xspeed[alive & under_max] = xspeed_new[alive & under_max]
+
+        #This block deals with the case where the ninja is touching a floor.
+        floor = alive & ~airborn
+        landed = floor & (state > 2)
+        self.applied_gravity[landed & (state == 3)] = Ninja.GRAVITY_FALL
+        state[landed] = np.where(xspeed[landed] * hor_input[landed] <= 0, 2, 1)
+        walking = floor & ~jumping
+        projection = np.abs(yspeed * normal_x - xspeed * normal_y)
+        forward = hor_input * projection * xspeed > 0
+
+        sliding = walking & (state == 2)
+        running = walking & (state == 1)
+        still = walking & (state == 0)
+
+        state[sliding & forward] = 1
+        sliding &= ~forward
+        stopping = sliding & (projection < 0.1) & (normal_x == 0)
+        state[stopping] = 0
+        sliding &= ~stopping
+        uphill = sliding & (yspeed < 0) & (normal_x != 0)
+        xspeed[sliding & ~uphill] *= Ninja.FRICTION_GROUND
+        uphill = np.flatnonzero(uphill)
+        if uphill.size: #Up slope friction formula, very dumb but that's how it is
+            xs, ys, ny = xspeed[uphill], yspeed[uphill], normal_y[uphill]
+            speed_scalar = np.sqrt(square(xs) + square(ys))
+            fric_force = np.abs(xs * (1-Ninja.FRICTION_GROUND) * ny)
+            fric_force2 = speed_scalar - fric_force * square(ny)
+            xspeed[uphill] = xs / speed_scalar * fric_force2
+            yspeed[uphill] = ys / speed_scalar * fric_force2
+
+        state[running & ~forward] = 2
+        boosting = np.flatnonzero(running & forward & (hor_input * normal_x < 0) & under_max)
+        if boosting.size:
+            boost = Ninja.GROUND_ACCEL/2 * hor_input[boosting]
+            xspeed[boosting] += boost * normal_y[boosting] * normal_y[boosting]
+            yspeed[boosting] += boost * normal_y[boosting] * -normal_x[boosting]
+
+        state[still & (hor_input != 0)] = 1
+        still &= hor_input == 0
+        xspeed[still & (projection < 0.1)] *= Ninja.FRICTION_GROUND_SLOW
+        state[still & ~(projection < 0.1)] = 2
+
+        floor_jumping = floor & jumping
+
+        #This block deals with the case where the ninja didn't touch a floor.
+        air = alive & airborn
+        falling = air & (state < 3)
+        state[falling] = 4
+        air &= ~falling
+        rising = air & (state == 3)
+        self.jump_duration[rising] += 1
+        ending = rising & (~jump_input | (self.jump_duration > Ninja.MAX_JUMP_DURATION))
+        self.applied_gravity[ending] = Ninja.GRAVITY_FALL
+        state[ending] = 4
+        air &= ~ending
+        wall_jumping = air & jumping & (walled | in_wall_buffer)
+        floor_jumping |= air & jumping & ~(walled | in_wall_buffer) & in_floor_buffer
+        air &= ~(wall_jumping | floor_jumping)
+        slide = air & walled & (state == 5)
+        grabbing = air & walled & (state != 5) & (yspeed > 0) & (hor_input * wall_normal < 0)
+        state[air & ~walled & (state == 5)] = 4
+        holding = hor_input * wall_normal <= 0
+        yspeed[slide & holding] *= Ninja.FRICTION_WALL
+        state[slide & ~holding] = 4
+        self.applied_gravity[grabbing & (state == 3)] = Ninja.GRAVITY_FALL
+        state[grabbing] = 5
+
+        self.floor_jump(np.flatnonzero(floor_jumping), hor_input)
+        self.wall_jump(np.flatnonzero(wall_jumping), hor_input)
+
+    def floor_jump(self, indices, hor_input):
+        """Perform floor jumps depending on slope angle and direction, see Ninja.floor_jump."""
+        if not indices.size:
+            return
+        xspeed, yspeed = self.xspeed[indices], self.yspeed[indices]
+        dx, dy = self.floor_normalized_x[indices], self.floor_normalized_y[indices]
+        hor_input = hor_input[indices]
+        slope = dx != 0
+        downhill = xspeed * dx >= 0
+        perp = slope & ~downhill & ~(xspeed * hor_input > 0)
+        along = perp | (slope & downhill & (xspeed * hor_input >= 0)) #Jump along the normal
+        jx = np.where(along, 2/3 * dx, 0)
+        jy = np.where(along, 2 * dy, np.where(slope, -1.4, -2))
+        xspeed[perp] = 0
+        yspeed[yspeed > 0] = 0
+        self.xspeed[indices] = xspeed + jx
+        self.yspeed[indices] = yspeed + jy
+        self.xpos[indices] += jx
+        self.ypos[indices] += jy
+        self.jump_buffer[indices] = -1
+        self.floor_buffer[indices] = -1
+        self.state[indices] = 3
+        self.applied_gravity[indices] = Ninja.GRAVITY_JUMP
+        self.jump_duration[indices] = 0
+
+    def wall_jump(self, indices, hor_input):
+        """Perform wall jumps depending on wall normal and if sliding or not, see Ninja.wall_jump."""
+        if not indices.size:
+            return
+        xspeed, yspeed = self.xspeed[indices], self.yspeed[indices]
+        wall_normal = self.wall_normal[indices]
+        slide = (hor_input[indices] * wall_normal < 0) & (self.state[indices] == 5)
+        jx = np.where(slide, 2/3, 1)
+        jy = np.where(slide, -1, -1.4)
+        xspeed[xspeed * wall_normal < 0] = 0
+        yspeed[yspeed > 0] = 0
+        self.xspeed[indices] = xspeed + jx * wall_normal
+        self.yspeed[indices] = yspeed + jy
+        self.xpos[indices] += jx * wall_normal
+        self.ypos[indices] += jy
+        self.jump_buffer[indices] = -1
+        self.wall_buffer[indices] = -1
+        self.state[indices] = 3
+        self.applied_gravity[indices] = Ninja.GRAVITY_JUMP
+        self.jump_duration[indices] = 0
+
+    def win(self, i):
+        """Set the state of a ninja to celebrating, see Ninja.win."""
+        if self.state[i] < 6:
+            if self.state[i] == 3:
+                self.applied_gravity[i] = Ninja.GRAVITY_FALL
+            self.state[i] = 8
+
+    def kill(self, indices):
+        """Set the state of some ninjas to just killed, see Ninja.kill."""
+        indices = indices[self.state[indices] < 6]
+        self.applied_gravity[indices[self.state[indices] == 3]] = Ninja.GRAVITY_FALL
+        self.state[indices] = 7
+
+
+def simulate(map_data, inputs_list, config=None):
+    """Simulate several replays on the same map in batch, and return the stats of each of them
+    (see BatchSimulator.simulate). Return None if the level isn't supported or NumPy is missing.
+    """
+    if not available():
+        return None
+    batch = BatchSimulator(config)
+    if not batch.load(map_data):
+        return None
+    return batch.simulate(inputs_list)
@@ -0,0 +1,93 @@
+"""Benchmark of the simulator on generated levels with a growing amount of death balls, to show how
+the time per frame scales with them. The counts can be given as arguments, e.g.
+python nbench.py 8 64 255
+Levels can't have more than 255 death balls, since their count is stored in a single byte.
+
+With --batch, it times instead a growing amount of replays on the same level, simulated by the
+batch simulator and one by one, to find out from how many replays the batch simulator is faster
+(see BATCH_MIN_REPLAYS in ntrace), e.g.
+python nbench.py --batch 100 300 1000
+"""
+import itertools
+import random
+import struct
+import sys
+import time
+
+import nbatch
+import ntrace
+from nsim import Simulator, SimConfig
+
+FRAMES = 600
+COUNTS = (2, 8, 32, 128, 255)
+BATCH_COUNTS = (100, 200, 300, 500, 1000)
+
+def level(tiles, objects):
+    """Return the map data of a level with the given tiles and objects (type, x, y, orientation, mode)."""
+    counts = [0] * 40
+    for object in objects:
+        counts[object[0]] += 1
+    return bytes(184) + bytes(tiles) + struct.pack('<40H', *counts) + b"".join(bytes(object) for object in objects)
+
+def deathball_level(count):
+    """Return the map data of an empty level with a ninja, an exit and a block of death balls."""
+    objects = [(0, 8, 92, 0, 0), (3, 168, 92, 0, 0), (4, 160, 92, 0, 0)]
+    for i in range(count):
+        objects.append((25, 16 + 6*(i % 26), 8 + 6*(i // 26), 0, 0))
+    return level(bytes(966), objects)
+
+def batch_level(rng):
+    """Return the map data of a level the batch simulator supports: random tiles near the floor,
+    gold, mines, and an exit with its switch.
+    """
+    tiles = bytearray(966)
+    for _ in range(25):
+        tiles[rng.randrange(42) + rng.randrange(14, 22)*42] = rng.choice((1, 2, 3, 4, 6, 7, 10, 11, 14, 18, 22, 26, 30))
+    objects = [(0, 10, 86, 0, 0), (3, rng.randint(100, 170), 86, 0, 0), (4, rng.randint(14, 90), 86, 0, 0)]
+    objects += [(2, rng.randint(12, 170), rng.randint(60, 87), 0, 0) for _ in range(20)]
+    objects += [(1, rng.randint(20, 170), rng.randint(50, 84), 0, 0) for _ in range(5)]
+    return level(tiles, objects)
+
+def random_inputs(rng, length):
+    """Return random inputs, mostly to the right, holding each one for a while."""
+    inputs = []
+    while len(inputs) < length:
+        inputs += [rng.choice((2, 2, 2, 0, 4)) | (rng.random() < 0.3)] * rng.randint(5, 40)
+    return inputs[:length]
+
+def benchmark(count):
+    """Return the average time per frame, in microseconds, of a level with the given death balls."""
+    sim = Simulator(SimConfig())
+    sim.load(deathball_level(count))
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        sim.tick(0, 0)
+    return (time.perf_counter() - start) / FRAMES * 1e6
+
+def benchmark_batch(count):
+    """Return the time in seconds to simulate the given amount of replays on a level in score-only
+    mode with the batch simulator, and one by one (only simulating their common inputs once, like
+    ntrace). The replays start alike, like those of a leaderboard, and then diverge.
+    """
+    rng = random.Random(count)
+    map_data = batch_level(rng)
+    start = random_inputs(rng, 300)
+    inputs_list = [start[:rng.randrange(300)] + random_inputs(rng, rng.randrange(200, 1200)) for _ in range(count)]
+    config = SimConfig(score_only=True)
+    timer = time.perf_counter()
+    nbatch.simulate(map_data, inputs_list, config)
+    batch = time.perf_counter() - timer
+    timer = time.perf_counter()
+    list(ntrace.simulate_shared(list(zip(range(count), itertools.repeat(map_data), inputs_list)), config))
+    return batch, time.perf_counter() - timer
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--batch"]:
+        if not nbatch.available():
+            sys.exit("The batch simulator requires NumPy")
+        for count in [int(arg) for arg in sys.argv[2:]] or BATCH_COUNTS:
+            batch, single = benchmark_batch(count)
+            print(f"{count:>4} replays: {batch:6.2f} s in batch, {single:6.2f} s one by one")
+    else:
+        for count in [int(arg) for arg in sys.argv[1:]] or COUNTS:
+            print(f"{count:>3} death balls: {benchmark(count):8.1f} us/frame")
@@ -0,0 +1,355 @@
+"""Vectorized kernels of the collisions between circles and the tile segments of a level. The
+segments of each level are packed into NumPy arrays, and every kernel takes a whole array of
+queries (e.g. the positions of many ninjas), gathers the candidate segments of each of them and
+evaluates all of them in one go. The results are exactly the same as those of the functions of
+nsim that check the segments one at a time (see sweep_circle_vs_tiles, get_single_closest_point
+and find_wall_normal), including their tie-breaking.
+
+NumPy is optional: this module can always be imported, but the kernels can't be used without it.
+"""
+import functools
+
+from nsim import *
+
+try:
+    import numpy as np
+except ImportError: #NumPy is optional, without it the regular simulator is always used.
+    np = None
+
+#Veltkamp's constant to split a double into two halves of 26 bits, 2^27 + 1.
+SPLIT = 134217729.0
+#Values closer than this to a tie between two doubles, in units in the last place, are squared
+#with pow (see square). Its error is below 0.51 units, so it can't round differently further away.
+ROUNDING_MARGIN = 0.5 - 1/64
+#Below this many values, squaring them one by one with pow is faster than vectorizing it.
+SQUARE_MIN_SIZE = 128
+
+
+def square(values):
+    """Return the squares of an array of doubles, exactly as x**2 computes them in Python. This
+    calls pow, which isn't always correctly rounded, so it may differ from x*x by 1 unit in the
+    last place when the exact square is very close to a tie between two doubles. Those cases are
+    detected with the exact error of x*x (using Dekker's product), and only then is pow used.
+    """
+    if values.size < SQUARE_MIN_SIZE:
+        return np.array([value**2 for value in values.tolist()], dtype=float)
+    product = values * values
+    high = SPLIT * values
+    high = high - (high - values)
+    low = values - high
+    error = ((high*high - product) + high*low + low*high) + low*low
+    tie = np.abs(error) > ROUNDING_MARGIN * np.spacing(np.abs(product))
+    tie |= np.frexp(product)[0] == 0.5 #Powers of 2 are checked too, since below them the units are halved.
+    magnitude = np.abs(values)
+    tie |= ~((magnitude > 2.0**-450) & (magnitude < 2.0**450)) & (magnitude != 0) #Where the product isn't exact.
+    indices = np.flatnonzero(tie)
+    if indices.size:
+        product[indices] = [value**2 for value in values[indices].tolist()]
+    return product
+
+def repeat_ranges(sizes):
+    """For ranges of the given sizes laid out one after the other, return the index of the range
+    each element belongs to, and the position of the element in it.
+    """
+    ranges = np.repeat(np.arange(sizes.size), sizes)
+    return ranges, np.arange(ranges.size) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+
+def first_in_ranges(ranges, mask):
+    """Given the sorted range of each element, return the first element of each range for which
+    the mask is true, as the indices of those elements.
+    """
+    indices = np.flatnonzero(mask)
+    ranges = ranges[indices]
+    first = np.ones(indices.size, dtype=bool)
+    first[1:] = ranges[1:] != ranges[:-1]
+    return indices[first]
+
+
+@functools.lru_cache(maxsize=CompiledLevel.CACHE_SIZE)
+def pack_segments(level):
+    """Return the packed segments of a compiled level, which are only packed the first time."""
+    return PackedSegments(level.segment_grid)
+
+
+class PackedSegments:
+    """The segments of the cells of a level, as arrays with one element per segment, in the order
+    of the cells and, in each cell, in the order of the segment grid. The halves of merged segments
+    are also packed as parts, with the rest of the segments (each of which is its own only part).
+    Only the segments that never change are packed, so those of doors aren't included.
+    """
+
+    def __init__(self, segment_grid):
+        segments = [segment for cell in segment_grid for segment in cell]
+        parts = [part for segment in segments for part in segment.parts]
+        self.segment_starts, self.segment_counts = self.index_cells(segment_grid, lambda segment: 1)
+        self.part_starts, self.part_counts = self.index_cells(segment_grid, lambda segment: len(segment.parts))
+
+        #Parts, which are linear or circular.
+        linear = [part if part.type == "linear" else None for part in parts]
+        circular = [part if part.type == "circular" else None for part in parts]
+        self.circular = np.array([part is not None for part in circular], dtype=bool)
+        self.x1 = self.pack(linear, lambda part: part.x1)
+        self.y1 = self.pack(linear, lambda part: part.y1)
+        self.px = self.pack(linear, lambda part: part.x2 - part.x1)
+        self.py = self.pack(linear, lambda part: part.y2 - part.y1)
+        self.seg_lensq = self.pack(linear, lambda part: (part.x2 - part.x1)**2 + (part.y2 - part.y1)**2, 1)
+        self.oriented = np.array([part is not None and part.oriented for part in linear], dtype=bool)
+        self.xcenter = self.pack(circular, lambda part: part.xpos)
+        self.ycenter = self.pack(circular, lambda part: part.ypos)
+        self.hor = self.pack(circular, lambda part: part.hor)
+        self.ver = self.pack(circular, lambda part: part.ver)
+        self.radius = self.pack(circular, lambda part: part.radius)
+        self.convex = np.array([part is not None and part.convex for part in circular], dtype=bool)
+        self.xhor = self.pack(circular, lambda part: part.p_hor[0])
+        self.yhor = self.pack(circular, lambda part: part.p_hor[1])
+        self.xver = self.pack(circular, lambda part: part.p_ver[0])
+        self.yver = self.pack(circular, lambda part: part.p_ver[1])
+
+        #Segments, pointing to their parts. The ends are those of the whole segment for linear and
+        #merged segments, and those of the arc for circular ones.
+        part_indices = np.cumsum([0] + [len(segment.parts) for segment in segments])
+        self.first_part = part_indices[:-1]
+        self.second_part = np.where(np.diff(part_indices) > 1, part_indices[:-1] + 1, -1)
+        linear = [segment if segment.type == "linear" else None for segment in segments]
+        merged = [segment if type(segment) is GridSegmentMerged else None for segment in segments]
+        self.segment_circular = np.array([segment.type == "circular" for segment in segments], dtype=bool)
+        self.xend1 = np.array([segment.x1 if segment.type == "linear" else segment.p_hor[0] for segment in segments], dtype=float)
+        self.yend1 = np.array([segment.y1 if segment.type == "linear" else segment.p_hor[1] for segment in segments], dtype=float)
+        self.xend2 = np.array([segment.x2 if segment.type == "linear" else segment.p_ver[0] for segment in segments], dtype=float)
+        self.yend2 = np.array([segment.y2 if segment.type == "linear" else segment.p_ver[1] for segment in segments], dtype=float)
+        self.seg_len = self.pack(linear, lambda segment: math.sqrt((segment.x2 - segment.x1)**2 + (segment.y2 - segment.y1)**2), 1)
+        self.xnormal = self.pack(linear, lambda segment: (segment.x2 - segment.x1) / math.sqrt((segment.x2 - segment.x1)**2 + (segment.y2 - segment.y1)**2))
+        self.ynormal = self.pack(linear, lambda segment: (segment.y2 - segment.y1) / math.sqrt((segment.x2 - segment.x1)**2 + (segment.y2 - segment.y1)**2))
+        self.merged = np.array([segment is not None for segment in merged], dtype=bool)
+        self.xmid = self.pack(merged, lambda segment: segment.xmid)
+        self.ymid = self.pack(merged, lambda segment: segment.ymid)
+        self.xdir = self.pack(merged, lambda segment: segment.xdir)
+        self.ydir = self.pack(merged, lambda segment: segment.ydir)
+        self.segment_xcenter = self.pack(segments, lambda segment: segment.xpos if segment.type == "circular" else 0)
+        self.segment_ycenter = self.pack(segments, lambda segment: segment.ypos if segment.type == "circular" else 0)
+        self.segment_hor = self.pack(segments, lambda segment: segment.hor if segment.type == "circular" else 0)
+        self.segment_ver = self.pack(segments, lambda segment: segment.ver if segment.type == "circular" else 0)
+        self.segment_radius = self.pack(segments, lambda segment: segment.radius if segment.type == "circular" else 0)
+
+    @staticmethod
+    def index_cells(segment_grid, size):
+        """Return where the items of each cell start in the packed arrays, and how many there are."""
+        counts = np.array([sum(size(segment) for segment in cell) for cell in segment_grid], dtype=np.intp)
+        return np.cumsum(counts) - counts, counts
+
+    @staticmethod
+    def pack(items, value, default=0):
+        """Return an array with a value of each item, or the default where the item is None."""
+        return np.array([value(item) if item is not None else default for item in items], dtype=float)
+
+    def gather(self, starts, counts, x1, y1, x2, y2):
+        """Gather the candidates of each query, which are all the items in the cells of a rectangular
+        region, in the same order as gather_segments_from_region. Return the query of each candidate
+        and the candidate, sorted by query.
+        """
+        cx1 = np.clip(np.floor(x1/24), 0, 43).astype(np.intp)
+        cy1 = np.clip(np.floor(y1/24), 0, 24).astype(np.intp)
+        cx2 = np.clip(np.floor(x2/24), 0, 43).astype(np.intp)
+        cy2 = np.clip(np.floor(y2/24), 0, 24).astype(np.intp)
+        height = cy2 - cy1 + 1
+        queries, cells = repeat_ranges((cx2 - cx1 + 1) * height)
+        height = height[queries]
+        cells = (cx1[queries] + cells // height)*GRID_HEIGHT + cy1[queries] + cells % height
+        sizes = counts[cells]
+        ranges, items = repeat_ranges(sizes)
+        return queries[ranges], starts[cells][ranges] + items
+
+    def part_closest_points(self, parts, xpos, ypos):
+        """Find the closest point of each part from the given positions, and whether the positions
+        are behind the parts (see GridSegmentLinear and GridSegmentCircular.get_closest_point).
+        """
+        is_back_facing = np.zeros(parts.size, dtype=bool)
+        a = np.empty(parts.size)
+        b = np.empty(parts.size)
+
+        indices = np.flatnonzero(~self.circular[parts])
+        part = parts[indices]
+        px, py = self.px[part], self.py[part]
+        dx = xpos[indices] - self.x1[part]
+        dy = ypos[indices] - self.y1[part]
+        u = (dx*px + dy*py)/self.seg_lensq[part]
+        u = np.where(u < 0, 0, u)
+        u = np.where(u > 1, 1, u)
+        a[indices] = self.x1[part] + u*px
+        b[indices] = self.y1[part] + u*py
+        is_back_facing[indices] = (dy*px - dx*py < 0) & self.oriented[part]
+
+        indices = np.flatnonzero(self.circular[parts])
+        if not indices.size:
+            return is_back_facing, a, b
+        part = parts[indices]
+        dx = xpos[indices] - self.xcenter[part]
+        dy = ypos[indices] - self.ycenter[part]
+        hor, ver = self.hor[part], self.ver[part]
+        arc = (dx * hor > 0) & (dy * ver > 0) #True if position is closer from arc than its edges.
+        edge = dx * hor > dy * ver
+        a[indices] = np.where(edge, self.xhor[part], self.xver[part])
+        b[indices] = np.where(edge, self.yhor[part], self.yver[part])
+        indices, part, dx, dy = indices[arc], part[arc], dx[arc], dy[arc]
+        dist = np.sqrt(square(dx) + square(dy))
+        radius = self.radius[part]
+        a[indices] = self.xcenter[part] + radius*dx/dist
+        b[indices] = self.ycenter[part] + radius*dy/dist
+        is_back_facing[indices] = np.where(self.convex[part], dist < radius, dist > radius)
+        return is_back_facing, a, b
+
+    def segment_closest_points(self, segments, xpos, ypos):
+        """Find the closest point of each segment from the given positions, and whether the positions
+        are behind the segments. Merged segments pick one of their halves like
+        GridSegmentMerged.get_closest_point does.
+        """
+        is_back_facing, a, b = self.part_closest_points(self.first_part[segments], xpos, ypos)
+        indices = np.flatnonzero(self.merged[segments])
+        if indices.size:
+            segment = segments[indices]
+            x, y = xpos[indices], ypos[indices]
+            is_back_facing2, a2, b2 = self.part_closest_points(self.second_part[segment], x, y)
+            along = (x - self.xmid[segment])*self.xdir[segment] + (y - self.ymid[segment])*self.ydir[segment]
+            distance1 = square(x - a[indices]) + square(y - b[indices]) - np.where(is_back_facing[indices], 0, 0.1)
+            distance2 = square(x - a2) + square(y - b2) - np.where(is_back_facing2, 0, 0.1)
+            margin = GridSegmentMerged.JUNCTION_MARGIN
+            second = (along > margin) | ((along >= -margin) & (distance2 < distance1))
+            indices = indices[second]
+            is_back_facing[indices] = is_back_facing2[second]
+            a[indices] = a2[second]
+            b[indices] = b2[second]
+        return is_back_facing, a, b
+
+    def closest_points(self, xpos, ypos, radius):
+        """Find the closest point of the segments around each position, like get_single_closest_point.
+        Return the result of each query (0 if no closest point was found, 1 if it belongs to an outside
+        edge, -1 if it belongs to an inside edge) and the coordinates of their closest points.
+        """
+        queries, segments = self.gather(self.segment_starts, self.segment_counts,
+                                        xpos-radius, ypos-radius, xpos+radius, ypos+radius)
+        x, y = xpos[queries], ypos[queries]
+        is_back_facing, a, b = self.segment_closest_points(segments, x, y)
+        distance_sq = square(x - a) + square(y - b)
+        distance_sq[~is_back_facing] -= 0.1 #This is to prioritize correct side collisions when multiple close segments.
+        shortest_distance = np.full(xpos.size, 9999999.0)
+        np.minimum.at(shortest_distance, queries, distance_sq)
+        closest = first_in_ranges(queries, (distance_sq == shortest_distance[queries]) & (distance_sq < 9999999))
+        found = queries[closest]
+        result = np.zeros(xpos.size, dtype=np.intp)
+        result[found] = np.where(is_back_facing[closest], -1, 1)
+        closest_x = np.zeros(xpos.size)
+        closest_y = np.zeros(xpos.size)
+        closest_x[found] = a[closest]
+        closest_y[found] = b[closest]
+        return result, closest_x, closest_y
+
+    def sweep_circle(self, xpos_old, ypos_old, dx, dy, radius):
+        """Return the shortest time of intersection of each moving circle with the segments around
+        it, like sweep_circle_vs_tiles (see the intersect_with_ray methods of the segments).
+        """
+        xpos_new = xpos_old + dx
+        ypos_new = ypos_old + dy
+        width = radius + 1
+        queries, segments = self.gather(self.segment_starts, self.segment_counts,
+                                        np.minimum(xpos_old, xpos_new) - width, np.minimum(ypos_old, ypos_new) - width,
+                                        np.maximum(xpos_old, xpos_new) + width, np.maximum(ypos_old, ypos_new) + width)
+        x, y, vx, vy = xpos_old[queries], ypos_old[queries], dx[queries], dy[queries]
+        vel_sq = (square(dx) + square(dy))[queries]
+        radius_sq = radius**2
+        time = np.minimum(self.circle_times(x, y, vx, vy, vel_sq, self.xend1[segments], self.yend1[segments], radius_sq),
+                          self.circle_times(x, y, vx, vy, vel_sq, self.xend2[segments], self.yend2[segments], radius_sq))
+
+        indices = np.flatnonzero(self.merged[segments])
+        if indices.size:
+            segment = segments[indices]
+            time[indices] = np.minimum(time[indices], self.circle_times(x[indices], y[indices], vx[indices], vy[indices],
+                                       vel_sq[indices], self.xmid[segment], self.ymid[segment], radius_sq))
+
+        indices = np.flatnonzero(~self.segment_circular[segments])
+        time[indices] = np.minimum(time[indices], self.lineseg_times(x[indices], y[indices], vx[indices], vy[indices],
+                                   segments[indices], radius))
+
+        indices = np.flatnonzero(self.segment_circular[segments])
+        if indices.size:
+            time[indices] = np.minimum(time[indices], self.arc_times(x[indices], y[indices], vx[indices], vy[indices],
+                                       vel_sq[indices], segments[indices], radius))
+
+        shortest_time = np.ones(xpos_old.size)
+        np.minimum.at(shortest_time, queries, time)
+        return shortest_time
+
+    @staticmethod
+    def circle_times(xpos, ypos, vx, vy, vel_sq, a, b, radius_sq):
+        """Times of intersection of moving circles with points, see get_time_of_intersection_circle_vs_circle."""
+        dx = xpos - a
+        dy = ypos - b
+        dist_sq = square(dx) + square(dy)
+        dot_prod = dx * vx + dy * vy
+        outside = dist_sq - radius_sq > 0
+        radicand = square(dot_prod) - vel_sq * (dist_sq - radius_sq)
+        time = np.where(outside, 1.0, 0.0)
+        indices = np.flatnonzero(outside & (vel_sq > 0.0001) & (dot_prod < 0) & (radicand >= 0))
+        time[indices] = (-dot_prod[indices] - np.sqrt(radicand[indices])) / vel_sq[indices]
+        return time
+
+    def lineseg_times(self, xpos, ypos, dx, dy, segments, radius):
+        """Times of intersection of moving circles with linear segments, see
+        get_time_of_intersection_circle_vs_lineseg.
+        """
+        a1, b1 = self.xend1[segments], self.yend1[segments]
+        nx, ny = self.xnormal[segments], self.ynormal[segments]
+        seg_len = self.seg_len[segments]
+        normal_proj = (xpos - a1) * ny - (ypos - b1) * nx
+        hor_proj = (xpos - a1) * nx + (ypos - b1) * ny
+        far = np.abs(normal_proj) >= radius
+        time = np.where(~far & (0 <= hor_proj) & (hor_proj <= seg_len), 0.0, 1.0)
+        dir = dx * ny - dy * nx
+        indices = np.flatnonzero(far & (dir * normal_proj < 0))
+        t = (np.abs(normal_proj[indices]) - radius) / np.abs(dir[indices])
+        t = np.where(t > 1, 1, t)
+        hor_proj2 = hor_proj[indices] + t * (dx[indices] * nx[indices] + dy[indices] * ny[indices])
+        time[indices] = np.where((0 <= hor_proj2) & (hor_proj2 <= seg_len[indices]), t, 1)
+        return time
+
+    def arc_times(self, xpos, ypos, vx, vy, vel_sq, segments, radius_circle):
+        """Times of intersection of moving circles with circular segments, see
+        get_time_of_intersection_circle_vs_arc.
+        """
+        dx = xpos - self.segment_xcenter[segments]
+        dy = ypos - self.segment_ycenter[segments]
+        dist_sq = square(dx) + square(dy)
+        dot_prod = dx * vx + dy * vy
+        radius_arc = self.segment_radius[segments]
+        radius1 = square(radius_arc + radius_circle)
+        radius2 = square(radius_arc - radius_circle)
+        outer = dist_sq > radius1
+        inner = ~outer & (dist_sq < radius2)
+        time = np.where(outer | inner, 1.0, 0.0)
+        radicand = square(dot_prod) - vel_sq * (dist_sq - radius1)
+        indices = np.flatnonzero(outer & (vel_sq > 0.0001) & (dot_prod < 0) & (radicand >= 0))
+        time[indices] = (-dot_prod[indices] - np.sqrt(radicand[indices])) / vel_sq[indices]
+        radicand = square(dot_prod) - vel_sq * (dist_sq - radius2)
+        indices = np.flatnonzero(inner & (vel_sq > 0.0001))
+        t = (-dot_prod[indices] + np.sqrt(radicand[indices])) / vel_sq[indices]
+        time[indices] = np.where(t > 1, 1, t)
+        facing = ((dx + time*vx) * self.segment_hor[segments] > 0) & ((dy + time*vy) * self.segment_ver[segments] > 0)
+        return np.where(facing, time, 1)
+
+    def wall_normals(self, xpos, ypos, radius):
+        """Return the normal of the first tile wall within a distance of each position, like
+        find_wall_normal, or 0 where there's no wall that close.
+        """
+        queries, parts = self.gather(self.part_starts, self.part_counts,
+                                     xpos-radius, ypos-radius, xpos+radius, ypos+radius)
+        x, y = xpos[queries], ypos[queries]
+        _, a, b = self.part_closest_points(parts, x, y)
+        dx = x - a
+        dy = y - b
+        dist = np.sqrt(square(dx) + square(dy))
+        close = (np.abs(dy) < 0.00001) & (0 < dist) & (dist <= radius)
+        normal = np.zeros(queries.size)
+        normal[close] = dx[close] / dist[close]
+        walls = first_in_ranges(queries, normal != 0)
+        normals = np.zeros(xpos.size)
+        normals[queries[walls]] = normal[walls]
+        return normals
@@ -47,6 +47,7 @@ sim = Simulator()
 with open("map_data", "rb") as f:
     mapdata = [int(b) for b in f.read()]
 sim.load(mapdata)
+checkpoint = None #Press C to save a checkpoint, and X to go back to it
 inputs = None
 if os.path.isfile("inputs"):
     with open("inputs", "rb") as f:
@@ -174,7 +175,7 @@ def entitydraw(init):
 
     context.set_source_rgb(*hex2float(TILECOLOR))
     context.set_line_width(DOORWIDTH*adjust)
-    for cell in sim.segment_dic.values():
+    for cell in sim.segment_grid:
         for segment in cell:
             if segment.active and segment.type == "linear" and not segment.oriented:
                 context.move_to(segment.x1*adjust, segment.y1*adjust)
@@ -214,7 +215,7 @@ def entitydraw(init):
     context.set_source_rgb(*hex2float(NINJACOLOR))
     context.set_line_width(NINJAWIDTH*adjust)
     context.set_line_cap(cairo.LineCap.ROUND)
-    bones = sim.ninja.bones
+    bones = sim.ninja.get_bones()
     segments = [[bones[limb[0]], bones[limb[1]]] for limb in LIMBS]
     radius = sim.ninja.RADIUS*adjust
     x = sim.ninja.xpos*adjust
@@ -254,12 +255,18 @@ while running:
             hor_input = hor_inputs[sim.frame]
             jump_input = jump_inputs[sim.frame]
     if keys[pygame.K_SPACE]:
-        sim.load(mapdata)
+        sim.reset()
+        checkpoint = None
         running_mode = "playing"
     if keys[pygame.K_r]:
         if inputs:
-            sim.load(mapdata)
+            sim.reset()
+            checkpoint = None
             running_mode = "replaying"
+    if keys[pygame.K_c]:
+        checkpoint = sim.snapshot()
+    if keys[pygame.K_x] and checkpoint:
+        sim.restore(checkpoint)
 
 
     adjust = min(screen.get_width()/SRCWIDTH, screen.get_height()/SRCHEIGHT)
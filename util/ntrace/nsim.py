@@ -1,34 +1,74 @@
-import argparse
 import array
+import functools
 import math
 from itertools import product
 import os.path
 import struct
-import copy
 import random
 import sys
 
-#Create argument parser so that we can pass parameters when executing the tool
-#Run the tool with the -h option to see the complete help
-parser = argparse.ArgumentParser(description='N++ physics clone')
-parser.add_argument('--basic-sim', action='store_true', help='Only simulate entities with physical collision')
-parser.add_argument('--full-export', action='store_true', help="Export coordinates of moving entities")
-parser.add_argument('-t', '--tolerance', type=float, default=1.0, help='Minimum units to consider an entity moved')
-ARGUMENTS = parser.parse_args()
-
-#Simulate ragdoll physics
+#File with the animation data of the ninja, only needed to compute its bones.
 ANIM_DATA = "anim_data_line_new.txt.bin"
-NINJA_ANIM_MODE = not ARGUMENTS.basic_sim and os.path.isfile(ANIM_DATA)
 
-if NINJA_ANIM_MODE:
+#Size of the grids of cells (24x24 units) and half cells (12x12 units) of the level, including the
+#frame. Grids are stored as flat arrays, where the cell (x, y) is at index x*height + y. The grid of
+#cells has an extra column and row, which only hold the segments of the right and bottom edges.
+GRID_WIDTH = 45
+GRID_HEIGHT = 26
+HALF_GRID_WIDTH = 89
+HALF_GRID_HEIGHT = 51
+#Distances between solid grid edges are counted in half cells and capped to this, meaning no edge.
+EDGE_DISTANCE_MAX = 255
+#Events of the collision log, stored one after the other: frame, entity type, entity index and state.
+COLLISION_EVENT = struct.Struct('<HBHB')
+
+
+class SimConfig:
+    """Options of the simulation, shared by every run of a simulator. These are the same as the
+    command line arguments of ntrace, which builds one from them, except for debug, which is only
+    useful when using the simulator directly.
+    """
+
+    def __init__(self, basic_sim=False, full_export=False, tolerance=1.0, score_only=False, seed=0, compact=False,
+                 compress=False, debug=False):
+        self.basic_sim = basic_sim #Only simulate entities with physical collision
+        self.full_export = full_export #Export coordinates of moving entities
+        self.tolerance = tolerance #Minimum units to consider an entity moved
+        self.score_only = score_only #Disable all logging, only the stats of each replay are needed
+        self.seed = seed #Seed for the random choices of the simulation (e.g. victory dances)
+        self.compact = compact #Export the trace in the compact format, with delta encoded coordinates
+        self.compress = compress #Also compress the trace with zlib, which implies the compact format
+        self.debug = debug #Also log the position and speed of the ninja on every frame
+
+    def __repr__(self):
+        return (f"SimConfig(basic_sim={self.basic_sim}, full_export={self.full_export}, "
+                f"tolerance={self.tolerance}, score_only={self.score_only}, seed={self.seed}, compact={self.compact}, "
+                f"compress={self.compress}, debug={self.debug})")
+
+
+@functools.lru_cache(maxsize=None)
+def load_animation():
+    """Return the animation data of the ninja, or None if the file is missing. It's only read the
+    first time it's needed, and then shared by every simulator. The data is a flat read-only array
+    of doubles: the x and y coordinates of each of the 13 bones, for each animation frame. It's
+    returned in a dict by the direction the ninja faces (1 or -1), already mirrored for -1.
+    """
+    if not os.path.isfile(ANIM_DATA):
+        return None
     with open(ANIM_DATA, mode="rb") as f:
         frames = struct.unpack('<L', f.read(4))[0]
-        ninja_animation = [[list(struct.unpack('<2d', f.read(16))) for _ in range(13)] for _ in range(frames)]
+        animation = array.array('d')
+        animation.frombytes(f.read(frames * 13 * 2 * animation.itemsize))
+    if sys.byteorder == "big":
+        animation.byteswap()
+    mirrored = array.array('d', animation)
+    mirrored[::2] = array.array('d', [-x for x in animation[::2]])
+    return {1: memoryview(animation).toreadonly(), -1: memoryview(mirrored).toreadonly()}
 
 
 class Ninja:
     """This class is responsible for updating and storing the positions and velocities of each ninja.
-    self.xposlog and self.yposlog contain all the coordinates used to generate the traces of the replays.
+    self.poslog contains all the coordinates used to generate the traces of the replays, already packed.
     """
 
     #Physics constants for the ninja.
@@ -60,6 +100,18 @@ class Ninja:
                  11:(1306, 1485), 12:(1486, 1605), 13:(1606, 1664), 14:(1665, 1731), 15:(1732, 1810),
                  16:(1811, 1852), 17:(1853, 1946), 18:(1947, 2004), 19:(2005, 2156), 20:(2157, 2241),
                  21:(2242, 2295)}
+    __slots__ = ("sim", "xpos", "ypos", "xspeed", "yspeed", "applied_gravity", "applied_drag",
+                 "applied_friction", "state", "airborn", "airborn_old", "walled", "jump_input_old",
+                 "jump_duration", "jump_buffer", "floor_buffer", "wall_buffer", "launch_pad_buffer",
+                 "wall_normal", "floor_normalized_x", "floor_normalized_y", "ceiling_normalized_x",
+                 "ceiling_normalized_y", "anim_state", "facing", "tilt", "anim_rate", "anim_frame",
+                 "frame_residual", "pose", "bones", "ragdoll", "poslog", "debuglog",
+                 "fractional_frame", "xpos_old", "ypos_old", "xspeed_old", "yspeed_old",
+                 "floor_count", "wall_count", "ceiling_count", "floor_normal_x", "floor_normal_y",
+                 "ceiling_normal_x", "ceiling_normal_y", "is_crushable", "x_crush", "y_crush",
+                 "crush_len", "pose_old", "bones_old", "run_cycle", "death_xpos", "death_ypos", "death_xspeed",
+                 "death_yspeed", "dance_id", "xlp_boost_normalized", "ylp_boost_normalized",
+                 "hor_input", "jump_input")
 
     def __init__(self, sim):
         """Initiate ninja position at spawn point, and initiate other values to their initial state"""
@@ -92,13 +144,12 @@ class Ninja:
         self.anim_rate = 0
         self.anim_frame = 11
         self.frame_residual = 0
-        self.bones = [[0, 0] for _ in range(13)]
+        self.pose = None #Frame of the animation, only turned into bones when they're needed
+        self.bones = None
         self.update_graphics()
         self.ragdoll = Ragdoll()
-        self.poslog = [] #Used for debug
-        self.speedlog = []
-        self.xposlog = [] #Used to produce trace
-        self.yposlog = []
+        self.poslog = array.array('h') #Used to produce trace
+        self.debuglog = array.array('d') #Used for debug
         self.log()
         self.fractional_frame = 0 #More accurate win score
         
@@ -170,10 +221,16 @@ class Ninja:
         self.ypos = self.ypos_old + time * dy
 
         #Find the closest point from the ninja, apply depenetration and update speed. Loop 32 times. 
-        for _ in range(32):
+        self.depenetrate(32)
+
+    def depenetrate(self, iterations):
+        """Push the ninja out of the tile segments it overlaps, one closest point at a time, until it
+        doesn't overlap any or after the given number of iterations.
+        """
+        for _ in range(iterations):
             result, closest_point = get_single_closest_point(self.sim, self.xpos, self.ypos, self.RADIUS)
             if result == 0:
-                break
+                return
             a, b = closest_point
             dx = self.xpos - a
             dy = self.ypos - b
@@ -243,17 +300,8 @@ class Ninja:
                             wall_normal = collision_result                  
 
         #Check if the ninja can interact with walls from nearby tile segments.
-        rad = self.RADIUS + 0.1
-        segments = gather_segments_from_region(self.sim, self.xpos-rad, self.ypos-rad,
-                                                         self.xpos+rad, self.ypos+rad)
-        for segment in segments:
-            result = segment.get_closest_point(self.xpos, self.ypos)
-            a, b = result[1], result[2]
-            dx = self.xpos - a
-            dy = self.ypos - b
-            dist = math.sqrt(dx**2 + dy**2)
-            if abs(dy) < 0.00001 and 0 < dist <= rad and not wall_normal:
-                wall_normal = dx/dist
+        if not wall_normal:
+            wall_normal = find_wall_normal(self.sim, self.xpos, self.ypos, self.RADIUS + 0.1)
 
         #Check if airborn or walled.
         self.airborn_old = self.airborn
@@ -527,10 +575,11 @@ class Ninja:
     def think_awaiting_death(self):
         """Set state to dead and activate ragdoll."""
         self.state = 6
-        bones_speed = [[self.bones[i][0] - self.bones_old[i][0], self.bones[i][1] - self.bones_old[i][1]] for i in range(13)]
+        bones, bones_old = self.get_bones(), self.get_bones_old()
+        bones_speed = [[bones[i][0] - bones_old[i][0], bones[i][1] - bones_old[i][1]] for i in range(13)]
         self.ragdoll.activate(self.xpos, self.ypos, self.xspeed, self.yspeed,
                               self.death_xpos, self.death_ypos, self.death_xspeed, self.death_yspeed,
-                              self.bones, bones_speed)
+                              bones, bones_speed)
 
     def update_graphics(self):
         """Update parameters necessary to draw the limbs of the ninja."""
@@ -590,7 +639,7 @@ class Ninja:
             if self.anim_state == 4:
                 self.anim_frame = 103
             if self.anim_state == 6:
-                self.dance_id = random.choice(list(self.DANCE_DIC)) if self.DANCE_RANDOM else self.DANCE_ID_DEFAULT
+                self.dance_id = self.sim.random.choice(list(self.DANCE_DIC)) if self.DANCE_RANDOM else self.DANCE_ID_DEFAULT
                 self.anim_frame = self.DANCE_DIC[self.dance_id][0]
 
         if self.anim_state == 0:
@@ -611,26 +660,54 @@ class Ninja:
             if self.anim_frame < self.DANCE_DIC[self.dance_id][1]:
                 self.anim_frame += 1
         
+        self.pose_old = self.pose
         self.bones_old = self.bones
-        if NINJA_ANIM_MODE:
-            self.calc_ninja_position()
-    
-    def calc_ninja_position(self):
-        """Calculate the positions of ninja's joints. The positions are fetched from the animation data,
-        after applying mirroring, rotation or interpolation if necessary."""
-        new_bones = copy.deepcopy(ninja_animation[self.anim_frame])
-        if self.anim_state == 1:
-            interpolation = (self.run_cycle % 6) / 6
-            if interpolation > 0:
-                next_bones = ninja_animation[(self.anim_frame - 12)%72 + 12]
-                new_bones = [[new_bones[i][j] + interpolation*(next_bones[i][j] - new_bones[i][j]) for j in range(2)] for i in range(13)]
-        for i in range(13):
-            new_bones[i][0] *= self.facing
-            x, y = new_bones[i]
-            tcos, tsin = math.cos(self.tilt), math.sin(self.tilt)
-            new_bones[i][0] = x*tcos - y*tsin
-            new_bones[i][1] = x*tsin + y*tcos
-        self.bones = new_bones
+        self.update_pose()
+
+    def update_pose(self):
+        """Store the frame of the animation the ninja is in, along with its interpolation, direction and
+        tilt. Only lasers, ragdolls and renderers need the bones, so they're computed from it the first
+        time they're asked for (see get_bones), instead of on every frame."""
+        interpolation = (self.run_cycle % 6) / 6 if self.anim_state == 1 else 0
+        self.pose = (self.anim_frame, interpolation, self.facing, self.tilt)
+        self.bones = None
+
+    def get_bones(self):
+        """Return the positions of ninja's joints on the current frame, relative to its position."""
+        if self.bones is None:
+            self.bones = self.calc_bones(self.pose)
+        return self.bones
+
+    def get_bones_old(self):
+        """Return the positions of ninja's joints on the previous frame, relative to its position."""
+        if self.bones_old is None:
+            self.bones_old = self.calc_bones(self.pose_old)
+        return self.bones_old
+
+    def calc_bones(self, pose):
+        """Calculate the positions of ninja's joints in a pose. The positions are fetched from the animation
+        data, already mirrored, after applying rotation or interpolation if necessary. They're all 0 if
+        there's no animation data, or before the first frame."""
+        animation = self.sim.animation
+        if animation is None or pose is None:
+            return [[0, 0] for _ in range(13)]
+        anim_frame, interpolation, facing, tilt = pose
+        frames = animation.get(facing)
+        scale = 1
+        if frames is None: #Facing away from a wall whose normal isn't exactly horizontal.
+            frames = animation[1]
+            scale = facing
+        frame = anim_frame*26
+        coords = frames[frame:frame + 26].tolist()
+        if interpolation > 0:
+            next_frame = ((anim_frame - 12)%72 + 12)*26
+            coords = [coord + interpolation*(next_coord - coord) for coord, next_coord in zip(coords, frames[next_frame:next_frame + 26])]
+        tcos, tsin = math.cos(tilt), math.sin(tilt)
+        bones = []
+        for i in range(0, 26, 2):
+            x, y = coords[i]*scale, coords[i + 1]
+            bones.append([x*tcos - y*tsin, x*tsin + y*tcos])
+        return bones
 
     def win(self):
         """Set ninja's state to celebrating."""
@@ -655,17 +732,22 @@ class Ninja:
         return not self.state in (6, 8, 9)
 
     def log(self):
-        """Log position and velocity vectors of the ninja for the current frame"""
-        self.poslog.append((self.sim.frame, round(self.xpos, 6), round(self.ypos, 6)))
-        self.speedlog.append((self.sim.frame, round(self.xspeed, 6), round(self.yspeed, 6)))
-        self.xposlog.append(self.xpos)
-        self.yposlog.append(self.ypos)
+        """Log the position of the ninja for the current frame, packed like in the trace. The position
+        and velocity vectors are also logged as they are when debugging, 4 values per frame.
+        """
+        if self.sim.config.score_only:
+            return
+        self.poslog.extend((pack_coord(self.xpos), pack_coord(self.ypos)))
+        if self.sim.config.debug:
+            self.debuglog.extend((self.xpos, self.ypos, self.xspeed, self.yspeed))
 
 
 class Ragdoll:
     """None of this is working yet. Might never will."""
     GRAVITY = 0.06666666666666665
     DRAG = 0.99999
+    __slots__ = ("state", "num", "bones_pos_old", "bones_speed_old", "bones_pos", "bones_speed",
+                 "segs")
 
     def __init__(self):
         self.state = 0
@@ -718,6 +800,8 @@ class Ragdoll:
 
 class GridSegmentLinear:
     """Contains all the linear segments of tiles and doors that the ninja can interract with"""
+    __slots__ = ("x1", "y1", "x2", "y2", "oriented", "active", "type", "parts")
+
     def __init__(self, p1, p2, oriented=True):
         """Initiate an instance of a linear segment of a tile. 
         Each segment is defined by the coordinates of its two end points.
@@ -729,6 +813,7 @@ class GridSegmentLinear:
         self.oriented = oriented
         self.active = True
         self.type = "linear"
+        self.parts = (self,)
 
     def get_closest_point(self, xpos, ypos):
         """Find the closest point on the segment from the given position.
@@ -760,9 +845,57 @@ class GridSegmentLinear:
                                                            self.x2, self.y2, radius)
         return min(time1, time2, time3)
 
+
+
+class GridSegmentMerged(GridSegmentLinear):
+    """Two halves of an edge of a cell, merged into a single segment when the level is compiled.
+    The result is the same as with the two halves: the closest point is computed on the half that
+    contains the projection of the position, and the point where they meet is still an end point
+    when each half is checked separately (see parts). The first half is the left or upper one.
+    """
+    JUNCTION_MARGIN = 0.00001 #Closer than this to the middle, both halves are checked.
+    __slots__ = ("xdir", "ydir", "xmid", "ymid")
+
+    def __init__(self, half1, half2):
+        if (half1.x2, half1.y2) == (half2.x1, half2.y1):
+            super().__init__((half1.x1, half1.y1), (half2.x2, half2.y2))
+            self.xmid, self.ymid = half1.x2, half1.y2
+        else:
+            super().__init__((half2.x1, half2.y1), (half1.x2, half1.y2))
+            self.xmid, self.ymid = half1.x1, half1.y1
+        self.xdir = 1 if self.y1 == self.y2 else 0
+        self.ydir = 1 - self.xdir
+        self.parts = (half1, half2)
+
+    def get_closest_point(self, xpos, ypos):
+        """Find the closest point on the segment from the given position, in the same way as the
+        closest of the two halves would. On a tie, the first half was the one checked first.
+        """
+        half1, half2 = self.parts
+        along = (xpos - self.xmid)*self.xdir + (ypos - self.ymid)*self.ydir
+        if along < -self.JUNCTION_MARGIN:
+            return half1.get_closest_point(xpos, ypos)
+        if along > self.JUNCTION_MARGIN:
+            return half2.get_closest_point(xpos, ypos)
+        result1 = half1.get_closest_point(xpos, ypos)
+        result2 = half2.get_closest_point(xpos, ypos)
+        distance1 = (xpos - result1[1])**2 + (ypos - result1[2])**2 - (0 if result1[0] else 0.1)
+        distance2 = (xpos - result2[1])**2 + (ypos - result2[2])**2 - (0 if result2[0] else 0.1)
+        return result2 if distance2 < distance1 else result1
+
+    def intersect_with_ray(self, xpos, ypos, dx, dy, radius):
+        """Return the time of intersection with a moving circle, like for linear segments. The point
+        where the halves meet is also checked, since it was an end point of both.
+        """
+        time = get_time_of_intersection_circle_vs_circle(xpos, ypos, dx, dy, self.xmid, self.ymid, radius)
+        return min(time, super().intersect_with_ray(xpos, ypos, dx, dy, radius))
+
     
 class GridSegmentCircular:
     """Contains all the circular segments of tiles that the ninja can interract with"""
+    __slots__ = ("xpos", "ypos", "hor", "ver", "radius", "p_hor", "p_ver", "active", "type",
+                 "parts", "convex")
+
     def __init__(self, center, quadrant, convex, radius=24):
         """Initiate an instance of a circular segment of a tile. 
         Each segment is defined by the coordinates of its center, a vector indicating which
@@ -778,6 +911,7 @@ class GridSegmentCircular:
         self.p_ver = (self.xpos, self.ypos + self.radius*self.ver)
         self.active = True
         self.type = "circular"
+        self.parts = (self,)
         self.convex = convex
 
     def get_closest_point(self, xpos, ypos):
@@ -814,6 +948,14 @@ class GridSegmentCircular:
 class Entity:
     """Class that all entity types (gold, bounce blocks, thwumps, etc.) inherit from."""
     entity_counts = [0] * 40
+    is_logical_collidable = False
+    is_physical_collidable = False
+    is_movable = False
+    is_thinkable = False
+    log_collisions = True
+    __slots__ = ("type", "index", "sim", "xpos", "ypos", "poslog", "active", "log_positions",
+                 "cell", "last_exported_state", "last_exported_frame", "last_exported_coords",
+                 "exported_chunks")
 
     def __init__(self, type, sim, xcoord, ycoord):
         """Inititate a member from map data"""
@@ -825,12 +967,7 @@ class Entity:
         self.ypos = ycoord*6
         self.poslog = array.array('h')
         self.active = True
-        self.is_logical_collidable = False
-        self.is_physical_collidable = False
-        self.is_movable = False
-        self.is_thinkable = False
         self.log_positions = False
-        self.log_collisions = True
         self.cell = clamp_cell(math.floor(self.xpos / 24), math.floor(self.ypos / 24))
         self.last_exported_state = None
         self.last_exported_frame = None
@@ -843,24 +980,42 @@ class Entity:
         """
         cell_new = clamp_cell(math.floor(self.xpos / 24), math.floor(self.ypos / 24))
         if cell_new != self.cell:
-            self.sim.grid_entity[self.cell].remove(self)
+            del self.sim.grid_entity[self.cell][self]
+            self.sim.forget_entity_neighbourhoods(self.cell)
             self.cell = cell_new
-            self.sim.grid_entity[self.cell].append(self)
+            self.sim.grid_entity[self.cell][self] = None
+            self.sim.forget_entity_neighbourhoods(self.cell)
+
+    def deactivate(self):
+        """Make the entity inactive, and remove it from the lists of entities updated every frame.
+        The lists are replaced instead of modified, so that a loop going through them isn't disturbed.
+        """
+        self.active = False
+        sim = self.sim
+        sim.forget_entity_neighbourhoods(self.cell)
+        if self.is_movable:
+            sim.movers = [entity for entity in sim.movers if entity is not self]
+        if self.is_thinkable:
+            sim.thinkers = [entity for entity in sim.thinkers if entity is not self]
+        if self.log_positions:
+            sim.loggers = [entity for entity in sim.loggers if entity is not self]
 
     def log_collision(self, state=1):
         """Log an interaction with this entity"""
+        if self.sim.config.score_only:
+            return
         if self.log_collisions and self.sim.frame > 0 and state != self.last_exported_state:
-            self.sim.collisionlog.append(struct.pack('<HBHB', self.sim.frame, self.type, self.index, state))
+            self.sim.collisionlog += COLLISION_EVENT.pack(self.sim.frame, self.type, self.index, state)
             self.last_exported_state = state
 
     def log_position(self):
         """Log position of entity on current frame"""
         # Only export position if enabled and the entity has moved enough
-        if not (self.active and self.log_positions):
+        if self.sim.config.score_only or not (self.active and self.log_positions):
             return
         last = self.last_exported_coords
         dist = abs(last[0] - self.xpos) + abs(last[1] - self.ypos) if last else 0
-        if last and dist < ARGUMENTS.tolerance:
+        if last and dist < self.sim.config.tolerance:
             return
 
         # Determine if a new chunk needs to be started or the last one extended
@@ -877,11 +1032,12 @@ class Entity:
 class EntityToggleMine(Entity):
     """This class handles both toggle mines (untoggled state) and regular mines (toggled state)."""
     RADII = {0:4, 1:3.5, 2:4.5} #0:toggled, 1:untoggled, 2:toggling
+    is_thinkable = True
+    is_logical_collidable = True
+    __slots__ = ("state", "RADIUS")
 
     def __init__(self, type, sim, xcoord, ycoord, state):
         super().__init__(type, sim, xcoord, ycoord)
-        self.is_thinkable = True
-        self.is_logical_collidable = True
         self.set_state(state)
 
     def think(self):
@@ -921,11 +1077,9 @@ class EntityToggleMine(Entity):
 
 class EntityGold(Entity):
     RADIUS = 6
+    is_logical_collidable = True
+    __slots__ = ()
 
-    def __init__(self, type, sim, xcoord, ycoord):
-        super().__init__(type, sim, xcoord, ycoord)
-        self.is_logical_collidable = True
-        
     def logical_collision(self):
         """The gold is collected if touches by a ninja that is not in winning state."""
         ninja = self.sim.ninja
@@ -933,16 +1087,14 @@ class EntityGold(Entity):
             if overlap_circle_vs_circle(self.xpos, self.ypos, self.RADIUS,
                                         ninja.xpos, ninja.ypos, ninja.RADIUS):
                 self.sim.gold_collected += 1
-                self.active = False
+                self.deactivate()
                 self.log_collision()
 
 
 class EntityExit(Entity):
     RADIUS = 12
-
-    def __init__(self, type, sim, xcoord, ycoord):
-        super().__init__(type, sim, xcoord, ycoord)
-        self.is_logical_collidable = True
+    is_logical_collidable = True
+    __slots__ = ()
 
     def logical_collision(self):
         """The ninja wins if it touches the exit door. The door is not interactable from the entity
@@ -960,10 +1112,11 @@ class EntityExit(Entity):
 
 class EntityExitSwitch(Entity):
     RADIUS = 6
+    is_logical_collidable = True
+    __slots__ = ("parent",)
 
     def __init__(self, type, sim, xcoord, ycoord, parent):
         super().__init__(type, sim, xcoord, ycoord)
-        self.is_logical_collidable = True
         self.parent = parent
 
     def logical_collision(self):
@@ -973,16 +1126,20 @@ class EntityExitSwitch(Entity):
         ninja = self.sim.ninja
         if overlap_circle_vs_circle(self.xpos, self.ypos, self.RADIUS,
                                     ninja.xpos, ninja.ypos, ninja.RADIUS):
-            self.active = False
-            self.sim.grid_entity[self.parent.cell].append(self.parent) #Add door to the entity grid so the ninja can touch it
+            self.deactivate()
+            self.sim.grid_entity[self.parent.cell][self.parent] = None #Add door to the entity grid so the ninja can touch it
+            self.sim.forget_entity_neighbourhoods(self.parent.cell)
             self.log_collision()
 
 
 class EntityDoorBase(Entity):
     """Parent class that all door type entities inherit from : regular doors, locked doors, trap doors."""
+    is_logical_collidable = True
+    __slots__ = ("closed", "orientation", "sw_xpos", "sw_ypos", "is_vertical", "grid_edges",
+                 "segment")
+
     def __init__(self, type, sim, xcoord, ycoord, orientation, sw_xcoord, sw_ycoord):
         super().__init__(type, sim, xcoord, ycoord)
-        self.is_logical_collidable = True
         self.closed = True
         self.orientation = orientation
         self.sw_xpos = 6 * sw_xcoord
@@ -990,29 +1147,26 @@ class EntityDoorBase(Entity):
         self.is_vertical = orientation in (0, 4)
         vec = map_orientation_to_vector(orientation)
         #Find the cell that the door is in for the grid segment.
-        door_xcell = math.floor((self.xpos - 12*vec[0]) / 24)
-        door_ycell = math.floor((self.ypos - 12*vec[1]) / 24)
-        door_cell = clamp_cell(door_xcell, door_ycell)
+        door_xcell = clamp(math.floor((self.xpos - 12*vec[0]) / 24), 0, 43)
+        door_ycell = clamp(math.floor((self.ypos - 12*vec[1]) / 24), 0, 24)
+        door_cell = door_xcell*GRID_HEIGHT + door_ycell
         #Find the half cell of the door for the grid edges.
-        door_half_xcell = 2*(door_cell[0] + 1)
-        door_half_ycell = 2*(door_cell[1] + 1)
+        door_half_xcell = 2*(door_xcell + 1)
+        door_half_ycell = 2*(door_ycell + 1)
         #Create the grid segment and grid edges.
         self.grid_edges = []
         if self.is_vertical:
             self.segment = GridSegmentLinear((self.xpos, self.ypos-12), (self.xpos, self.ypos+12),
                                              oriented=False)
-            self.grid_edges.append((door_half_xcell, door_half_ycell-2))
-            self.grid_edges.append((door_half_xcell, door_half_ycell-1))
-            for grid_edge in self.grid_edges:
-                sim.ver_grid_edge_dic[grid_edge] += 1
+            self.grid_edges.append(door_half_xcell*HALF_GRID_HEIGHT + door_half_ycell-2)
+            self.grid_edges.append(door_half_xcell*HALF_GRID_HEIGHT + door_half_ycell-1)
         else:
             self.segment = GridSegmentLinear((self.xpos-12, self.ypos), (self.xpos+12, self.ypos),
                                              oriented=False)
-            self.grid_edges.append((door_half_xcell-2, door_half_ycell))
-            self.grid_edges.append((door_half_xcell-1, door_half_ycell))
-            for grid_edge in self.grid_edges:
-                sim.hor_grid_edge_dic[grid_edge] += 1
-        sim.segment_dic[door_cell].append(self.segment)
+            self.grid_edges.append((door_half_xcell-2)*HALF_GRID_HEIGHT + door_half_ycell)
+            self.grid_edges.append((door_half_xcell-1)*HALF_GRID_HEIGHT + door_half_ycell)
+        sim.change_grid_edges(self.is_vertical, self.grid_edges, 1)
+        sim.add_door_segment(door_cell, self.segment)
         #Update position and cell so it corresponds to the switch and not the door.
         self.xpos = self.sw_xpos
         self.ypos = self.sw_ypos
@@ -1023,19 +1177,16 @@ class EntityDoorBase(Entity):
         self.closed = closed
         self.segment.active = closed
         self.log_collision(0 if closed else 1)
-        for grid_edge in self.grid_edges:
-            if self.is_vertical:
-                self.sim.ver_grid_edge_dic[grid_edge] += 1 if closed else -1
-            else:
-                self.sim.hor_grid_edge_dic[grid_edge] += 1 if closed else -1
+        self.sim.change_grid_edges(self.is_vertical, self.grid_edges, 1 if closed else -1)
 
 
 class EntityDoorRegular(EntityDoorBase):
     RADIUS = 10
+    is_thinkable = True
+    __slots__ = ("open_timer",)
 
     def __init__(self, type, sim, xcoord, ycoord, orientation, sw_xcoord, sw_ycoord):
         super().__init__(type, sim, xcoord, ycoord, orientation, sw_xcoord, sw_ycoord)
-        self.is_thinkable = True
         self.open_timer = 0
 
     def think(self):
@@ -1059,6 +1210,7 @@ class EntityDoorRegular(EntityDoorBase):
 
 class EntityDoorLocked(EntityDoorBase):
     RADIUS = 5
+    __slots__ = ()
 
     def __init__(self, type, sim, xcoord, ycoord, orientation, sw_xcoord, sw_ycoord):
         super().__init__(type, sim, xcoord, ycoord, orientation, sw_xcoord, sw_ycoord)
@@ -1069,11 +1221,12 @@ class EntityDoorLocked(EntityDoorBase):
         if overlap_circle_vs_circle(self.xpos, self.ypos, self.RADIUS,
                                     ninja.xpos, ninja.ypos, ninja.RADIUS):
             self.change_state(closed = False)
-            self.active = False
+            self.deactivate()
 
 
 class EntityDoorTrap(EntityDoorBase):
     RADIUS = 5
+    __slots__ = ()
 
     def __init__(self, type, sim, xcoord, ycoord, orientation, sw_xcoord, sw_ycoord):
         super().__init__(type, sim, xcoord, ycoord, orientation, sw_xcoord, sw_ycoord)
@@ -1085,16 +1238,17 @@ class EntityDoorTrap(EntityDoorBase):
         if overlap_circle_vs_circle(self.xpos, self.ypos, self.RADIUS,
                                     ninja.xpos, ninja.ypos, ninja.RADIUS):
             self.change_state(closed = True)
-            self.active = False
+            self.deactivate()
 
 
 class EntityLaunchPad(Entity):
     RADIUS = 6
     BOOST = 36/7
+    is_logical_collidable = True
+    __slots__ = ("orientation", "normal_x", "normal_y")
 
     def __init__(self, type, sim, xcoord, ycoord, orientation):
         super().__init__(type, sim, xcoord, ycoord)
-        self.is_logical_collidable = True
         self.orientation = orientation
         self.normal_x, self.normal_y = map_orientation_to_vector(orientation)
 
@@ -1116,11 +1270,12 @@ class EntityLaunchPad(Entity):
 
 class EntityOneWayPlatform(Entity):
     SEMI_SIDE = 12
+    is_logical_collidable = True
+    is_physical_collidable = True
+    __slots__ = ("orientation", "normal_x", "normal_y")
 
     def __init__(self, type, sim, xcoord, ycoord, orientation):
         super().__init__(type, sim, xcoord, ycoord)
-        self.is_logical_collidable = True
-        self.is_physical_collidable = True
         self.orientation = orientation
         self.normal_x, self.normal_y = map_orientation_to_vector(orientation)
 
@@ -1165,11 +1320,12 @@ class EntityDroneBase(Entity):
     #Patrolling modes : {0:follow wall CW, 1:follow wall CCW, 2:wander CW, 3:wander CCW}
     #Directions : {0:keep forward, 1:turn right, 2:go backward, 3:turn left}
     DIR_LIST = {0:[1, 0, 3, 2], 1:[3, 0, 1, 2], 2:[0, 1, 3, 2], 3:[0, 3, 1, 2]}
+    is_movable = True
+    __slots__ = ("speed", "dir", "mode", "xtarget", "ytarget", "xpos2", "ypos2", "dir_old")
 
     def __init__(self, type, sim, xcoord, ycoord, orientation, mode, speed):
         super().__init__(type, sim, xcoord, ycoord)
-        self.log_positions = ARGUMENTS.full_export
-        self.is_movable = True
+        self.log_positions = sim.config.full_export
         self.speed = speed
         self.dir = None
         self.turn(orientation // 2)
@@ -1181,7 +1337,7 @@ class EntityDroneBase(Entity):
         """Change the drone's direction and log it."""
         self.dir_old = self.dir or dir
         self.dir = dir
-        if ARGUMENTS.full_export:
+        if self.sim.config.full_export:
             self.log_collision(dir)
 
     def move(self):
@@ -1234,27 +1390,25 @@ class EntityDroneBase(Entity):
             cell_xtarget = math.floor((xtarget + xdir*self.RADIUS) / 12)
             cell_y1 = math.floor((self.ypos - self.RADIUS) / 12)
             cell_y2 = math.floor((self.ypos + self.RADIUS) / 12)
-            while cell_x != cell_xtarget:
-                if not is_empty_column(self.sim, cell_x, cell_y1, cell_y2, xdir):
-                    return False
-                cell_x += xdir
+            if count_empty_columns(self.sim, cell_x, cell_y1, cell_y2, xdir) < (cell_xtarget - cell_x) * xdir:
+                return False
         else:
             cell_y = math.floor((self.ypos + ydir*self.RADIUS) / 12)
             cell_ytarget = math.floor((ytarget + ydir*self.RADIUS) / 12)
             cell_x1 = math.floor((self.xpos - self.RADIUS) / 12)
             cell_x2 = math.floor((self.xpos + self.RADIUS) / 12)
-            while cell_y != cell_ytarget:
-                if not is_empty_row(self.sim, cell_x1, cell_x2, cell_y, ydir):
-                    return False
-                cell_y += ydir
+            if count_empty_rows(self.sim, cell_x1, cell_x2, cell_y, ydir) < (cell_ytarget - cell_y) * ydir:
+                return False
         self.xtarget, self.ytarget = xtarget, ytarget
         return True
 
 
 class EntityDroneZap(EntityDroneBase):
+    is_logical_collidable = True
+    __slots__ = ()
+
     def __init__(self, type, sim, xcoord, ycoord, orientation, mode):
         super().__init__(type, sim, xcoord, ycoord, orientation, mode, 8/7)
-        self.is_logical_collidable = True
     
     def logical_collision(self):
         """Kill the ninja if it touches the regular drone."""
@@ -1266,9 +1420,11 @@ class EntityDroneZap(EntityDroneBase):
 
 
 class EntityDroneChaser(EntityDroneZap):
+    is_thinkable = True
+    __slots__ = ("speed_slow", "speed_chase", "chasing")
+
     def __init__(self, type, sim, xcoord, ycoord, orientation, mode):
         super().__init__(type, sim, xcoord, ycoord, orientation, mode)
-        self.is_thinkable = True
         self.speed_slow = self.speed
         self.speed_chase = 2 * self.speed
         self.chasing = False
@@ -1295,13 +1451,14 @@ class EntityBounceBlock(Entity):
     STIFFNESS = 0.02222222222222222
     DAMPENING = 0.98
     STRENGTH = 0.2
+    is_physical_collidable = True
+    is_logical_collidable = True
+    is_movable = True
+    __slots__ = ("xspeed", "yspeed", "xorigin", "yorigin")
 
     def __init__(self, type, sim, xcoord, ycoord):
         super().__init__(type, sim, xcoord, ycoord)
-        self.log_positions = ARGUMENTS.full_export
-        self.is_physical_collidable = True
-        self.is_logical_collidable = True
-        self.is_movable = True
+        self.log_positions = sim.config.full_export
         self.xspeed, self.yspeed = 0, 0
         self.xorigin, self.yorigin = self.xpos, self.ypos
         
@@ -1346,14 +1503,15 @@ class EntityThwump(Entity):
     SEMI_SIDE = 9
     FORWARD_SPEED = 20/7
     BACKWARD_SPEED = 8/7
+    is_movable = True
+    is_thinkable = True
+    is_logical_collidable = True
+    is_physical_collidable = True
+    __slots__ = ("orientation", "is_horizontal", "direction", "xorigin", "yorigin", "state")
 
     def __init__(self, type, sim, xcoord, ycoord, orientation):
         super().__init__(type, sim, xcoord, ycoord)
-        self.log_positions = ARGUMENTS.full_export
-        self.is_movable = True
-        self.is_thinkable = True
-        self.is_logical_collidable = True
-        self.is_physical_collidable = True
+        self.log_positions = sim.config.full_export
         self.orientation = orientation
         self.is_horizontal = orientation in (0, 4)
         self.direction = 1 if orientation in (0, 2) else -1
@@ -1363,7 +1521,7 @@ class EntityThwump(Entity):
     def set_state(self, state):
         """Set the thwump's state and log it. 0:immobile, 1:forward, -1:backward"""
         self.state = state
-        if ARGUMENTS.full_export:
+        if self.sim.config.full_export:
             self.log_collision(state % 3) #The logged value goes from 0 to 2
 
     def move(self):
@@ -1420,12 +1578,11 @@ class EntityThwump(Entity):
                     thwump_xcell2 = math.floor((self.xpos + 11) / 12)
                     dy = ninja_ycell - thwump_ycell
                     if dy * self.direction >= 0:
-                        for i in range(100):
-                            if not is_empty_row(self.sim, thwump_xcell1, thwump_xcell2, thwump_ycell, self.direction):
-                                dy = ninja_ycell - thwump_ycell
-                                break
-                            thwump_ycell += self.direction
-                        if i > 0 and dy * self.direction <= 0:
+                        #Look for a solid edge up to 100 rows ahead, and charge if the ninja is before it.
+                        steps = count_empty_rows(self.sim, thwump_xcell1, thwump_xcell2, thwump_ycell, self.direction)
+                        if steps < 100:
+                            dy = ninja_ycell - (thwump_ycell + steps * self.direction)
+                        if steps > 0 and dy * self.direction <= 0:
                             self.set_state(1)
             else:
                 if abs(self.ypos - ninja.ypos) < activation_range: #If the ninja is in the activation range
@@ -1435,12 +1592,11 @@ class EntityThwump(Entity):
                     thwump_ycell2 = math.floor((self.ypos + 11) / 12)
                     dx = ninja_xcell - thwump_xcell
                     if dx * self.direction >= 0:
-                        for i in range(100):
-                            if not is_empty_column(self.sim, thwump_xcell, thwump_ycell1, thwump_ycell2, self.direction):
-                                dx = ninja_xcell - thwump_xcell
-                                break
-                            thwump_xcell += self.direction
-                        if i > 0 and dx * self.direction <= 0:
+                        #Look for a solid edge up to 100 columns ahead, and charge if the ninja is before it.
+                        steps = count_empty_columns(self.sim, thwump_xcell, thwump_ycell1, thwump_ycell2, self.direction)
+                        if steps < 100:
+                            dx = ninja_xcell - (thwump_xcell + steps * self.direction)
+                        if steps > 0 and dx * self.direction <= 0:
                             self.set_state(1)
 
     def physical_collision(self):
@@ -1478,10 +1634,11 @@ class EntityLaser(Entity):
     SPIN_SPEED = 0.010471975 #roughly 2pi/600
     SURFACE_FLAT_SPEED = 0.1
     SURFACE_CORNER_SPEED = 0.005524805665672641 #roughly 0.1/(5.9*pi)
+    is_thinkable = True
+    __slots__ = ("len", "angle", "mode", "xend", "yend", "dir", "xvec", "yvec", "sx", "sy")
 
     def __init__(self, type, sim, xcoord, ycoord, orientation, mode):
         super().__init__(type, sim, xcoord, ycoord)
-        self.is_thinkable = True
         #Find out what is the laser mode : spinner or surface. Surface mode if segment close enough.
         result, closest_point = get_single_closest_point(self.sim, self.xpos, self.ypos, 12)
         if result == -1:
@@ -1565,10 +1722,11 @@ class EntityLaser(Entity):
 
 class EntityBoostPad(Entity):
     RADIUS = 6
+    is_movable = True
+    __slots__ = ("is_touching_ninja",)
 
     def __init__(self, type, sim, xcoord, ycoord):
         super().__init__(type, sim, xcoord, ycoord)
-        self.is_movable = True
         self.is_touching_ninja = False
 
     def move(self):
@@ -1598,12 +1756,14 @@ class EntityDeathBall(Entity):
     MAX_SPEED = 0.85
     DRAG_MAX_SPEED = 0.9
     DRAG_NO_TARGET = 0.95
+    BOUNCE_DISTANCE = 16 #balls closer than this bounce against each other
+    is_thinkable = True
+    is_logical_collidable = True
+    __slots__ = ("xspeed", "yspeed")
 
     def __init__(self, type, sim, xcoord, ycoord):
         super().__init__(type, sim, xcoord, ycoord)
-        self.log_positions = ARGUMENTS.full_export
-        self.is_thinkable = True
-        self.is_logical_collidable = True
+        self.log_positions = sim.config.full_export
         self.xspeed, self.yspeed = 0, 0
 
     def think(self):
@@ -1677,12 +1837,11 @@ class EntityDeathBall(Entity):
         #Handle bounces with other deathballs
         db_count = self.sim.map_data[1200]
         if self.index + 1 < db_count:
-            db_targets = self.sim.entity_dic[self.type][self.index+1:]
-            for db_target in db_targets:
+            for db_target in self.gather_bounce_targets():
                 dx = self.xpos - db_target.xpos
                 dy = self.ypos - db_target.ypos
                 dist = math.sqrt(dx**2 + dy**2)
-                if dist < 16:
+                if dist < self.BOUNCE_DISTANCE:
                     dx = dx / dist * 4
                     dy = dy / dist * 4
                     self.xspeed += dx
@@ -1690,6 +1849,25 @@ class EntityDeathBall(Entity):
                     db_target.xspeed -= dx
                     db_target.yspeed -= dy
         self.grid_move()
+
+    def gather_bounce_targets(self):
+        """Return the balls after this one that may be close enough to bounce against it, in order.
+        Balls only move when they think, so those after this one are still where they were at the
+        start of the frame. Then, the balls are hashed into square buckets as wide as the bounce
+        distance, and only the buckets around this one need to be checked.
+        """
+        buckets = self.sim.deathball_buckets
+        if buckets is None:
+            buckets = self.sim.deathball_buckets = {}
+            for ball in self.sim.entity_dic[self.type]:
+                key = (math.floor(ball.xpos / self.BOUNCE_DISTANCE), math.floor(ball.ypos / self.BOUNCE_DISTANCE))
+                buckets.setdefault(key, []).append(ball)
+        xbucket = math.floor(self.xpos / self.BOUNCE_DISTANCE)
+        ybucket = math.floor(self.ypos / self.BOUNCE_DISTANCE)
+        targets = [ball for key in product((xbucket - 1, xbucket, xbucket + 1), (ybucket - 1, ybucket, ybucket + 1))
+                   for ball in buckets.get(key, ()) if ball.index > self.index]
+        targets.sort(key=lambda ball: ball.index)
+        return targets
         
     def logical_collision(self):
         """If the ninja touches the ball, kill it and make the ball bounce from it."""
@@ -1706,11 +1884,13 @@ class EntityDeathBall(Entity):
 
 
 class EntityMiniDrone(EntityDroneBase):
+    RADIUS = 4
+    GRID_WIDTH = 12
+    is_logical_collidable = True
+    __slots__ = ()
+
     def __init__(self, type, sim, xcoord, ycoord, orientation, mode):
         super().__init__(type, sim, xcoord, ycoord, orientation, mode, 1.3)
-        self.is_logical_collidable = True
-        self.RADIUS = 4
-        self.GRID_WIDTH = 12
     
     def logical_collision(self):
         """Kill the ninja if it touches the mini drone."""
@@ -1724,13 +1904,14 @@ class EntityMiniDrone(EntityDroneBase):
 class EntityShoveThwump(Entity):
     SEMI_SIDE = 12 
     RADIUS = 8 #for the projectile inside
+    is_thinkable = True
+    is_logical_collidable = True
+    is_physical_collidable = True
+    __slots__ = ("xorigin", "yorigin", "xdir", "ydir", "activated", "state")
 
     def __init__(self, type, sim, xcoord, ycoord):
         super().__init__(type, sim, xcoord, ycoord)
-        self.log_positions = ARGUMENTS.full_export
-        self.is_thinkable = True
-        self.is_logical_collidable = True
-        self.is_physical_collidable = True
+        self.log_positions = sim.config.full_export
         self.xorigin, self.yorigin = self.xpos, self.ypos
         self.xdir, self.ydir = 0, 0
         self.set_state(0) #0:immobile, 1:activated, 2:launching, 3:retreating
@@ -1740,7 +1921,7 @@ class EntityShoveThwump(Entity):
         """Changes the state of the shwump. 0:immobile, 1:activated, 2:launching, 3:retreating
         Also logs it, combined with the direction information into a single integer."""
         self.state = state
-        if ARGUMENTS.full_export:
+        if self.sim.config.full_export:
             dir = map_vector_to_orientation(self.xdir, self.ydir)
             self.log_collision(4 * state + dir // 2)
 
@@ -1899,133 +2080,58 @@ class Simulator:
                                  14:((24, 24), (-1, -1), False), 15:((0, 24), (1, -1), False),
                                  16:((0, 0), (1, 1), False), 17:((24, 0), (-1, 1), False)}
       
+    #Append-only logs of the ninja and the entities, which snapshots only store the length of.
+    NINJA_LOGS = ("poslog", "debuglog")
+    ENTITY_LOGS = ("poslog", "exported_chunks")
+
+    def __init__(self, config=None):
+        """Create a simulator with the given options (a SimConfig), or the default ones. The animation
+        data of the ninja is only needed to compute its bones, so it's not loaded in basic sim.
+        """
+        self.config = config or SimConfig()
+        self.animation = None if self.config.basic_sim else load_animation()
+
     def load(self, map_data):
-        """From the given map data, initiate the level geometry, the entities and the ninja."""
+        """From the given map data, initiate the level geometry, the entities and the ninja.
+        The static geometry of each level is only compiled once, and then shared by all its runs.
+        """
+        self.level = CompiledLevel.get(map_data)
+        self.reset()
+
+    def reset(self):
+        """Start a new run on the loaded level. Only the state that can change during a run is
+        initiated here: the grid edges and segments (which doors modify), the entities and the ninja.
+        """
+        level = self.level
         self.frame = 0
-        self.collisionlog = []
+        self.random = random.Random(self.config.seed) #Seeded on each load so that results are reproducible
+        self.collisionlog = bytearray() #Packed collision events, see COLLISION_EVENT
         self.gold_collected = 0
-
-        #initiate a dictionary mapping each tile id to its cell. Start by filling it with full tiles (id of 1).
-        self.tile_dic = {}
-        for x in range(44):
-            for y in range(25):
-                self.tile_dic[(x, y)] = 1
-        
-        #Initiate dictionaries and list containing interactable segments and entities
-        self.segment_dic = {}
-        for x in range(45):
-            for y in range(26):
-                self.segment_dic[(x, y)] = []
-        self.grid_entity = {}
-        for x in range(44):
-            for y in range(25):
-                self.grid_entity[(x, y)] = []
+        self.map_data = level.map_data
+        self.tile_dic = level.tile_dic
+        self.hor_segment_dic = level.hor_segment_dic
+        self.ver_segment_dic = level.ver_segment_dic
+
+        #Copy the geometry that doors can modify, and initiate the containers of entities.
+        self.segment_grid = [[*segments] for segments in level.segment_grid]
+        self.hor_grid_edges = array.array('b', level.hor_grid_edges) #Signed, since doors add and subtract
+        self.ver_grid_edges = array.array('b', level.ver_grid_edges)
+        self.column_distances = {} #Distances between solid edges, measured when first needed.
+        self.row_distances = {}
+        self.segment_neighbourhoods = level.segment_neighbourhoods
+        #The entities of each cell are kept as the keys of a dict, to remove them quickly while keeping
+        #their order, which is the order of their collisions with the ninja.
+        self.grid_entity = [{} for _ in range(GRID_WIDTH*GRID_HEIGHT)]
+        self.entity_neighbourhoods = {}
+        self.deathball_buckets = None
         self.entity_dic = dict([(i, []) for i in range(1, 29)])
 
-        #Initiate dictionaries of grid edges and segments. They are all set to zero initialy,
-        #except for the edges of the frame, which are solid.
-        self.hor_grid_edge_dic = {}
-        for x in range(88):
-            for y in range(51):
-                value = 1 if y in (0, 50) else 0
-                self.hor_grid_edge_dic[(x, y)] = value
-        self.ver_grid_edge_dic = {}
-        for x in range(89):
-            for y in range(50):
-                value = 1 if x in (0, 88) else 0
-                self.ver_grid_edge_dic[(x, y)] = value
-        self.hor_segment_dic = {}
-        for x in range(88):
-            for y in range(51):
-                value = 0
-                if y == 0:
-                    value = 1
-                if y == 50:
-                    value = -1
-                self.hor_segment_dic[(x, y)] = value
-        self.ver_segment_dic = {}
-        for x in range(89):
-            for y in range(50):
-                value = 0
-                if x == 0:
-                    value = 1
-                if x == 88:
-                    value = -1
-                self.ver_segment_dic[(x, y)] = value
-
-        self.map_data = map_data
-        #extract tile data from map data
-        tile_data = self.map_data[184:1150]
-
-        #map each tile to its cell
-        for x in range(42):
-            for y in range(23):
-                self.tile_dic[(x+1, y+1)] = tile_data[x + y*42]
-
-        #This loops makes the inventory of grid edges and orthogonal linear segments,
-        #and initiates non-orthogonal linear segments and circular segments.
-        for coord, tile_id in self.tile_dic.items():
-            xcoord, ycoord = coord
-            #Assign every grid edge and orthogonal linear segment to the dictionaries.
-            if tile_id in self.TILE_GRID_EDGE_MAP.keys() and tile_id in self.TILE_SEGMENT_ORTHO_MAP.keys():
-                grid_edge_list = self.TILE_GRID_EDGE_MAP[tile_id]
-                segment_ortho_list = self.TILE_SEGMENT_ORTHO_MAP[tile_id]
-                for y in range(3):
-                    for x in range(2):
-                        self.hor_grid_edge_dic[(2*xcoord + x, 2*ycoord + y)] = (
-                            (self.hor_grid_edge_dic[(2*xcoord + x, 2*ycoord + y)] + grid_edge_list[2*y + x]) % 2)
-                        self.hor_segment_dic[(2*xcoord + x, 2*ycoord + y)] += segment_ortho_list[2*y + x]
-                for x in range(3):
-                    for y in range(2):
-                        self.ver_grid_edge_dic[(2*xcoord + x, 2*ycoord + y)] = (
-                            (self.ver_grid_edge_dic[(2*xcoord + x, 2*ycoord + y)] + grid_edge_list[2*x + y + 6]) % 2)
-                        self.ver_segment_dic[(2*xcoord + x, 2*ycoord + y)] += segment_ortho_list[2*x + y + 6]
-
-            #Initiate non-orthogonal linear and circular segments.
-            xtl = xcoord * 24
-            ytl = ycoord * 24
-            if tile_id in self.TILE_SEGMENT_DIAG_MAP.keys():
-                ((x1, y1), (x2, y2)) = self.TILE_SEGMENT_DIAG_MAP[tile_id]
-                self.segment_dic[coord].append(GridSegmentLinear((xtl+x1, ytl+y1), (xtl+x2, ytl+y2)))
-            if tile_id in self.TILE_SEGMENT_CIRCULAR_MAP.keys():
-                ((x, y), quadrant, convex) = self.TILE_SEGMENT_CIRCULAR_MAP[tile_id]
-                self.segment_dic[coord].append(GridSegmentCircular((xtl+x, ytl+y), quadrant, convex))                
-
-        #Initiate segments from the dictionaries of orthogonal linear segments.
-        #Note that two segments of the same position but opposite orientation cancel each other,
-        #and no segment is initiated.
-        for coord, state in self.hor_segment_dic.items():
-            if state:
-                xcoord, ycoord = coord
-                cell = (math.floor(xcoord/2), math.floor((ycoord - 0.1*state) / 2))
-                point1 = (12*xcoord, 12*ycoord)
-                point2 = (12*xcoord+12, 12*ycoord)
-                if state == -1:
-                    point1, point2 = point2, point1
-                self.segment_dic[cell].append(GridSegmentLinear(point1, point2))
-        for coord, state in self.ver_segment_dic.items():
-            if state:
-                xcoord, ycoord = coord
-                cell = (math.floor((xcoord - 0.1*state) / 2), math.floor(ycoord/2))
-                point1 = (12*xcoord, 12*ycoord+12)
-                point2 = (12*xcoord, 12*ycoord)
-                if state == -1:
-                    point1, point2 = point2, point1
-                self.segment_dic[cell].append(GridSegmentLinear(point1, point2))
-
         #initiate player 1 instance of Ninja at spawn coordinates
         self.ninja = Ninja(self)
 
         #Initiate each entity (other than ninjas)
-        index = 1230
-        exit_door_count = self.map_data[1156]
         Entity.entity_counts = [0] * 40
-        while (index < len(map_data)):
-            type = self.map_data[index]
-            xcoord = self.map_data[index+1]
-            ycoord = self.map_data[index+2]
-            orientation = self.map_data[index+3]
-            mode = self.map_data[index+4]
+        for type, xcoord, ycoord, orientation, mode, switch_xcoord, switch_ycoord in level.spawns:
             if type == 1:
                 entity = EntityToggleMine(type, self, xcoord, ycoord, 0)
             elif type == 2:
@@ -2033,26 +2139,20 @@ class Simulator:
             elif type == 3:
                 parent = EntityExit(type, self, xcoord, ycoord)
                 self.entity_dic[type].append(parent)
-                child_xcoord = self.map_data[index + 5*exit_door_count + 1]
-                child_ycoord = self.map_data[index + 5*exit_door_count + 2]
-                entity = EntityExitSwitch(4, self, child_xcoord, child_ycoord, parent)
+                entity = EntityExitSwitch(4, self, switch_xcoord, switch_ycoord, parent)
             elif type == 5:
                 entity = EntityDoorRegular(type, self, xcoord, ycoord, orientation, xcoord, ycoord)
             elif type == 6:
-                switch_xcoord = self.map_data[index + 6]
-                switch_ycoord = self.map_data[index + 7]
                 entity = EntityDoorLocked(type, self, xcoord, ycoord, orientation, switch_xcoord, switch_ycoord)
             elif type == 8:
-                switch_xcoord = self.map_data[index + 6]
-                switch_ycoord = self.map_data[index + 7]
                 entity = EntityDoorTrap(type, self, xcoord, ycoord, orientation, switch_xcoord, switch_ycoord)
             elif type == 10:
                 entity = EntityLaunchPad(type, self, xcoord, ycoord, orientation)
             elif type == 11:
                 entity = EntityOneWayPlatform(type, self, xcoord, ycoord, orientation)
-            elif type == 14 and not ARGUMENTS.basic_sim:
+            elif type == 14 and not self.config.basic_sim:
                 entity = EntityDroneZap(type, self, xcoord, ycoord, orientation, mode)
-            #elif type == 15 and not ARGUMENTS.basic_sim:
+            #elif type == 15 and not self.config.basic_sim:
             #    entity = EntityDroneChaser(type, self, xcoord, ycoord, orientation, mode)
             elif type == 17:
                 entity = EntityBounceBlock(type, self, xcoord, ycoord)
@@ -2060,13 +2160,13 @@ class Simulator:
                 entity = EntityThwump(type, self, xcoord, ycoord, orientation)
             elif type == 21:
                 entity = EntityToggleMine(type, self, xcoord, ycoord, 1)
-            #elif type == 23 and not ARGUMENTS.basic_sim:
+            #elif type == 23 and not self.config.basic_sim:
             #    entity = EntityLaser(type, self, xcoord, ycoord, orientation, mode)
             elif type == 24:
                 entity = EntityBoostPad(type, self, xcoord, ycoord)
-            elif type == 25 and not ARGUMENTS.basic_sim:
+            elif type == 25 and not self.config.basic_sim:
                 entity = EntityDeathBall(type, self, xcoord, ycoord)
-            elif type == 26 and not ARGUMENTS.basic_sim:
+            elif type == 26 and not self.config.basic_sim:
                 entity = EntityMiniDrone(type, self, xcoord, ycoord, orientation, mode)
             elif type == 28:
                 entity = EntityShoveThwump(type, self, xcoord, ycoord)
@@ -2074,12 +2174,80 @@ class Simulator:
                 entity = None
             if entity:
                 self.entity_dic[type].append(entity)
-                self.grid_entity[entity.cell].append(entity)
-            index += 5
+                self.grid_entity[entity.cell][entity] = None
 
-        for list in self.entity_dic.values():
-            for entity in list:
-                entity.log_position()
+        self.sort_entities()
+        for entity in self.loggers:
+            entity.log_position()
+
+    def sort_entities(self):
+        """Make the lists of the active entities that move, think and log their position every frame,
+        in the same order as entity_dic. Afterwards, deactivated entities remove themselves from them.
+        """
+        entities = [entity for list in self.entity_dic.values() for entity in list if entity.active]
+        self.movers = [entity for entity in entities if entity.is_movable]
+        self.thinkers = [entity for entity in entities if entity.is_thinkable]
+        self.loggers = [entity for entity in entities if entity.log_positions]
+
+    def forget_entity_neighbourhoods(self, cell):
+        """Discard the cached entity neighbourhoods that contain a cell, after an entity enters or
+        leaves it, or is deactivated in it. See gather_entities_from_neighbourhood.
+        """
+        xcell, ycell = divmod(cell, GRID_HEIGHT)
+        for column in range(max(xcell - 1, 0)*GRID_HEIGHT, min(xcell + 1, 43)*GRID_HEIGHT + 1, GRID_HEIGHT):
+            for center in range(column + max(ycell - 1, 0), column + min(ycell + 1, 24) + 1):
+                self.entity_neighbourhoods.pop(center, None)
+
+    def change_grid_edges(self, vertical, edges, delta):
+        """Add to the count of some grid edges, as doors close (1) or open (-1)."""
+        grid_edges = self.ver_grid_edges if vertical else self.hor_grid_edges
+        for edge in edges:
+            grid_edges[edge] += delta
+            self.forget_edge_distances(vertical, edge)
+
+    def forget_edge_distances(self, vertical, edge):
+        """Discard the measured distances along the row of vertical edges or the column of horizontal
+        edges that contains a grid edge, after it changes.
+        """
+        if vertical:
+            self.row_distances.pop(edge % HALF_GRID_HEIGHT, None)
+        else:
+            self.column_distances.pop(edge // HALF_GRID_HEIGHT, None)
+
+    def get_column_distances(self, column):
+        """Return the distances from each half cell of a column to the next solid horizontal edge
+        below and above it. See measure_edge_distances.
+        """
+        distances = self.column_distances.get(column)
+        if distances is None:
+            first = column*HALF_GRID_HEIGHT
+            distances = measure_edge_distances(self.hor_grid_edges, first, first + HALF_GRID_HEIGHT - 1, 1)
+            self.column_distances[column] = distances
+        return distances
+
+    def get_row_distances(self, row):
+        """Return the distances from each half cell of a row to the next solid vertical edge to its
+        right and left. See measure_edge_distances.
+        """
+        distances = self.row_distances.get(row)
+        if distances is None:
+            last = (HALF_GRID_WIDTH - 1)*HALF_GRID_HEIGHT + row
+            distances = measure_edge_distances(self.ver_grid_edges, row, last, HALF_GRID_HEIGHT)
+            self.row_distances[row] = distances
+        return distances
+
+    def add_door_segment(self, cell, segment):
+        """Add the segment of a door to its cell. Door segments are the only ones that can change, so
+        the neighbourhoods that contain them aren't used, and they're gathered from the cells instead.
+        """
+        self.segment_grid[cell].append(segment)
+        if self.segment_neighbourhoods is self.level.segment_neighbourhoods:
+            self.segment_neighbourhoods = list(self.segment_neighbourhoods)
+        xcell, ycell = divmod(cell, GRID_HEIGHT)
+        for x, width in product((xcell - 1, xcell), (1, 2)):
+            for y, height in product((ycell - 1, ycell), (1, 2)):
+                if x >= 0 and y >= 0 and x + width > xcell and y + height > ycell:
+                    self.segment_neighbourhoods[4*(x*GRID_HEIGHT + y) + 2*(width - 1) + height - 1] = None
 
     def tick(self, hor_input, jump_input):
         """Gets called every frame to update the whole physics simulation."""
@@ -2090,16 +2258,15 @@ class Simulator:
         self.ninja.hor_input = hor_input
         self.ninja.jump_input = jump_input
 
+        #Death balls are hashed again every frame, the first time one of them needs it.
+        self.deathball_buckets = None
+
         #Move all movable entities
-        for list in self.entity_dic.values():
-            for entity in list:
-                if entity.is_movable and entity.active:
-                    entity.move()
+        for entity in self.movers:
+            entity.move()
         #Make all thinkable entities think
-        for list in self.entity_dic.values():
-            for entity in list:
-                if entity.is_thinkable and entity.active:
-                    entity.think()
+        for entity in self.thinkers:
+            entity.think()
         
         if self.ninja.state != 9:
             ninja = self.ninja if self.ninja.state != 6 else self.ninja.ragdoll #if dead, apply physics to ragdoll instead.
@@ -2112,39 +2279,337 @@ class Simulator:
             self.ninja.think() #Make ninja think
             self.ninja.update_graphics() #Update limbs of ninja
 
-        if self.ninja.state == 6 and NINJA_ANIM_MODE: #Placeholder because no ragdoll!
+        if self.ninja.state == 6 and self.animation is not None: #Placeholder because no ragdoll!
             self.ninja.anim_frame = 105
             self.ninja.anim_state = 7
-            self.ninja.calc_ninja_position()
+            self.ninja.update_pose()
 
         #Update all the logs for debugging purposes and for tracing the route.
+        if self.config.score_only:
+            return
         self.ninja.log()
+        for entity in self.loggers:
+            entity.log_position()
+
+    def snapshot(self):
+        """Capture the state of the current run, so that it can be resumed later with restore.
+        The static geometry is shared and never copied, and the logs are append-only, so only their
+        lengths are kept. This means that a snapshot can only be restored on this same run (i.e. not
+        after loading or resetting the simulator), and that restoring it truncates the logs: restoring
+        a snapshot taken after the one currently restored doesn't bring back its logs.
+        """
+        entities = []
+        cells = set()
         for list in self.entity_dic.values():
             for entity in list:
-                entity.log_position()
+                if isinstance(entity, EntityDoorBase):
+                    grid_edges = self.ver_grid_edges if entity.is_vertical else self.hor_grid_edges
+                    door = (entity.segment.active, tuple(grid_edges[edge] for edge in entity.grid_edges))
+                else:
+                    door = None
+                entities.append((entity, copy_state(entity, self.ENTITY_LOGS), door))
+                cells.add(entity.cell)
+        #Entities are always in the grid cell they're in, so only those cells can be non-empty.
+        grid_entity = tuple((cell, tuple(self.grid_entity[cell])) for cell in cells)
+        return (self.frame, self.gold_collected, self.random.getstate(), len(self.collisionlog),
+                copy_state(self.ninja, self.NINJA_LOGS), copy_state(self.ninja.ragdoll), entities, grid_entity)
+
+    def restore(self, state):
+        """Resume the run from a snapshot taken earlier in it."""
+        frame, gold_collected, random_state, collision_count, ninja, ragdoll, entities, grid_entity = state
+        self.frame = frame
+        self.gold_collected = gold_collected
+        self.random.setstate(random_state)
+        del self.collisionlog[collision_count:]
+        restore_state(self.ninja, ninja, self.NINJA_LOGS)
+        restore_state(self.ninja.ragdoll, ragdoll)
+        for entity, _, _ in entities:
+            self.grid_entity[entity.cell].clear()
+        for cell, list in grid_entity:
+            self.grid_entity[cell] = dict.fromkeys(list)
+        self.entity_neighbourhoods.clear()
+        for entity, entity_state, door in entities:
+            restore_state(entity, entity_state, self.ENTITY_LOGS)
+            if door:
+                entity.segment.active, values = door
+                grid_edges = self.ver_grid_edges if entity.is_vertical else self.hor_grid_edges
+                for edge, value in zip(entity.grid_edges, values):
+                    grid_edges[edge] = value
+                    self.forget_edge_distances(entity.is_vertical, edge)
+        self.sort_entities()
+
+
+class CompiledLevel:
+    """Static data of a level, compiled from its map data: the tiles, the grid edges and segments of
+    the tiles, and the spawn table of the entities. Once compiled it must not be modified, since it's
+    shared by every run on the level. Compiled levels are cached, and are equal if their map data is.
+    """
+    CACHE_SIZE = 64 #Maximum amount of compiled levels kept in memory.
+    cache = {}
+
+    @classmethod
+    def get(cls, map_data):
+        """Return the compiled level of the given map data, compiling it if it isn't cached."""
+        key = bytes(map_data)
+        level = cls.cache.pop(key, None) or cls(key)
+        cls.cache[key] = level #Reinserted so that the dictionary is sorted from least to most recently used.
+        if len(cls.cache) > cls.CACHE_SIZE:
+            del cls.cache[next(iter(cls.cache))]
+        return level
+
+    def __init__(self, map_data):
+        """Compile the level from its map data, given as bytes."""
+        self.map_data = map_data
+
+        #initiate a dictionary mapping each tile id to its cell. Start by filling it with full tiles (id of 1).
+        self.tile_dic = {}
+        for x in range(44):
+            for y in range(25):
+                self.tile_dic[(x, y)] = 1
+
+        #Initiate grid containing the segments of each cell
+        segment_grid = [[] for _ in range(GRID_WIDTH*GRID_HEIGHT)]
+
+        #Initiate grids of grid edges and dictionaries of segments. They are all set to zero initialy,
+        #except for the edges of the frame, which are solid.
+        hor_grid_edges = bytearray(HALF_GRID_WIDTH*HALF_GRID_HEIGHT)
+        for x in range(88):
+            hor_grid_edges[x*HALF_GRID_HEIGHT] = 1
+            hor_grid_edges[x*HALF_GRID_HEIGHT + 50] = 1
+        ver_grid_edges = bytearray(HALF_GRID_WIDTH*HALF_GRID_HEIGHT)
+        for y in range(50):
+            ver_grid_edges[y] = 1
+            ver_grid_edges[88*HALF_GRID_HEIGHT + y] = 1
+        self.hor_segment_dic = {}
+        for x in range(88):
+            for y in range(51):
+                value = 0
+                if y == 0:
+                    value = 1
+                if y == 50:
+                    value = -1
+                self.hor_segment_dic[(x, y)] = value
+        self.ver_segment_dic = {}
+        for x in range(89):
+            for y in range(50):
+                value = 0
+                if x == 0:
+                    value = 1
+                if x == 88:
+                    value = -1
+                self.ver_segment_dic[(x, y)] = value
+
+        #extract tile data from map data
+        tile_data = self.map_data[184:1150]
+
+        #map each tile to its cell
+        for x in range(42):
+            for y in range(23):
+                self.tile_dic[(x+1, y+1)] = tile_data[x + y*42]
+
+        #This loops makes the inventory of grid edges and orthogonal linear segments,
+        #and initiates non-orthogonal linear segments and circular segments.
+        for coord, tile_id in self.tile_dic.items():
+            xcoord, ycoord = coord
+            #Assign every grid edge and orthogonal linear segment to the dictionaries.
+            if tile_id in Simulator.TILE_GRID_EDGE_MAP.keys() and tile_id in Simulator.TILE_SEGMENT_ORTHO_MAP.keys():
+                grid_edge_list = Simulator.TILE_GRID_EDGE_MAP[tile_id]
+                segment_ortho_list = Simulator.TILE_SEGMENT_ORTHO_MAP[tile_id]
+                for y in range(3):
+                    for x in range(2):
+                        edge = (2*xcoord + x)*HALF_GRID_HEIGHT + 2*ycoord + y
+                        hor_grid_edges[edge] = (hor_grid_edges[edge] + grid_edge_list[2*y + x]) % 2
+                        self.hor_segment_dic[(2*xcoord + x, 2*ycoord + y)] += segment_ortho_list[2*y + x]
+                for x in range(3):
+                    for y in range(2):
+                        edge = (2*xcoord + x)*HALF_GRID_HEIGHT + 2*ycoord + y
+                        ver_grid_edges[edge] = (ver_grid_edges[edge] + grid_edge_list[2*x + y + 6]) % 2
+                        self.ver_segment_dic[(2*xcoord + x, 2*ycoord + y)] += segment_ortho_list[2*x + y + 6]
+
+            #Initiate non-orthogonal linear and circular segments.
+            xtl = xcoord * 24
+            ytl = ycoord * 24
+            cell = xcoord*GRID_HEIGHT + ycoord
+            if tile_id in Simulator.TILE_SEGMENT_DIAG_MAP.keys():
+                ((x1, y1), (x2, y2)) = Simulator.TILE_SEGMENT_DIAG_MAP[tile_id]
+                segment_grid[cell].append(GridSegmentLinear((xtl+x1, ytl+y1), (xtl+x2, ytl+y2)))
+            if tile_id in Simulator.TILE_SEGMENT_CIRCULAR_MAP.keys():
+                ((x, y), quadrant, convex) = Simulator.TILE_SEGMENT_CIRCULAR_MAP[tile_id]
+                segment_grid[cell].append(GridSegmentCircular((xtl+x, ytl+y), quadrant, convex))
+
+        #Initiate segments from the dictionaries of orthogonal linear segments.
+        #Note that two segments of the same position but opposite orientation cancel each other,
+        #and no segment is initiated. The two halves of an edge of a cell are merged into a single
+        #segment if they have the same orientation (which also means that they're in the same cell).
+        self.eliminated_segments = 0 #Amount of segments saved by merging, reported for reference.
+        for coord, state in self.hor_segment_dic.items():
+            if state:
+                xcoord, ycoord = coord
+                if xcoord % 2 == 1 and self.hor_segment_dic[(xcoord-1, ycoord)] == state:
+                    continue #Already merged with the left half
+                merged = xcoord % 2 == 0 and self.hor_segment_dic.get((xcoord+1, ycoord)) == state
+                cell = math.floor(xcoord/2)*GRID_HEIGHT + math.floor((ycoord - 0.1*state) / 2)
+                halves = []
+                for x in ((xcoord, xcoord+1) if merged else (xcoord,)):
+                    point1 = (12*x, 12*ycoord)
+                    point2 = (12*x+12, 12*ycoord)
+                    if state == -1:
+                        point1, point2 = point2, point1
+                    halves.append(GridSegmentLinear(point1, point2))
+                segment_grid[cell].append(GridSegmentMerged(*halves) if merged else halves[0])
+                self.eliminated_segments += merged
+        for coord, state in self.ver_segment_dic.items():
+            if state:
+                xcoord, ycoord = coord
+                if ycoord % 2 == 1 and self.ver_segment_dic[(xcoord, ycoord-1)] == state:
+                    continue #Already merged with the upper half
+                merged = ycoord % 2 == 0 and self.ver_segment_dic.get((xcoord, ycoord+1)) == state
+                cell = math.floor((xcoord - 0.1*state) / 2)*GRID_HEIGHT + math.floor(ycoord/2)
+                halves = []
+                for y in ((ycoord, ycoord+1) if merged else (ycoord,)):
+                    point1 = (12*xcoord, 12*y+12)
+                    point2 = (12*xcoord, 12*y)
+                    if state == -1:
+                        point1, point2 = point2, point1
+                    halves.append(GridSegmentLinear(point1, point2))
+                segment_grid[cell].append(GridSegmentMerged(*halves) if merged else halves[0])
+                self.eliminated_segments += merged
+        self.segment_grid = tuple(tuple(segments) for segments in segment_grid)
+
+        #For each cell, gather the segments of the regions of 1x1, 1x2, 2x1 and 2x2 cells starting at it,
+        #which are all the regions that queries of up to 12 units of radius can cover (e.g. the ninja's).
+        #The region of width w and height h starting at cell c is at index 4*c + 2*(w-1) + (h-1).
+        neighbourhoods = []
+        grid = self.segment_grid + ((),)*(GRID_HEIGHT + 1) #Padded, so that regions can go past the edges.
+        for cell in range(GRID_WIDTH*GRID_HEIGHT):
+            last_row = cell % GRID_HEIGHT == GRID_HEIGHT - 1
+            below = () if last_row else grid[cell + 1]
+            right = grid[cell + GRID_HEIGHT]
+            right_below = () if last_row else grid[cell + GRID_HEIGHT + 1]
+            neighbourhoods.append(grid[cell])
+            neighbourhoods.append(grid[cell] + below)
+            neighbourhoods.append(grid[cell] + right)
+            neighbourhoods.append(grid[cell] + below + right + right_below)
+        self.segment_neighbourhoods = tuple(neighbourhoods)
+        self.hor_grid_edges = bytes(hor_grid_edges)
+        self.ver_grid_edges = bytes(ver_grid_edges)
+
+        #Make the spawn table of the entities (other than ninjas). Exits and locked and trap doors
+        #also store the coordinates of their switch.
+        spawns = []
+        index = 1230
+        exit_door_count = self.map_data[1156]
+        while (index < len(map_data)):
+            type = self.map_data[index]
+            xcoord = self.map_data[index+1]
+            ycoord = self.map_data[index+2]
+            orientation = self.map_data[index+3]
+            mode = self.map_data[index+4]
+            switch_xcoord, switch_ycoord = None, None
+            if type == 3:
+                switch_xcoord = self.map_data[index + 5*exit_door_count + 1]
+                switch_ycoord = self.map_data[index + 5*exit_door_count + 2]
+            elif type in (6, 8):
+                switch_xcoord = self.map_data[index + 6]
+                switch_ycoord = self.map_data[index + 7]
+            spawns.append((type, xcoord, ycoord, orientation, mode, switch_xcoord, switch_ycoord))
+            index += 5
+        self.spawns = tuple(spawns)
+
+    def __hash__(self):
+        return hash(self.map_data)
 
+    def __eq__(self, other):
+        return isinstance(other, CompiledLevel) and self.map_data == other.map_data
+
+
+@functools.lru_cache(maxsize=None)
+def get_slots(cls):
+    """Return the names of the attributes of a class, including those of its parents. Every class
+    of the simulated objects declares them in __slots__, so instances don't have a __dict__.
+    """
+    return tuple(name for klass in reversed(cls.__mro__) for name in klass.__dict__.get("__slots__", ()))
+
+def copy_state(obj, logs=()):
+    """Return a copy of the attributes of an object, for snapshots. Lists (e.g. bones) are copied
+    along with the lists they contain, and logs are only stored as their length and last element.
+    Attributes which haven't been set yet are left out.
+    """
+    state = {}
+    for name in get_slots(type(obj)):
+        try:
+            state[name] = getattr(obj, name)
+        except AttributeError:
+            pass
+    lists = tuple(name for name, value in state.items() if type(value) is list and name not in logs)
+    for name in lists:
+        state[name] = [item[:] if type(item) is list else item for item in state[name]]
+    for name in logs:
+        log = state[name]
+        state[name] = (len(log), log[-1] if log else None)
+    return state, lists
+
+def restore_state(obj, state, logs=()):
+    """Restore the attributes of an object from a copy made with copy_state, truncating its logs."""
+    state, lists = state
+    for name in get_slots(type(obj)):
+        if name in logs:
+            length, last = state[name]
+            log = getattr(obj, name)
+            del log[length:]
+            if length:
+                log[-1] = last
+        elif name in lists:
+            setattr(obj, name, [item[:] if type(item) is list else item for item in state[name]])
+        elif name in state:
+            setattr(obj, name, state[name])
+        elif hasattr(obj, name):
+            delattr(obj, name)
 
 def gather_segments_from_region(sim, x1, y1, x2, y2):
-    """Return a list containing all collidable segments from the cells in a
-    rectangular region bounded by 2 points.
+    """Return a sequence containing all collidable segments from the cells in a
+    rectangular region bounded by 2 points. It must not be modified, since small
+    regions without doors return the precomputed neighbourhoods of the level.
     """
-    cx1, cy1 = clamp_cell(math.floor(x1/24), math.floor(y1/24))
-    cx2, cy2 = clamp_cell(math.floor(x2/24), math.floor(y2/24))
-    cells = product(range(cx1, cx2 + 1), range(cy1, cy2 + 1))
+    #The cells are clamped inline, since this is called several times per collision substep.
+    cx1, cy1, cx2, cy2 = math.floor(x1/24), math.floor(y1/24), math.floor(x2/24), math.floor(y2/24)
+    cx1 = 0 if cx1 < 0 else 43 if cx1 > 43 else cx1
+    cx2 = 0 if cx2 < 0 else 43 if cx2 > 43 else cx2
+    cy1 = 0 if cy1 < 0 else 24 if cy1 > 24 else cy1
+    cy2 = 0 if cy2 < 0 else 24 if cy2 > 24 else cy2
+    if cx2 - cx1 < 2 and cy2 - cy1 < 2:
+        segments = sim.segment_neighbourhoods[4*(cx1*GRID_HEIGHT + cy1) + 2*(cx2 - cx1) + cy2 - cy1]
+        if segments is not None:
+            return segments
+    segment_grid = sim.segment_grid
     segment_list = []
-    for cell in cells:
-        segment_list += [segment for segment in sim.segment_dic[cell] if segment.active]
+    for column in range(cx1*GRID_HEIGHT, cx2*GRID_HEIGHT + 1, GRID_HEIGHT):
+        for cell in range(column + cy1, column + cy2 + 1):
+            segment_list += [segment for segment in segment_grid[cell] if segment.active]
     return segment_list
 
 def gather_entities_from_neighbourhood(sim, xpos, ypos):
-    """Return a list that contains all active entities from the nine neighbour cells."""
-    cx, cy = clamp_cell(math.floor(xpos/24), math.floor(ypos/24))
-    cells = product(range(max(cx - 1, 0), min(cx + 1, 43) + 1), 
-                    range(max(cy - 1, 0), min(cy + 1, 24) + 1))
+    """Return a sequence that contains all active entities from the nine neighbour cells. It must not
+    be modified, since it's cached until an entity enters, leaves or is deactivated in those cells.
+    Neighbourhoods of static entities (gold, mines, pads...) are thus only gathered once per run.
+    """
+    cx, cy = math.floor(xpos/24), math.floor(ypos/24)
+    cx = 0 if cx < 0 else 43 if cx > 43 else cx
+    cy = 0 if cy < 0 else 24 if cy > 24 else cy
+    entities = sim.entity_neighbourhoods.get(cx*GRID_HEIGHT + cy)
+    if entities is not None:
+        return entities
+    cy1 = cy - 1 if cy > 0 else 0
+    cy2 = cy + 1 if cy < 24 else 24
+    cx1 = cx - 1 if cx > 0 else 0
+    cx2 = cx + 1 if cx < 43 else 43
+    grid_entity = sim.grid_entity
     entity_list = []
-    for cell in cells:
-        entity_list += [entity for entity in sim.grid_entity[cell] if entity.active]
-    return entity_list
+    for column in range(cx1*GRID_HEIGHT, cx2*GRID_HEIGHT + 1, GRID_HEIGHT):
+        for cell in range(column + cy1, column + cy2 + 1):
+            entity_list += [entity for entity in grid_entity[cell] if entity.active]
+    entities = sim.entity_neighbourhoods[cx*GRID_HEIGHT + cy] = tuple(entity_list)
+    return entities
     
 def sweep_circle_vs_tiles(sim, xpos_old, ypos_old, dx, dy, radius):
     """Fetch all segments from neighbourhood. Return shortest intersection time from interpolation."""
@@ -2246,6 +2711,21 @@ def get_single_closest_point(sim, xpos, ypos, radius):
             result = -1 if is_back_facing else 1
     return result, closest_point
 
+def find_wall_normal(sim, xpos, ypos, radius):
+    """Return the normal of the first tile wall within a distance of the given position, which is
+    the horizontal direction pointing away from it, or None if there's no wall that close.
+    """
+    segments = gather_segments_from_region(sim, xpos-radius, ypos-radius, xpos+radius, ypos+radius)
+    for segment in segments:
+        for part in segment.parts: #The halves of merged segments are checked separately.
+            result = part.get_closest_point(xpos, ypos)
+            a, b = result[1], result[2]
+            dx = xpos - a
+            dy = ypos - b
+            dist = math.sqrt(dx**2 + dy**2)
+            if abs(dy) < 0.00001 and 0 < dist <= radius and dx/dist:
+                return dx/dist
+
 def get_raycast_distance(sim, xpos, ypos, dx, dy):
     """Return the length of a ray given its start point and direction. The ray stops when it hits a
     tile. Return None if the ray hits nothing after travelling for 2000 units. The algorithm works by
@@ -2296,7 +2776,7 @@ def intersect_ray_vs_cell_contents(sim, xcell, ycell, xpos, ypos, dx, dy):
     """Given a cell and a ray, return the shortest time of intersection between the ray and one of
     the cell's tile segments. Return 1 if the ray hits nothing.
     """
-    segments = sim.segment_dic[clamp_cell(xcell, ycell)]
+    segments = sim.segment_grid[clamp_cell(xcell, ycell)]
     shortest_time = 1
     for segment in segments:
         time = segment.intersect_with_ray(xpos, ypos, dx, dy, 0)
@@ -2337,11 +2817,12 @@ def check_lineseg_vs_ninja(x1, y1, x2, y2, ninja):
         return False
     #Now test the segment against each of ninja's 11 segments. Return true if it intersects any.
     NINJA_SEGS = ((0, 12), (1, 12), (2, 8), (3, 9), (4, 10), (5, 11), (6, 7), (8, 0), (9, 0), (10, 1), (11, 1))
+    bones = ninja.get_bones()
     for seg in NINJA_SEGS:
-        x3 = ninja.xpos + 24*ninja.bones[seg[0]][0]
-        y3 = ninja.ypos + 24*ninja.bones[seg[0]][1]
-        x4 = ninja.xpos + 24*ninja.bones[seg[1]][0]
-        y4 = ninja.ypos + 24*ninja.bones[seg[1]][1]
+        x3 = ninja.xpos + 24*bones[seg[0]][0]
+        y3 = ninja.ypos + 24*bones[seg[0]][1]
+        x4 = ninja.xpos + 24*bones[seg[1]][0]
+        y4 = ninja.ypos + 24*bones[seg[1]][1]
         det1 = (x1 - x3)*(y2 - y3) - (y1 - y3)*(x2 - x3)
         det2 = (x1 - x4)*(y2 - y4) - (y1 - y4)*(x2 - x4)
         det3 = (x3 - x1)*(y4 - y1) - (y3 - y1)*(x4 - x1)
@@ -2412,12 +2893,8 @@ def clamp(n, a, b):
     return a if n < a else b if n > b else n
 
 def clamp_cell(xcell, ycell):
-    """If necessary, adjust coordinates of cell so it is in bounds."""
-    return (clamp(xcell, 0, 43), clamp(ycell, 0, 24))
-
-def clamp_half_cell(xcell, ycell):
-    """If necessary, adjust coordinates of half cell so it is in bounds."""
-    return (clamp(xcell, 0, 88), clamp(ycell, 0, 50))
+    """If necessary, adjust coordinates of cell so it is in bounds, and return its index in the grid."""
+    return clamp(xcell, 0, 43)*GRID_HEIGHT + clamp(ycell, 0, 24)
 
 def pack_coord(coord):
     """Pack a coordinate into a signed short for exporting"""
@@ -2426,16 +2903,72 @@ def pack_coord(coord):
 
 def is_empty_row(sim, xcoord1, xcoord2, ycoord, dir):
     """Return true if the cell has no solid horizontal edge in the specified direction."""
-    xcoords = range(xcoord1, xcoord2+1)
     if dir == 1:
-        return not any(sim.hor_grid_edge_dic[clamp_half_cell(xcoord, ycoord+1)] for xcoord in xcoords)
-    if dir == -1:
-        return not any(sim.hor_grid_edge_dic[clamp_half_cell(xcoord, ycoord)] for xcoord in xcoords)
+        ycoord = clamp(ycoord+1, 0, 50)
+    elif dir == -1:
+        ycoord = clamp(ycoord, 0, 50)
+    else:
+        return None
+    grid_edges = sim.hor_grid_edges
+    return not any(grid_edges[clamp(xcoord, 0, 88)*HALF_GRID_HEIGHT + ycoord] for xcoord in range(xcoord1, xcoord2+1))
     
 def is_empty_column(sim, xcoord, ycoord1, ycoord2, dir):
     """Return true if the cell has no solid vertical edge in the specified direction."""
-    ycoords = range(ycoord1, ycoord2+1)
     if dir == 1:
-        return not any(sim.ver_grid_edge_dic[clamp_half_cell(xcoord+1, ycoord)] for ycoord in ycoords)
-    if dir == -1:
-        return not any(sim.ver_grid_edge_dic[clamp_half_cell(xcoord, ycoord)] for ycoord in ycoords)
\ No newline at end of file
+        column = clamp(xcoord+1, 0, 88)*HALF_GRID_HEIGHT
+    elif dir == -1:
+        column = clamp(xcoord, 0, 88)*HALF_GRID_HEIGHT
+    else:
+        return None
+    grid_edges = sim.ver_grid_edges
+    return not any(grid_edges[column + clamp(ycoord, 0, 50)] for ycoord in range(ycoord1, ycoord2+1))
+
+def count_empty_rows(sim, xcoord1, xcoord2, ycoord, dir):
+    """Return how many rows in a row can be crossed from a cell in the specified direction before
+    reaching a solid horizontal edge, that is, how many times in a row is_empty_row would be true.
+    """
+    if dir not in (1, -1):
+        return None
+    if not 0 <= ycoord <= 50: #Outside of the grid, the rows are clamped, so they're checked one by one.
+        count = 0
+        while count < EDGE_DISTANCE_MAX and is_empty_row(sim, xcoord1, xcoord2, ycoord + count*dir, dir):
+            count += 1
+        return count
+    side = 0 if dir == 1 else 1
+    return min(sim.get_column_distances(clamp(xcoord, 0, 88))[side][ycoord] for xcoord in range(xcoord1, xcoord2+1))
+
+def count_empty_columns(sim, xcoord, ycoord1, ycoord2, dir):
+    """Return how many columns in a row can be crossed from a cell in the specified direction before
+    reaching a solid vertical edge, that is, how many times in a row is_empty_column would be true.
+    """
+    if dir not in (1, -1):
+        return None
+    if not 0 <= xcoord <= 88: #Outside of the grid, the columns are clamped, so they're checked one by one.
+        count = 0
+        while count < EDGE_DISTANCE_MAX and is_empty_column(sim, xcoord + count*dir, ycoord1, ycoord2, dir):
+            count += 1
+        return count
+    side = 0 if dir == 1 else 1
+    return min(sim.get_row_distances(clamp(ycoord, 0, 50))[side][xcoord] for ycoord in range(ycoord1, ycoord2+1))
+
+def measure_edge_distances(grid_edges, first, last, step):
+    """Return the distances from each half cell along a line of the grid (a column of horizontal
+    edges or a row of vertical edges, going from index first to last) to the next solid edge forward
+    and backward, as two lists. Forward from a half cell, the first edge checked is the next one, and
+    backward, its own one. Past the ends of the line the end edge keeps being checked, as the grid
+    is clamped.
+    """
+    edges = grid_edges[first:last+1:step]
+    size = len(edges)
+    forward = [0] * size
+    backward = [0] * size
+    distance = 0 if edges[-1] else EDGE_DISTANCE_MAX
+    forward[-1] = distance
+    for index in range(size - 2, -1, -1):
+        distance = 0 if edges[index + 1] else min(distance + 1, EDGE_DISTANCE_MAX)
+        forward[index] = distance
+    distance = EDGE_DISTANCE_MAX
+    for index in range(size):
+        distance = 0 if edges[index] else min(distance + 1, EDGE_DISTANCE_MAX)
+        backward[index] = distance
+    return forward, backward
@@ -0,0 +1,88 @@
+"""Tests of the tool, run from this folder with
+python -m unittest ntest
+"""
+import io
+import random
+import struct
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+import nbatch
+import ntrace
+
+def level(objects):
+    """Return the map data of an empty level with the given objects (type, x, y, orientation, mode)."""
+    counts = [0] * 40
+    for object in objects:
+        counts[object[0]] += 1
+    return bytes(184) + bytes(966) + struct.pack('<40H', *counts) + b"".join(bytes(object) for object in objects)
+
+def demo(seed):
+    """Return a compressed demo: running right for a different amount of frames for even seeds (one
+    of which ends right as it enters the exit), or random inputs for odd ones.
+    """
+    if seed % 2 == 0:
+        return zlib.compress(bytes([2]) * (61 + seed))
+    rng = random.Random(seed)
+    return zlib.compress(bytes(rng.choice((0, 1, 2, 2, 3, 3, 3)) for _ in range(150 + seed)))
+
+def request(flags, maps, demos):
+    """Return a request payload in server mode (see ntrace_docs.txt), with the default tolerance."""
+    payload = struct.pack('<BBd', 0, flags, 1.0)
+    for blobs in (maps, demos):
+        payload += struct.pack('<B', len(blobs)) + b"".join(struct.pack('<L', len(blob)) + blob for blob in blobs)
+    return payload
+
+
+class BatchModeTest(unittest.TestCase):
+    """Batch mode answers the score-only requests of a leaderboard (one demo each, like outte sends
+    them) with the batch simulator, and its responses are the same as answering them one by one.
+    """
+    MAP = level([(0, 8, 92, 0, 0), (2, 16, 92, 0, 0), (2, 24, 92, 0, 0), (3, 48, 92, 0, 0), (4, 32, 92, 0, 0)])
+
+    def setUp(self):
+        self.arguments = ntrace.ARGUMENTS
+
+    def tearDown(self):
+        ntrace.ARGUMENTS = self.arguments
+
+    def run_batch(self, payloads):
+        """Run the tool with --batch on a file with the given requests, and return the responses."""
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b"".join(struct.pack('<L', len(payload)) + payload for payload in payloads))
+            f.flush()
+            ntrace.ARGUMENTS = ntrace.parser.parse_args(["--batch", f.name])
+            stdout = io.TextIOWrapper(io.BytesIO())
+            with mock.patch("sys.stdout", stdout):
+                ntrace.run_batch(ntrace.ARGUMENTS.batch)
+        output = io.BytesIO(stdout.buffer.getvalue())
+        responses = []
+        while (response := ntrace.read_frame(output)) is not None:
+            responses.append(response)
+        return responses
+
+    @unittest.skipUnless(nbatch.available(), "NumPy isn't installed")
+    def test_leaderboard(self):
+        payloads = [request(ntrace.FLAG_SCORE_ONLY, [self.MAP], [demo(i)]) for i in range(ntrace.BATCH_MIN_REPLAYS)]
+        payloads.insert(3, request(0, [self.MAP], [demo(-1)])) #Traces are never batched
+        payloads.insert(5, b"\0") #Malformed requests get an error response, in order
+        expected = [ntrace.answer_request(payload) for payload in payloads]
+
+        with mock.patch.object(nbatch.BatchSimulator, "simulate", autospec=True, side_effect=nbatch.BatchSimulator.simulate) as simulate:
+            responses = self.run_batch(payloads)
+        simulate.assert_called_once()
+        self.assertEqual(len(simulate.call_args.args[1]), ntrace.BATCH_MIN_REPLAYS)
+        self.assertEqual(responses, expected)
+        self.assertEqual(responses[5][0], 1)
+        self.assertTrue(any(b'"valid": [true]' in response for response in responses))
+
+    def test_few_replays(self):
+        payloads = [request(ntrace.FLAG_SCORE_ONLY, [self.MAP], [demo(i)]) for i in range(4)]
+        expected = [ntrace.answer_request(payload) for payload in payloads]
+
+        with mock.patch.object(nbatch.BatchSimulator, "simulate", autospec=True) as simulate:
+            responses = self.run_batch(payloads)
+        simulate.assert_not_called()
+        self.assertEqual(responses, expected)
@@ -1,4 +1,12 @@
+import argparse
+import functools
+import hashlib
+import io
+import itertools
+import operator
 import os.path
+import socket
+import sys
 import zlib
 import struct
 import json
@@ -6,6 +14,29 @@ import json
 from nsim import *
 
 
+#Create argument parser so that we can pass parameters when executing the tool
+#Run the tool with the -h option to see the complete help
+parser = argparse.ArgumentParser(description='N++ physics clone')
+parser.add_argument('--basic-sim', action='store_true', help='Only simulate entities with physical collision')
+parser.add_argument('--full-export', action='store_true', help="Export coordinates of moving entities")
+parser.add_argument('-t', '--tolerance', type=float, default=1.0, help='Minimum units to consider an entity moved')
+parser.add_argument('--score-only', action='store_true', help='Disable all logging and only output the stats of each replay')
+parser.add_argument('--seed', type=int, default=0, help='Seed for the random choices of the simulation (e.g. victory dances)')
+parser.add_argument('--compact', action='store_true', help='Write the trace in the compact format, with delta encoded coordinates')
+parser.add_argument('--compress', action='store_true', help='Also compress the trace with zlib, implies --compact')
+parser.add_argument('--server', nargs='?', const=True, default=False, metavar='SOCKET',
+                    help='Keep running and answer simulation requests from stdin, or from a Unix socket if provided')
+parser.add_argument('--stdin', action='store_true', help='Answer a single simulation request from stdin, without using files')
+parser.add_argument('--batch', nargs='?', const=True, default=False, metavar='FILE',
+                    help='Answer every simulation request from a file, or from stdin if not provided, and exit')
+parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                    help='Amount of processes to run simulations in parallel (0 to use all cores)')
+parser.add_argument('--cache', metavar='DIR', help='Directory where simulation results are cached, disabled if not provided')
+parser.add_argument('--cache-size', type=float, default=256, metavar='MB', help='Maximum size of the cache, least recently used results are deleted')
+
+#The defaults are used when imported as a library, the command line is only parsed when run as a script.
+ARGUMENTS = parser.parse_args([])
+
 #Required names for files.
 RAW_INPUTS = ["inputs_0", "inputs_1", "inputs_2", "inputs_3"]
 RAW_MAP_DATA = "map_data"
@@ -14,53 +45,97 @@ RAW_MAP_DATA_EPISODE = ["map_data_0", "map_data_1", "map_data_2", "map_data_3",
 OUTPUT_TRACE = "output.bin"
 OUTPUT_SPLITS = "output.txt"
 
-#Import inputs.
-inputs_list = []
-if os.path.isfile(RAW_INPUTS_EPISODE):
-    tool_mode = "splits"
-    with open(RAW_INPUTS_EPISODE, "rb") as f:
-        inputs_episode = zlib.decompress(f.read()).split(b"&")
-        for inputs_level in inputs_episode:
-            inputs_list.append([int(b) for b in inputs_level])
-else:
-    tool_mode = "trace"
-    for rinputs in RAW_INPUTS:
-        if os.path.isfile(rinputs):
-            with open(rinputs, "rb") as f:
-                inputs_list.append([int(b) for b in zlib.decompress(f.read())])
-        else:
-            break
-
-#import map data
-mdata_list = []
-if tool_mode == "trace":
-    with open(RAW_MAP_DATA, "rb") as f:
-        mdata = [int(b) for b in f.read()]
-    for _ in range(len(inputs_list)):
-        mdata_list.append(mdata)
-elif tool_mode == "splits":
-    for rmdata in (RAW_MAP_DATA_EPISODE):
-        with open(rmdata, "rb") as f:
-            mdata_list.append([int(b) for b in f.read()])
-
 #These dictionaries convert raw input data into the horizontal and jump components.
 HOR_INPUTS_DIC = {0:0, 1:0, 2:1, 3:1, 4:-1, 5:-1, 6:-1, 7:-1}
 JUMP_INPUTS_DIC = {0:0, 1:1, 2:0, 3:1, 4:0, 5:1, 6:0, 7:1}
 
-goldlog = []
-frameslog = []
-fractionlog = []
-validlog = []
-collisionlog = []
-entitylog = []
+#Flags of the request header in server mode.
+FLAG_BASIC_SIM = 1
+FLAG_FULL_EXPORT = 2
+FLAG_SCORE_ONLY = 4
+FLAG_COMPACT = 8
+FLAG_COMPRESS = 16
 
-#Repeat this loop for each individual replay
-for i in range(len(inputs_list)):
-    valid = False
+#Versions of the trace format. The compact one starts with a 0 (which is never the run count of a
+#regular trace), then its version and its flags.
+TRACE_VERSION_REGULAR = 1
+TRACE_VERSION_COMPACT = 2
+TRACE_COMPRESSED = 1 #Flag of compact traces whose replay sections are compressed with zlib
+
+#Amount of requests read at once in batch mode, per process. Consecutive requests on the same map
+#are never split between windows (up to BATCH_RUN requests), so that they can be simulated together.
+BATCH_WINDOW = 16
+BATCH_RUN = 4096
+
+#Minimum amount of replays on the same map to simulate them with the batch simulator (nbatch). Each
+#frame it pays a fixed NumPy overhead, while simulating them one by one only simulates the inputs
+#they have in common once, so it's only faster when there are many: it breaks even between 130 and
+#250 replays depending on the level, and is 1.1 to 1.3 times faster at 300 and 2 to 3 times at 1000
+#(measured with "python nbench.py --batch"). This is unrelated to nbatch's VECTORIZE_MIN, which
+#only decides how the last ninjas still running in a batch collide with the tiles.
+BATCH_MIN_REPLAYS = 300
+
+#Pool of worker processes, created the first time it's needed.
+POOL = None
+
+#Total size of the result cache in bytes, computed the first time it's needed.
+CACHE_USAGE = None
+#Bytes written to the cache by this process since its size was last measured. Worker processes only
+#count their own entries, so the cache is measured again once they've written this part of its size.
+CACHE_WRITTEN = 0
+CACHE_RESCAN = 1/16
 
-    #Extract inputs and map data from the list
-    inputs = inputs_list[i]
-    mdata = mdata_list[i]
+
+def read_files():
+    """Read the raw inputs and map data from the working directory, and figure out the tool mode
+    depending on which files are present.
+    """
+    maps = []
+    demos = []
+    if os.path.isfile(RAW_INPUTS_EPISODE):
+        tool_mode = "splits"
+        with open(RAW_INPUTS_EPISODE, "rb") as f:
+            demos.append(f.read())
+        for rmdata in RAW_MAP_DATA_EPISODE:
+            with open(rmdata, "rb") as f:
+                maps.append(f.read())
+    else:
+        tool_mode = "trace"
+        for rinputs in RAW_INPUTS:
+            if os.path.isfile(rinputs):
+                with open(rinputs, "rb") as f:
+                    demos.append(f.read())
+            else:
+                break
+        with open(RAW_MAP_DATA, "rb") as f:
+            maps.append(f.read())
+
+    return tool_mode, maps, demos
+
+def decode_job(tool_mode, maps, demos):
+    """Decode the raw map data and demos of a simulation into the map data and inputs of each replay."""
+    if tool_mode == "trace":
+        inputs_list = [decode_inputs(demo) for demo in demos]
+        mdata_list = [[int(b) for b in maps[0]]] * len(inputs_list)
+    else:
+        inputs_list = decode_episode(demos[0])
+        mdata_list = [[int(b) for b in mdata] for mdata in maps]
+    return mdata_list, inputs_list
+
+def decode_inputs(raw):
+    """Decompress the inputs of a level replay."""
+    return [int(b) for b in zlib.decompress(raw)]
+
+def decode_episode(raw):
+    """Decompress the inputs of an episode replay and split them into its 5 level replays."""
+    return [[int(b) for b in inputs_level] for inputs_level in zlib.decompress(raw).split(b"&")]
+
+def simulate_replay(job, config):
+    """Simulate a single replay on its map with the given options. The job is a tuple with the index
+    of the replay, its map data and its inputs. Return the stats and logs of the replay.
+    """
+    i, mdata, inputs = job
+    valid = False
 
     #Convert inputs in a more useful format.
     hor_inputs = [HOR_INPUTS_DIC[inp] for inp in inputs]
@@ -68,7 +143,7 @@ for i in range(len(inputs_list)):
     inp_len = len(inputs)
 
     #Initiate simulator and load the level
-    sim = Simulator()
+    sim = Simulator(config)
     sim.load(mdata)
 
     #Execute the main physics function once per frame
@@ -83,58 +158,692 @@ for i in range(len(inputs_list)):
                 valid = True
             break
 
-    #Append to the logs for each replay.
-    goldlog.append(sim.gold_collected)
-    frameslog.append(inp_len)
-    fractionlog.append(1 - sim.ninja.fractional_frame)
-    validlog.append(valid)
-    collisionlog.append(sim.collisionlog)
-    poslog = array.array('h')
-    for xpos, ypos in zip(sim.ninja.xposlog, sim.ninja.yposlog):
-        poslog.append(pack_coord(xpos))
-        poslog.append(pack_coord(ypos))
+    return replay_result(sim, i, inp_len, valid)
+
+def replay_result(sim, i, inp_len, valid):
+    """Return the stats and logs of a replay from the current state of the simulator. The logs are
+    copied, since the simulator may go on to simulate other replays. The stats include the amount of
+    segments eliminated on its level, which is already compiled here.
+    """
+    #Gather the ninja coordinates, which are already packed, and the logged entities.
+    segments = sim.level.eliminated_segments
+    if sim.config.score_only:
+        return sim.gold_collected, inp_len, 1 - sim.ninja.fractional_frame, valid, segments, [], []
+    poslog = sim.ninja.poslog[:]
     chunks = array.array('H')
     chunks.append(0)
     chunks.append(round(len(poslog) / 2))
     entities = [(0, i, chunks, poslog)]
-    entities += [(e.type, e.index, e.exported_chunks, e.poslog) for l in sim.entity_dic.values() for e in l if e.log_positions]
-    entitylog.append(entities)
-
-            
-#Export simulation result for outte (coordinates, collisions, ...)
-if tool_mode == "trace":
-    with open(OUTPUT_TRACE, "wb") as f:
-        # Write run count, and then valid log (1 byte per run)
-        n = len(inputs_list)
-        f.write(struct.pack('B', n))
-        f.write(struct.pack(f'{n}B', *validlog))
-        for i in range(n):
-            # Entity section: Positions of logged entities, including ninja
-            entities = len(entitylog[i])
-            f.write(struct.pack('<H', entities))
-            for j in range(entities):
-                entity = entitylog[i][j]
-                id, index, chunk_count = entity[0], entity[1], round(len(entity[2]) / 2)
-                f.write(struct.pack('<BHH', id, index, chunk_count))
-                entity[2].tofile(f)
-                entity[3].tofile(f)
-            # Collision section
-            collisions = len(collisionlog[i])
-            f.write(struct.pack('<L', collisions))
-            for col in collisionlog[i]:
-                f.write(col)
-
-#For each level of the episode, write to file whether the replay is valid, then write the score split. 
-#Only ran in splits mode.
-if tool_mode == "splits":
+    entities += [(e.type, e.index, e.exported_chunks[:], e.poslog[:]) for l in sim.entity_dic.values() for e in l if e.log_positions]
+
+    return sim.gold_collected, inp_len, 1 - sim.ninja.fractional_frame, valid, segments, sim.collisionlog[:], entities
+
+def simulate_shared(jobs, config):
+    """Simulate several replays on the same map, simulating the inputs they have in common only
+    once. The replays form a tree, branching wherever their inputs diverge, which is traversed depth
+    first: the simulator state is saved at each branch, and restored to continue with each of them.
+    Yield the index and the result of each replay as soon as it's finished, which are the same as
+    simulating each replay separately.
+    """
+    sim = Simulator(config)
+    sim.load(jobs[0][1])
+    yield from simulate_branch(sim, sorted(jobs, key=lambda job: job[2]))
+
+def simulate_branch(sim, jobs):
+    """Simulate a branch of the tree of replays, which are sorted by their inputs and have the
+    same inputs up to the current frame, yielding the index and the result of each replay.
+    """
+    while True:
+        #Finish the replays whose inputs end here, the rest continue.
+        for job in jobs:
+            if len(job[2]) == sim.frame:
+                yield job[0], replay_result(sim, job[0], sim.frame, False)
+        jobs = [job for job in jobs if len(job[2]) > sim.frame]
+        if not jobs:
+            return
+
+        #Simulate the inputs that all the replays have in common (since they're sorted, the first
+        #and the last one are the most different). The replays finish if the ninja dies or wins.
+        first, last = jobs[0][2], jobs[-1][2]
+        end = min(len(first), len(last))
+        frame = sim.frame
+        while frame < end and first[frame] == last[frame]:
+            frame += 1
+        while sim.frame < frame:
+            inp = first[sim.frame]
+            sim.tick(HOR_INPUTS_DIC[inp], JUMP_INPUTS_DIC[inp])
+            if sim.ninja.state in (6, 8):
+                for job in jobs:
+                    valid = sim.ninja.state == 8 and sim.frame == len(job[2])
+                    yield job[0], replay_result(sim, job[0], len(job[2]), valid)
+                return
+        if frame < end:
+            break
+
+    #Branch out at the next input, going back to this state for each branch.
+    branches = {}
+    for job in jobs:
+        branches.setdefault(job[2][sim.frame], []).append(job)
+    state = sim.snapshot()
+    for n, branch in enumerate(branches.values()):
+        if n > 0:
+            sim.restore(state)
+        yield from simulate_branch(sim, branch)
+
+def simulate_batch(jobs, config):
+    """Simulate many replays on the same map at once with the batch simulator, and return the same
+    results as simulating each of them in score-only mode, in the same order. Return None if the
+    level isn't supported by it, or if NumPy isn't installed.
+    """
+    import nbatch #Imported here, since NumPy slows down the startup otherwise
+    stats = nbatch.simulate(jobs[0][1], [job[2] for job in jobs], config)
+    if stats is None:
+        return None
+    segments = CompiledLevel.get(jobs[0][1]).eliminated_segments #Already compiled by the batch simulator
+    return [result + (segments, [], []) for result in stats]
+
+def simulate_replays(jobs, config):
+    """Simulate a list of replays and yield their results in the same order, each one as soon as
+    it's ready. Replays on the same map are simulated together, so that the inputs they have in
+    common are only simulated once, or all at once by the batch simulator if there are many and
+    only their stats are needed.
+    """
+    positions = {job[0]: n for n, job in enumerate(jobs)}
+    groups = {}
+    for job in jobs:
+        groups.setdefault(bytes(job[1]), []).append(job)
+    def results():
+        for group in groups.values():
+            group_results = None
+            if config.score_only and len(group) >= BATCH_MIN_REPLAYS:
+                group_results = simulate_batch(group, config)
+            if group_results is not None:
+                group_results = zip([job[0] for job in group], group_results)
+            elif len(group) > 1:
+                group_results = simulate_shared(group, config)
+            else:
+                group_results = [(group[0][0], simulate_replay(group[0], config))]
+            for i, result in group_results:
+                yield positions[i], result
+    return in_order(results())
+
+def in_order(results):
+    """Yield the results given as pairs of position and result, in any order, sorted by position.
+    Each one is yielded as soon as all the ones before it have been given, and then forgotten.
+    """
+    pending = {}
+    current = 0
+    for position, result in results:
+        pending[position] = result
+        while current in pending:
+            yield pending.pop(current)
+            current += 1
+
+def simulate(mdata_list, inputs_list, config, export=None):
+    """Simulate each replay on its corresponding map with the given options (a SimConfig), and
+    return the logs of all of them.
+    The replays are spread across the worker processes if there's more than one and they're on
+    different maps, since replays on the same map are always simulated together. If an export
+    function is given, the collision and entity logs of each replay are passed to it in order, as
+    soon as the replay is finished, instead of being kept, so that they're only held for one replay.
+    """
+    logs = {"gold": [], "frames": [], "fraction": [], "valid": [], "segments": [], "collision": [], "entity": []}
+    jobs = list(zip(range(len(inputs_list)), mdata_list, inputs_list))
+    if len({bytes(mdata) for mdata in mdata_list}) < 2 or get_pool() is None:
+        results = simulate_replays(jobs, config)
+    else:
+        #Sorted by inputs, so that the replays of each map are in the same order as in a single process.
+        order = sorted(range(len(jobs)), key=lambda i: inputs_list[i])
+        keys = [bytes(mdata_list[i]) for i in order]
+        results = in_order(zip(order, run_pool(functools.partial(simulate_replays, config=config), [jobs[i] for i in order], keys)))
+
+    #Append to the logs for each replay.
+    for gold, frames, fraction, valid, segments, collisions, entities in results:
+        logs["gold"].append(gold)
+        logs["frames"].append(frames)
+        logs["fraction"].append(fraction)
+        logs["valid"].append(valid)
+        logs["segments"].append(segments)
+        if export:
+            export(collisions, entities)
+        else:
+            logs["collision"].append(collisions)
+            logs["entity"].append(entities)
+
+    return logs
+
+def init_worker(arguments):
+    """Setup of each worker process, which takes the arguments of the main one (they're not parsed
+    again). Workers run their jobs sequentially.
+    """
+    global ARGUMENTS
+    ARGUMENTS = arguments
+    ARGUMENTS.jobs = 1
+
+def get_pool():
+    """Return the pool of worker processes, or None if simulations should run in this process."""
+    global POOL
+    if ARGUMENTS.jobs == 1:
+        return None
+    if POOL is None:
+        import multiprocessing #Imported here, since it slows down the startup otherwise
+        POOL = multiprocessing.Pool(ARGUMENTS.jobs or None, init_worker, (ARGUMENTS,))
+    return POOL
+
+def run_task(func, task):
+    """Run a task in a worker process, which is a list of indexed items to apply the function to.
+    The function takes the list of items and returns the list of their results.
+    """
+    return list(zip([i for i, _ in task], func([item for _, item in task])))
+
+def run_pool(func, items, keys):
+    """Apply a function to lists of items in the worker processes, and yield the results in the
+    original order as soon as they're ready. Items with the same key (i.e. the same map) are never
+    split, but given to the same worker as a single task, so that it simulates them together.
+    Without worker processes, the tasks are run in this one, one after the other.
+    """
+    pool = get_pool()
+    groups = {}
+    for i, key in enumerate(keys):
+        groups.setdefault(key, []).append(i)
+    tasks = [[(i, items[i]) for i in group] for group in groups.values()]
+    results = {}
+    current = 0
+    for chunk in (pool.imap_unordered if pool else map)(functools.partial(run_task, func), tasks):
+        results.update(chunk)
+        while current in results:
+            yield results.pop(current)
+            current += 1
+
+def write_trace(f, mdata_list, inputs_list, config):
+    """Simulate the replays and write the simulation result for outte (coordinates, collisions, ...)
+    in binary format to a seekable file, each replay as soon as it's finished. The header holds the
+    valid flags, which are only known at the end, so it's written first with no flags set and
+    patched afterwards. Return the logs of the replays, without the collision and entity logs.
+    """
+    def export(collisions, entities):
+        section = export_replay(collisions, entities, compact)
+        if config.compress:
+            section = zlib.compress(section)
+            f.write(struct.pack('<L', len(section)))
+        f.write(section)
+
+    compact = config.compact or config.compress
+    start = f.tell()
+    f.write(export_header([False] * len(inputs_list), config))
+    logs = simulate(mdata_list, inputs_list, config, export)
+    end = f.tell()
+    f.seek(start)
+    f.write(export_header(logs["valid"], config))
+    f.seek(end)
+    return logs
+
+def export_header(validlog, config):
+    """Return the header of the trace: the version of the compact format if it's used, and then the
+    run count and the valid log (1 byte per run).
+    """
+    n = len(validlog)
+    header = struct.pack(f'{n + 1}B', n, *validlog)
+    if config.compact or config.compress:
+        header = struct.pack('3B', 0, TRACE_VERSION_COMPACT, TRACE_COMPRESSED if config.compress else 0) + header
+    return header
+
+def export_replay(collisions, entities, compact=False):
+    """Return the section of the trace of a replay, from its collision and entity logs. Its size is
+    computed first, so that it's assembled in a single buffer, which is returned. In the compact
+    format, the coordinates of each entity are delta encoded (see encode_coords) after their size.
+    """
+    if compact:
+        entities = [(id, index, chunks, encode_coords(poslog)) for id, index, chunks, poslog in entities]
+        size = 2 + sum(9 + len(chunks)*chunks.itemsize + len(coords) for _, _, chunks, coords in entities)
+    else:
+        size = 2 + sum(5 + len(chunks)*chunks.itemsize + len(poslog)*poslog.itemsize for _, _, chunks, poslog in entities)
+    size += 4 + len(collisions)
+    out = bytearray(size)
+
+    # Entity section: Positions of logged entities, including ninja
+    struct.pack_into('<H', out, 0, len(entities))
+    offset = 2
+    for id, index, chunks, poslog in entities:
+        struct.pack_into('<BHH', out, offset, id, index, round(len(chunks) / 2))
+        offset += 5
+        data = memoryview(chunks).cast('B')
+        out[offset:offset + len(data)] = data
+        offset += len(data)
+        if compact:
+            struct.pack_into('<L', out, offset, len(poslog))
+            offset += 4
+        data = memoryview(poslog).cast('B')
+        out[offset:offset + len(data)] = data
+        offset += len(data)
+    # Collision section, already packed
+    struct.pack_into('<L', out, offset, len(collisions) // COLLISION_EVENT.size)
+    offset += 4
+    out[offset:offset + len(collisions)] = collisions
+    return out
+
+def encode_coords(poslog):
+    """Return the coordinates of a position log (x and y of each frame) in the compact format. Each
+    one is stored as its difference with the same coordinate on the previous frame (0 for the
+    first one), zigzag encoded so that small negative differences are small numbers too, and then as
+    a variable length integer: 7 bits per byte, most significant first, with the top bit set on all
+    but the last byte (the same as Ruby's "w" format). Most differences take a single byte.
+    """
+    values = [(delta << 1) if delta >= 0 else (-delta << 1) - 1
+              for delta in map(operator.sub, poslog, itertools.chain((0, 0), poslog))]
+    if not values or max(values) < 0x80:
+        return bytes(values)
+    out = bytearray()
+    for value in values:
+        if value >= 0x4000:
+            out.append(value >> 14 | 0x80)
+        if value >= 0x80:
+            out.append(value >> 7 & 0x7f | 0x80)
+        out.append(value & 0x7f)
+    return out
+
+def compute_splits(logs):
+    """For each level of the episode, return whether the replay is valid and the score split."""
+    result = []
     split = 90*60
-    with open(OUTPUT_SPLITS, "w") as f:
-        for i in range(5):
-            print(validlog[i], file=f)
-            split = split - frameslog[i] + 1 + goldlog[i]*120
-            print(split, file=f)
-
-# Basic stats in the terminal
-scores = [(90 * 60 - frameslog[i] + 1 + goldlog[i] * 120) / 60 for i in range(len(inputs_list))]
-stats = { "valid": validlog, "scores": scores, "fractions": fractionlog, "frames": frameslog, "gold": goldlog }
-print(json.dumps(stats))
\ No newline at end of file
+    for i in range(5):
+        split = split - logs["frames"][i] + 1 + logs["gold"][i]*120
+        result.append((logs["valid"][i], split))
+    return result
+
+def export_splits(logs):
+    """Return the splits in text format, the validity and the split of each level in separate lines."""
+    return "".join(f"{valid}\n{split}\n" for valid, split in compute_splits(logs))
+
+def compute_stats(logs, mdata_list):
+    """Return the basic stats of each replay (validity, score, fractional frame...), and the amount
+    of tile segments eliminated by merging them on each distinct level, in order, for reference.
+    """
+    frameslog = logs["frames"]
+    goldlog = logs["gold"]
+    scores = [(90 * 60 - frameslog[i] + 1 + goldlog[i] * 120) / 60 for i in range(len(frameslog))]
+    segments = {bytes(mdata): n for mdata, n in zip(mdata_list, logs["segments"])}
+    segments = list(segments.values())
+    return { "valid": logs["valid"], "scores": scores, "fractions": logs["fraction"], "frames": frameslog, "gold": goldlog,
+             "eliminated_segments": segments }
+
+def simulator_config():
+    """Return the simulator options given in the command line."""
+    return SimConfig(ARGUMENTS.basic_sim, ARGUMENTS.full_export, ARGUMENTS.tolerance, ARGUMENTS.score_only, ARGUMENTS.seed,
+                     ARGUMENTS.compact, ARGUMENTS.compress)
+
+def trace(map_data, demos, **options):
+    """Simulate between 1 and 4 compressed demos on the given map data, and return the trace in the
+    same format as the output.bin file. The options are the same as the simulator's arguments.
+    """
+    return run_job("trace", [map_data], demos, SimConfig(**options))[1]
+
+def stats(map_data, demos, **options):
+    """Simulate between 1 and 4 compressed demos on the given map data without logging anything,
+    and return only their stats (validity, score, fractional frame...).
+    """
+    return json.loads(run_job("trace", [map_data], demos, SimConfig(**options, score_only=True))[0])
+
+def splits(maps, episode_demo, **options):
+    """Simulate a compressed episode demo on the map data of its 5 levels, and return a list with
+    whether each level replay is valid and its score split in frames.
+    """
+    inputs_list = decode_episode(episode_demo)
+    mdata_list = [[int(b) for b in mdata] for mdata in maps]
+    logs = simulate(mdata_list, inputs_list, SimConfig(**options))
+    return compute_splits(logs)
+
+def run_job(tool_mode, maps, demos, config, f=None):
+    """Simulate the raw map data and demos with the given options, and return the stats and the
+    output (trace or splits) as bytes. If a file is given, the output is written to it instead, and
+    an empty output is returned. Traces are then written one replay at a time, as they're finished,
+    unless they're cached. If the cache is enabled, results are reused when possible.
+    """
+    key = cache_key(tool_mode, maps, demos, config) if ARGUMENTS.cache else None
+    result = cache_load(key) if key else None
+    if result:
+        stats, output = result
+    else:
+        mdata_list, inputs_list = decode_job(tool_mode, maps, demos)
+        if config.score_only or tool_mode == "splits":
+            logs = simulate(mdata_list, inputs_list, config)
+            output = b"" if config.score_only else export_splits(logs).encode()
+        else:
+            #Cached traces are stored whole, so they're only written to the file at the end.
+            stream = f if f and not key else io.BytesIO()
+            logs = write_trace(stream, mdata_list, inputs_list, config)
+            output = b"" if stream is f else stream.getvalue()
+        stats = json.dumps(compute_stats(logs, mdata_list)).encode()
+        if key:
+            cache_store(key, stats, output)
+
+    if f:
+        f.write(output)
+        output = b""
+    return stats, output
+
+@functools.lru_cache(maxsize=None)
+def simulator_version():
+    """Return a hash of the simulator's source code, so that cached results expire when it changes."""
+    folder = os.path.dirname(os.path.abspath(__file__))
+    version = hashlib.sha256()
+    for filename in ("nsim.py", "ntrace.py", "nbatch.py", "nkernels.py"):
+        with open(os.path.join(folder, filename), "rb") as f:
+            version.update(f.read())
+    return version.hexdigest()
+
+def cache_key(tool_mode, maps, demos, config):
+    """Return the key of a simulation in the cache, a hash of everything that affects its result:
+    the map data, the demos, the simulator options and the simulator version.
+    """
+    key = hashlib.sha256(simulator_version().encode())
+    options = (tool_mode, config.basic_sim, config.full_export, config.tolerance, config.score_only, config.seed,
+               config.compact, config.compress)
+    key.update(repr(options).encode())
+    for blobs in (maps, demos):
+        key.update(struct.pack('<B', len(blobs)))
+        for blob in blobs:
+            key.update(struct.pack('<L', len(blob)) + blob)
+    return key.hexdigest()
+
+def cache_path(key):
+    """Return the path of a cache entry, grouped in folders by the first 2 characters of the key."""
+    return os.path.join(ARGUMENTS.cache, key[:2], key)
+
+def cache_load(key):
+    """Return the stats and output of a cached simulation, or None if it isn't cached. Reading an
+    entry marks it as recently used. Truncated entries (e.g. left by a full disk) are deleted.
+    """
+    path = cache_path(key)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+    except OSError:
+        return None
+    size = struct.unpack_from('<L', data, 0)[0] if len(data) >= 4 else None
+    if size is None or 4 + size > len(data):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    return data[4:4+size], data[4+size:]
+
+def cache_store(key, stats, output):
+    """Store the stats and output of a simulation in the cache, and evict the least recently used
+    entries if it has grown too big.
+    """
+    global CACHE_USAGE, CACHE_WRITTEN
+    path = cache_path(key)
+    data = struct.pack('<L', len(stats)) + stats + output
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "wb") as f:
+            f.write(data)
+        os.replace(temp, path)
+    except OSError:
+        return
+    CACHE_WRITTEN += len(data)
+    if CACHE_USAGE is None or CACHE_WRITTEN >= ARGUMENTS.cache_size * 1024 * 1024 * CACHE_RESCAN:
+        CACHE_USAGE = sum(size for _, size, _ in cache_entries())
+        CACHE_WRITTEN = 0
+    else:
+        CACHE_USAGE += len(data)
+    if CACHE_USAGE > ARGUMENTS.cache_size * 1024 * 1024:
+        cache_evict()
+
+def cache_entries():
+    """Return the last access time, size and path of every entry in the cache."""
+    entries = []
+    for folder, _, filenames in os.walk(ARGUMENTS.cache):
+        for filename in filenames:
+            if filename.endswith(".tmp"):
+                continue
+            path = os.path.join(folder, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+    return entries
+
+def cache_evict():
+    """Delete the least recently used entries until the cache is down to 3/4 of its maximum size."""
+    global CACHE_USAGE
+    entries = sorted(cache_entries())
+    CACHE_USAGE = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if CACHE_USAGE <= ARGUMENTS.cache_size * 1024 * 1024 * 3 / 4:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        CACHE_USAGE -= size
+
+def run_files():
+    """Default mode: read the input files from the working directory and write the output files."""
+    tool_mode, maps, demos = read_files()
+    config = simulator_config()
+
+    #Export simulation result for outte (coordinates, collisions, ...), written as it's simulated.
+    if tool_mode == "trace" and not config.score_only:
+        with open(OUTPUT_TRACE, "wb") as f:
+            stats, _ = run_job(tool_mode, maps, demos, config, f)
+    else:
+        stats, output = run_job(tool_mode, maps, demos, config)
+
+    #For each level of the episode, write to file whether the replay is valid, then write the score split.
+    #Only ran in splits mode.
+    if tool_mode == "splits" and not config.score_only:
+        with open(OUTPUT_SPLITS, "w") as f:
+            f.write(output.decode())
+
+    # Basic stats in the terminal
+    print(stats.decode())
+
+def read_exactly(f, size):
+    """Read exactly the given amount of bytes from a stream. Return None if it ends before."""
+    data = b""
+    while len(data) < size:
+        chunk = f.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+def read_frame(f):
+    """Read a length-prefixed frame from a stream. Return None on end of stream or empty frame."""
+    header = read_exactly(f, 4)
+    if not header:
+        return None
+    size = struct.unpack('<L', header)[0]
+    if size == 0:
+        return None
+    return read_exactly(f, size)
+
+def write_frame(f, payload):
+    """Write a length-prefixed frame to a stream."""
+    f.write(struct.pack('<L', len(payload)) + payload)
+    f.flush()
+
+def parse_request(payload):
+    """Parse the payload of a request in server mode. See ntrace_docs.txt for the format."""
+    tool_mode, flags, tolerance = struct.unpack_from('<BBd', payload, 0)
+    offset = 10
+    blobs = []
+    for _ in range(2):
+        count = payload[offset]
+        offset += 1
+        blobs.append([])
+        for _ in range(count):
+            size = struct.unpack_from('<L', payload, offset)[0]
+            offset += 4
+            blobs[-1].append(payload[offset:offset+size])
+            offset += size
+    maps, demos = blobs
+    return "splits" if tool_mode == 1 else "trace", flags, tolerance, maps, demos
+
+def request_config(flags, tolerance):
+    """Return the simulator options of a request in server mode."""
+    return SimConfig(bool(flags & FLAG_BASIC_SIM), bool(flags & FLAG_FULL_EXPORT), tolerance,
+                     bool(flags & FLAG_SCORE_ONLY), ARGUMENTS.seed, bool(flags & FLAG_COMPACT),
+                     bool(flags & FLAG_COMPRESS))
+
+def handle_request(payload):
+    """Run a single simulation request in server mode and return the response payload."""
+    tool_mode, flags, tolerance, maps, demos = parse_request(payload)
+    stats, output = run_job(tool_mode, maps, demos, request_config(flags, tolerance))
+    return struct.pack('<BL', 0, len(stats)) + stats + output
+
+def handle_score_requests(requests):
+    """Run several parsed score-only trace requests with the same map and flags as a single
+    simulation, so that their replays are simulated together (by the batch simulator if there are
+    enough of them), and return the response payload of each. The stats of each request are the
+    same as if it was run on its own, and cached ones are still reused.
+    """
+    _, flags, tolerance, maps, _ = requests[0]
+    config = request_config(flags, tolerance)
+    keys = [cache_key("trace", maps, demos, config) if ARGUMENTS.cache else None for _, _, _, _, demos in requests]
+    stats = [None] * len(requests)
+    for n, key in enumerate(keys):
+        result = cache_load(key) if key else None
+        if result:
+            stats[n] = result[0]
+
+    pending = [n for n in range(len(requests)) if stats[n] is None]
+    mdata_list, inputs_list = decode_job("trace", maps, [demo for n in pending for demo in requests[n][4]])
+    logs = simulate(mdata_list, inputs_list, config)
+    start = 0
+    for n in pending:
+        end = start + len(requests[n][4])
+        stats[n] = json.dumps(compute_stats({name: log[start:end] for name, log in logs.items()}, mdata_list[start:end])).encode()
+        if keys[n]:
+            cache_store(keys[n], stats[n], b"")
+        start = end
+    return [struct.pack('<BL', 0, len(result)) + result for result in stats]
+
+def serve(rfile, wfile):
+    """Answer simulation requests from a stream until it ends. Each request is answered with
+    exactly one response, even if it fails, so that the client never gets out of sync.
+    """
+    while True:
+        payload = read_frame(rfile)
+        if payload is None:
+            return
+        write_frame(wfile, answer_request(payload))
+
+def serve_parallel(rfile, wfile):
+    """Answer simulation requests from a stream until it ends, like serve, but reading several at
+    once, so that requests on the same map are answered together, and spreading them across the
+    worker processes if there are any. Responses are still written in order.
+    """
+    size = BATCH_WINDOW * (ARGUMENTS.jobs or os.cpu_count())
+    payload = read_frame(rfile)
+    key = request_key(payload) if payload is not None else None
+    while payload is not None:
+        window = []
+        keys = []
+        while payload is not None and (len(window) < size or (key == keys[-1] and len(window) < size + BATCH_RUN)):
+            window.append(payload)
+            keys.append(key)
+            payload = read_frame(rfile)
+            key = request_key(payload) if payload is not None else None
+        for response in run_pool(answer_requests, window, keys):
+            write_frame(wfile, response)
+
+def request_key(payload):
+    """Return the map data of a request, used to schedule requests of the same map together."""
+    try:
+        return b"".join(parse_request(payload)[3])
+    except Exception:
+        return None
+
+def answer_requests(payloads):
+    """Return the responses to a list of requests on the same map. Score-only trace requests with
+    the same flags are answered together if they have enough replays for the batch simulator, which
+    is much faster than answering them one by one. The rest are answered one by one.
+    """
+    groups = {}
+    for n, payload in enumerate(payloads):
+        try:
+            request = parse_request(payload)
+        except Exception:
+            continue
+        tool_mode, flags, tolerance, maps, _ = request
+        if tool_mode == "trace" and flags & FLAG_SCORE_ONLY:
+            groups.setdefault((flags, tolerance, *maps), []).append((n, request))
+
+    responses = [None] * len(payloads)
+    for group in groups.values():
+        if sum(len(request[4]) for _, request in group) < BATCH_MIN_REPLAYS:
+            continue
+        try:
+            group_responses = handle_score_requests([request for _, request in group])
+        except Exception:
+            continue #Answered one by one, so that only the failing ones get an error
+        for (n, _), response in zip(group, group_responses):
+            responses[n] = response
+    return [response or answer_request(payload) for response, payload in zip(responses, payloads)]
+
+def answer_request(payload):
+    """Return the response to a request, or an error response if it fails."""
+    try:
+        return handle_request(payload)
+    except Exception as e:
+        error = repr(e).encode()
+        return struct.pack('<BL', 1, len(error)) + error
+
+def run_server(path):
+    """Server mode: keep the simulator loaded and answer requests, either through stdin/stdout,
+    or through a Unix socket if a path is provided. Connections to the socket are served in order.
+    """
+    if path is True:
+        serve(sys.stdin.buffer, sys.stdout.buffer)
+        return
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn, conn.makefile('rb') as rfile, conn.makefile('wb') as wfile:
+                serve(rfile, wfile)
+    finally:
+        server.close()
+        os.remove(path)
+
+def run_batch(path):
+    """Batch mode: answer every request from a file, or from stdin if no path is provided, and exit.
+    The responses are written to stdout in the same order as the requests, each one as soon as it's
+    ready, so that a whole corpus of jobs only pays for the startup once.
+    """
+    if path is True:
+        serve_parallel(sys.stdin.buffer, sys.stdout.buffer)
+        return
+    with open(path, "rb") as f:
+        serve_parallel(f, sys.stdout.buffer)
+
+def run_stdin():
+    """Single request mode: read one request payload from stdin (without the length prefix), and
+    write the response payload to stdout. Same formats as in server mode, but no files are used.
+    """
+    response = answer_request(sys.stdin.buffer.read())
+    sys.stdout.buffer.write(response)
+    sys.stdout.buffer.flush()
+
+
+if __name__ == "__main__":
+    ARGUMENTS = parser.parse_args()
+    if ARGUMENTS.server:
+        run_server(ARGUMENTS.server)
+    elif ARGUMENTS.batch:
+        run_batch(ARGUMENTS.batch)
+    elif ARGUMENTS.stdin:
+        run_stdin()
+    else:
+        run_files()